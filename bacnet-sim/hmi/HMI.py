@@ -5,27 +5,82 @@ Flask web application for monitoring and controlling the treatment plant via BAC
 
 import threading
 import asyncio
+import time
+import sys
 import os
-import BAC0
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, g
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from state_stream import StateBroadcaster
+from historian import Historian, parse_query, capacity_for
+from metrics import HMIMetrics, CONTENT_TYPE
+import profiling
 
 FLASK_HOST = "0.0.0.0"
-FLASK_PORT = 8090
+FLASK_PORT = int(os.getenv("FLASK_PORT", "8090"))
 DEVICE_IP = os.getenv("DEVICE_IP", "127.0.0.1")
 DEVICE_ID = "1001"
+# Local BACnet/IP endpoint; each HMI on a host needs a port of its own
+BACNET_LOCAL_IP = os.getenv("BACNET_LOCAL_IP") or None
+BACNET_LOCAL_PORT = int(os.getenv("BACNET_LOCAL_PORT", "0")) or None
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "0.5"))
+READ_TIMEOUT = float(os.getenv("BACNET_READ_TIMEOUT", "2.0"))
+# With COV the poll only checks the cache, so it can run far less often
+COV_ENABLED = os.getenv("BACNET_COV", "1") != "0"
+COV_LIFETIME = int(os.getenv("BACNET_COV_LIFETIME", "300"))
+CONSISTENCY_INTERVAL = float(os.getenv("CONSISTENCY_INTERVAL", "30"))
+COV_RETRY = 5.0
+CONNECT_TIMEOUT = 5.0
+# A week of samples at the poll interval unless set
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY") or capacity_for(POLL_INTERVAL))
 TANK_MAX = 10000
 
+# (HMI field, object type, instance) of every presentValue polled, in request order
+POINTS = [
+    ('tankVolume', 'analogValue', 1),
+    ('inflowRate', 'analogValue', 2),
+    ('outflowRate', 'analogValue', 3),
+    ('emergencyStopStatus', 'binaryValue', 1),
+    ('pumpSwitchStatus', 'binaryValue', 2),
+    ('inflowMode', 'binaryValue', 3),
+    ('pumpStatus', 'binaryOutput', 1),
+    ('inflowValveStatus', 'binaryOutput', 2),
+    ('outflowValveStatus', 'binaryOutput', 3),
+    ('overflowed', 'binaryOutput', 4),
+    ('lowLevelAlarm', 'binaryOutput', 5),
+    ('operatorErrorAlarm', 'binaryOutput', 6),
+]
+
+
+def convert_value(obj_type, value):
+    """
+    HMI value of a presentValue, or None if the read failed
+    """
+    if value is None:
+        return None
+    if obj_type == 'analogValue':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    state = str(value)
+    if state == 'active':
+        return 1
+    if state == 'inactive':
+        return 0
+    return None
+
 
 class BACnetClient:
     def __init__(self, device_ip):
         self.device_ip = device_ip
         self.bacnet = None
+        self.connected = threading.Event()
         self.loop = None
         self.lock = threading.Lock()
-        
-        self.thread = threading.Thread(target=self._init_bacnet, daemon=True)
-        self.thread.start()
+        # Cleared if the device rejects ReadPropertyMultiple
+        self.read_multiple = True
         
         self.data = {
             'emergencyStopStatus': None,
@@ -40,76 +95,200 @@ class BACnetClient:
             'inflowRate': None,
             'outflowRate': None,
             'lowLevelAlarm': None,
-            'operatorErrorAlarm': None
+            'operatorErrorAlarm': None,
+            # Fields whose last read failed and still show the previous value
+            'stale': [field for field, _, _ in POINTS]
         }
+        self.broadcaster = StateBroadcaster(self.data)
+        self.historian = Historian(capacity=HISTORY_CAPACITY)
+        self.metrics = HMIMetrics()
+        self.read_timeouts = self.metrics.registry.counter(
+            'bacnet_read_timeouts_total', 'BACnet reads that got no answer within BACNET_READ_TIMEOUT', ('service',)
+        )
+        self.metrics.registry.gauge(
+            'hmi_stale_points', 'Points whose last read failed', function=lambda: len(self.data['stale'])
+        )
+    
+    def start(self):
+        """
+        Load BAC0 and connect on a background thread, so the web server comes
+        up without waiting for either
+        """
+        self.thread = threading.Thread(target=self._init_bacnet, daemon=True)
+        self.thread.start()
     
     def _init_bacnet(self):
         asyncio.run(self._async_init())
     
     async def _async_init(self):
+        import BAC0
+        
+        BAC0.log_level('silence')
         self.loop = asyncio.get_event_loop()
         
         while True:
             try:
                 if self.bacnet is None:
                     try:
-                        self.bacnet = BAC0.connect()
-                        await asyncio.sleep(2)
+                        self.bacnet = BAC0.connect(ip=BACNET_LOCAL_IP, port=BACNET_LOCAL_PORT)
+                        await self._wait_connected()
                     except Exception as e:
+                        print(f"BACnet connect failed: {e}")
+                        await self._disconnect()
                         await asyncio.sleep(5)
                         continue
+                    self.connected.set()
+                    if COV_ENABLED:
+                        for point in POINTS:
+                            asyncio.create_task(self._watch_point(*point))
+                    asyncio.create_task(self._record_history())
                 
                 await self._read_all()
-                await asyncio.sleep(2)
+                await asyncio.sleep(CONSISTENCY_INTERVAL if COV_ENABLED else POLL_INTERVAL)
                 
             except Exception as e:
                 print(f"Error in BACnet cycle: {e}")
                 await asyncio.sleep(2)
     
+    async def _wait_connected(self):
+        # BAC0 builds its application on the loop and flags it once it has sent its I-Am
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while not getattr(self.bacnet, '_initialized', True):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no BACnet application within {CONNECT_TIMEOUT:g}s")
+            await asyncio.sleep(0.05)
+
+    async def _disconnect(self):
+        # The port stays bound until the application is disconnected
+        bacnet, self.bacnet = self.bacnet, None
+        if bacnet is not None:
+            try:
+                await bacnet.disconnect()
+            except Exception:
+                pass
+    
     async def _read_all(self):
         if self.bacnet is None:
             return
         
         try:
-            tasks = [
-                self._read_value('analogValue', 1, 'presentValue'),
-                self._read_value('analogValue', 2, 'presentValue'),
-                self._read_value('analogValue', 3, 'presentValue'),
-                self._read_value('binaryValue', 1, 'presentValue'),
-                self._read_value('binaryValue', 2, 'presentValue'),
-                self._read_value('binaryValue', 3, 'presentValue'),
-                self._read_value('binaryOutput', 1, 'presentValue'),
-                self._read_value('binaryOutput', 2, 'presentValue'),
-                self._read_value('binaryOutput', 3, 'presentValue'),
-                self._read_value('binaryOutput', 4, 'presentValue'),
-                self._read_value('binaryOutput', 5, 'presentValue'),
-                self._read_value('binaryOutput', 6, 'presentValue'),
-            ]
+            started = time.perf_counter()
+            values = None
+            if self.read_multiple:
+                values = await self._read_multiple()
+            if values is None:
+                values = await asyncio.gather(
+                    *(self._read_value(obj_type, instance, 'presentValue') for _, obj_type, instance in POINTS)
+                )
             
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            data = dict(self.data)
+            stale = []
+            for (field, obj_type, _), value in zip(POINTS, values):
+                value = convert_value(obj_type, value)
+                if value is None:
+                    stale.append(field)
+                else:
+                    data[field] = value
+            data['stale'] = stale
+            if len(stale) < len(POINTS):
+                self.metrics.polled(time.perf_counter() - started)
+            else:
+                self.metrics.poll_errors.inc()
             
-            self.data['tankVolume'] = int(results[0]) if results[0] is not None else 0
-            self.data['inflowRate'] = int(results[1]) if results[1] is not None else 0
-            self.data['outflowRate'] = int(results[2]) if results[2] is not None else 0
-            self.data['emergencyStopStatus'] = 1 if str(results[3]) == 'active' else 0
-            self.data['pumpSwitchStatus'] = 1 if str(results[4]) == 'active' else 0
-            self.data['inflowMode'] = 1 if str(results[5]) == 'active' else 0
-            self.data['pumpStatus'] = 1 if str(results[6]) == 'active' else 0
-            self.data['inflowValveStatus'] = 1 if str(results[7]) == 'active' else 0
-            self.data['outflowValveStatus'] = 1 if str(results[8]) == 'active' else 0
-            self.data['overflowed'] = 1 if str(results[9]) == 'active' else 0
-            self.data['lowLevelAlarm'] = 1 if str(results[10]) == 'active' else 0
-            self.data['operatorErrorAlarm'] = 1 if str(results[11]) == 'active' else 0
+            self.data = data
+            self.broadcaster.publish(data)
             
         except Exception as e:
             print(f"Error reading BACnet data: {e}")
     
+    async def _watch_point(self, field, obj_type, instance):
+        """
+        Keep a COV subscription on one object and update the cache from its
+        notifications. bacpypes3 renews the subscription before its lifetime
+        runs out; if a renewal fails the subscription is made again.
+        """
+        from bacpypes3.apdu import ErrorRejectAbortNack
+        from bacpypes3.basetypes import PropertyIdentifier
+        from bacpypes3.pdu import Address
+        from bacpypes3.primitivedata import ObjectIdentifier
+        
+        app = self.bacnet.this_application.app
+        object_id = ObjectIdentifier(f"{obj_type},{instance}")
+        while True:
+            try:
+                async with app.change_of_value(
+                    Address(self.device_ip), object_id,
+                    issue_confirmed_notifications=False, lifetime=COV_LIFETIME
+                ) as subscription:
+                    while True:
+                        try:
+                            prop, value = await asyncio.wait_for(subscription.get_value(), COV_LIFETIME)
+                        except asyncio.TimeoutError:
+                            prop = None
+                        renewal = subscription.refresh_subscription_task
+                        if renewal is not None and renewal.done() and renewal.exception() is not None:
+                            raise renewal.exception()
+                        if prop == PropertyIdentifier.presentValue:
+                            self._update_point(field, obj_type, value)
+            except (Exception, ErrorRejectAbortNack) as e:
+                print(f"COV subscription to {obj_type} {instance} failed: {e}")
+                await asyncio.sleep(COV_RETRY)
+    
+    async def _record_history(self):
+        # COV updates arrive at any time, so history samples the cache on a fixed interval
+        while True:
+            self.historian.record(self.data)
+            await asyncio.sleep(POLL_INTERVAL)
+    
+    def _update_point(self, field, obj_type, value):
+        value = convert_value(obj_type, value)
+        if value is None:
+            return
+        data = dict(self.data)
+        data[field] = value
+        data['stale'] = [name for name in data['stale'] if name != field]
+        self.metrics.updated()
+        self.data = data
+        self.broadcaster.publish(data)
+    
+    async def _read_multiple(self):
+        """
+        Read every point with one ReadPropertyMultiple. Returns None if the
+        device does not support it, so the caller falls back to ReadProperty.
+        """
+        from BAC0.core.io.IOExceptions import SegmentationNotSupported, UnrecognizedService
+        from bacpypes3.apdu import ErrorRejectAbortNack
+        
+        args = " ".join(f"{obj_type}:{instance} presentValue" for _, obj_type, instance in POINTS)
+        try:
+            values = await asyncio.wait_for(
+                self.bacnet.readMultiple(f"{self.device_ip} {args}"), timeout=READ_TIMEOUT
+            )
+        except (UnrecognizedService, SegmentationNotSupported):
+            print("Device rejected ReadPropertyMultiple, reading objects one at a time")
+            self.read_multiple = False
+            return None
+        except asyncio.TimeoutError:
+            self.read_timeouts.inc('ReadPropertyMultiple')
+            print(f"ReadPropertyMultiple timed out after {READ_TIMEOUT}s")
+            return [None] * len(POINTS)
+        except (Exception, ErrorRejectAbortNack) as e:
+            print(f"Error in ReadPropertyMultiple: {e}")
+            return [None] * len(POINTS)
+        
+        if len(values) != len(POINTS):
+            return [None] * len(POINTS)
+        return values
+    
     async def _read_value(self, obj_type, instance, prop):
         try:
             command = f'{self.device_ip} {obj_type} {instance} {prop}'
             task = asyncio.create_task(self.bacnet.read(command))
-            value = await asyncio.wait_for(task, timeout=10.0)
+            value = await asyncio.wait_for(task, timeout=READ_TIMEOUT)
             return value
+        except asyncio.TimeoutError:
+            self.read_timeouts.inc('ReadProperty')
+            return None
         except Exception:
             return None
     
@@ -123,9 +302,7 @@ class BACnetClient:
             return False
     
     def write_data(self, control, value):
-        print(f"Command: {control}={value}")
-        
-        if self.bacnet is None or self.loop is None:
+        if not self.connected.is_set():
             return jsonify({"error": "BACnet not connected"}), 503
         
         try:
@@ -173,7 +350,6 @@ class BACnetClient:
                 success = future.result(timeout=5.0)
             
             if success:
-                print("Command sent")
                 return jsonify({"success": "Command sent"}), 200
             else:
                 return jsonify({"error": "Write failed"}), 500
@@ -195,6 +371,17 @@ app = Flask(__name__)
 bacnet_client = BACnetClient(DEVICE_IP)
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    bacnet_client.metrics.request_done(request.path, time.perf_counter() - g.request_started)
+    return response
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -202,21 +389,42 @@ def index():
 
 @app.route('/update', methods=['GET'])
 def update():
-    return jsonify({
-        'tankVolume': bacnet_client.data['tankVolume'],
-        'inflowRate': bacnet_client.data['inflowRate'],
-        'outflowRate': bacnet_client.data['outflowRate'],
-        'pumpSwitchStatus': bacnet_client.data['pumpSwitchStatus'],
-        'emergencyStopStatus': bacnet_client.data['emergencyStopStatus'],
-        'inflowValveStatus': bacnet_client.data['inflowValveStatus'],
-        'outflowValveStatus': bacnet_client.data['outflowValveStatus'],
-        'inflowMode': bacnet_client.data['inflowMode'],
-        'overflowed': bacnet_client.data['overflowed'],
-        'maxVolume': bacnet_client.data['maxVolume'],
-        'lowLevelAlarm': bacnet_client.data['lowLevelAlarm'],
-        'operatorErrorAlarm': bacnet_client.data['operatorErrorAlarm'],
-        'pumpStatus': bacnet_client.data['pumpStatus']
-    })
+    snapshot = bacnet_client.broadcaster.snapshot
+    response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/ready')
+def ready():
+    # For readiness probes: /update answers before BACnet is connected
+    if not bacnet_client.connected.is_set():
+        return jsonify({"error": "BACnet not connected"}), 503
+    return jsonify({"ready": True})
+
+
+@app.route('/stream')
+def stream():
+    return Response(
+        bacnet_client.broadcaster.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/history')
+def history():
+    try:
+        query = parse_query(request.args, bacnet_client.historian.tags)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(bacnet_client.historian.query(**query))
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(bacnet_client.metrics.registry.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/write', methods=['POST'])
@@ -242,6 +450,11 @@ def write():
         return jsonify({"error": "Invalid control"}), 400
 
 
+profiler = profiling.from_env("bacnet-hmi")
+if profiler:
+    profiling.wrap_views(app, profiler)
+
+
 if __name__ == '__main__':
-    BAC0.log_level('silence')
+    bacnet_client.start()
     app.run(host=FLASK_HOST, port=FLASK_PORT)
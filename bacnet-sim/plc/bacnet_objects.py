@@ -0,0 +1,159 @@
+"""
+Aloha Water Treatment Plant BACnet Objects
+The plant's BACnet device description and objects, shared by the BACnet and
+dual-stack PLCs
+"""
+
+from BAC0.core.devices.local.factory import (
+    analog_value, binary_value, binary_output
+)
+
+BACNET_DEVICE_ID = 1001
+# Smallest change that triggers a COV notification to subscribers
+TANK_LEVEL_COV_INCREMENT = 10.0
+FLOW_COV_INCREMENT = 1.0
+
+
+def describe_device(bacnet):
+    bacnet.this_application.objectName = "AlohaWaterTreatment"
+    bacnet.this_application.vendorName = "Aloha Water Treatment"
+    bacnet.this_application.modelName = "ATC-100"
+    bacnet.this_application.firmwareRevision = "1.0.0"
+    bacnet.this_application.description = "Water Treatment Plant Controller"
+
+
+def create_bacnet_objects():
+    """
+    Create the plant's BACnet objects and return their factories and a
+    name -> object mapping for the control logic
+    """
+    tank_level = analog_value(
+        name="TankLevel",
+        instance=1,
+        description="Treatment tank water level",
+        presentValue=0,
+        is_commandable=False,
+        properties={"covIncrement": TANK_LEVEL_COV_INCREMENT}
+    )
+    
+    inflow_rate = analog_value(
+        name="InflowRate",
+        instance=2,
+        description="Inlet flow rate",
+        presentValue=0,
+        is_commandable=True,
+        properties={"covIncrement": FLOW_COV_INCREMENT}
+    )
+    
+    outflow_rate = analog_value(
+        name="OutflowRate",
+        instance=3,
+        description="Outlet flow rate",
+        presentValue=0,
+        is_commandable=True,
+        properties={"covIncrement": FLOW_COV_INCREMENT}
+    )
+    
+    emergency_stop = binary_value(
+        name="EmergencyStop",
+        instance=1,
+        description="Emergency stop button",
+        presentValue=False,
+        is_commandable=True
+    )
+    
+    pump_switch = binary_value(
+        name="PumpSwitch",
+        instance=2,
+        description="Main pump switch",
+        presentValue=False,
+        is_commandable=True
+    )
+    
+    auto_mode = binary_value(
+        name="AutoMode",
+        instance=3,
+        description="Auto/Manual mode (False=Auto, True=Manual)",
+        presentValue=False,
+        is_commandable=True
+    )
+    
+    pump_status = binary_output(
+        name="PumpStatus",
+        instance=1,
+        description="Pump operational state",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    inflow_valve = binary_output(
+        name="InflowValve",
+        instance=2,
+        description="Inlet valve state",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    outflow_valve = binary_output(
+        name="OutflowValve",
+        instance=3,
+        description="Outlet valve state",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    overflow_alarm = binary_output(
+        name="OverflowAlarm",
+        instance=4,
+        description="High level alarm",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    low_level_alarm = binary_output(
+        name="LowLevelAlarm",
+        instance=5,
+        description="Low level alarm",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    operator_error_alarm = binary_output(
+        name="OperatorErrorAlarm",
+        instance=6,
+        description="Operator error / safety violation",
+        presentValue=False,
+        is_commandable=False
+    )
+    
+    factories = [
+        tank_level,
+        inflow_rate,
+        outflow_rate,
+        emergency_stop,
+        pump_switch,
+        auto_mode,
+        pump_status,
+        inflow_valve,
+        outflow_valve,
+        overflow_alarm,
+        low_level_alarm,
+        operator_error_alarm
+    ]
+    
+    bacnet_objects = {
+        'tankLevel': tank_level.objects["TankLevel"],
+        'inflowRate': inflow_rate.objects["InflowRate"],
+        'outflowRate': outflow_rate.objects["OutflowRate"],
+        'emergencyStop': emergency_stop.objects["EmergencyStop"],
+        'pumpSwitch': pump_switch.objects["PumpSwitch"],
+        'autoMode': auto_mode.objects["AutoMode"],
+        'pumpStatus': pump_status.objects["PumpStatus"],
+        'inflowValve': inflow_valve.objects["InflowValve"],
+        'outflowValve': outflow_valve.objects["OutflowValve"],
+        'overflowAlarm': overflow_alarm.objects["OverflowAlarm"],
+        'lowLevelAlarm': low_level_alarm.objects["LowLevelAlarm"],
+        'operatorErrorAlarm': operator_error_alarm.objects["OperatorErrorAlarm"]
+    }
+    
+    return factories, bacnet_objects
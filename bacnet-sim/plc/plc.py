@@ -6,16 +6,25 @@ BACnet server for water treatment process control
 
 import asyncio
 import signal
+import time
+import sys
 import os
 import BAC0
-from BAC0.core.devices.local.factory import (
-    analog_value, binary_value, binary_output
-)
+from bacnet_objects import BACNET_DEVICE_ID, create_bacnet_objects, describe_device
 from plc_logic import plc_logic
+from shadow_state import ShadowState
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from plant_engine import PlantEngine
+from history_store import HistoryWriter
+from metrics import Registry, serve
+import profiling
 
-BACNET_DEVICE_ID = 1001
 BACNET_IP = os.getenv("BACNET_IP", "127.0.0.1/24")
 TANK_MAX = 10000
+HISTORY_DIR = os.getenv("HISTORY_DIR")
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 is_active = True
 
@@ -40,142 +49,44 @@ async def run_bacnet_plc():
             deviceId=BACNET_DEVICE_ID
         )
         
-        bacnet.this_application.objectName = "AlohaWaterTreatment"
-        bacnet.this_application.vendorName = "Aloha Water Treatment"
-        bacnet.this_application.modelName = "ATC-100"
-        bacnet.this_application.firmwareRevision = "1.0.0"
-        bacnet.this_application.description = "Water Treatment Plant Controller"
-        
-        tank_level = analog_value(
-            name="TankLevel",
-            instance=1,
-            description="Treatment tank water level",
-            presentValue=0,
-            is_commandable=False
-        )
-        
-        inflow_rate = analog_value(
-            name="InflowRate",
-            instance=2,
-            description="Inlet flow rate",
-            presentValue=0,
-            is_commandable=True
-        )
-        
-        outflow_rate = analog_value(
-            name="OutflowRate",
-            instance=3,
-            description="Outlet flow rate",
-            presentValue=0,
-            is_commandable=True
-        )
-        
-        emergency_stop = binary_value(
-            name="EmergencyStop",
-            instance=1,
-            description="Emergency stop button",
-            presentValue=False,
-            is_commandable=True
-        )
-        
-        pump_switch = binary_value(
-            name="PumpSwitch",
-            instance=2,
-            description="Main pump switch",
-            presentValue=False,
-            is_commandable=True
-        )
-        
-        auto_mode = binary_value(
-            name="AutoMode",
-            instance=3,
-            description="Auto/Manual mode (False=Auto, True=Manual)",
-            presentValue=False,
-            is_commandable=True
-        )
-        
-        pump_status = binary_output(
-            name="PumpStatus",
-            instance=1,
-            description="Pump operational state",
-            presentValue=False,
-            is_commandable=False
-        )
-        
-        inflow_valve = binary_output(
-            name="InflowValve",
-            instance=2,
-            description="Inlet valve state",
-            presentValue=False,
-            is_commandable=False
-        )
+        describe_device(bacnet)
         
-        outflow_valve = binary_output(
-            name="OutflowValve",
-            instance=3,
-            description="Outlet valve state",
-            presentValue=False,
-            is_commandable=False
-        )
-        
-        overflow_alarm = binary_output(
-            name="OverflowAlarm",
-            instance=4,
-            description="High level alarm",
-            presentValue=False,
-            is_commandable=False
-        )
+        factories, bacnet_objects = create_bacnet_objects()
+        for factory in factories:
+            factory.add_objects_to_application(bacnet)
         
-        low_level_alarm = binary_output(
-            name="LowLevelAlarm",
-            instance=5,
-            description="Low level alarm",
-            presentValue=False,
-            is_commandable=False
-        )
+        print(f"PLC running on BACnet device {BACNET_DEVICE_ID} at {BACNET_IP}")
+        print("Water Treatment Plant Control System Ready")
         
-        operator_error_alarm = binary_output(
-            name="OperatorErrorAlarm",
-            instance=6,
-            description="Operator error / safety violation",
-            presentValue=False,
-            is_commandable=False
-        )
+        engine = PlantEngine(1)
+        shadow = ShadowState(bacnet_objects)
+        history = HistoryWriter(HISTORY_DIR, 1) if HISTORY_DIR else None
+        if history:
+            print(f"Recording history to {HISTORY_DIR} ({history.scans} scans on disk)")
         
-        tank_level.add_objects_to_application(bacnet)
-        inflow_rate.add_objects_to_application(bacnet)
-        outflow_rate.add_objects_to_application(bacnet)
-        emergency_stop.add_objects_to_application(bacnet)
-        pump_switch.add_objects_to_application(bacnet)
-        auto_mode.add_objects_to_application(bacnet)
-        pump_status.add_objects_to_application(bacnet)
-        inflow_valve.add_objects_to_application(bacnet)
-        outflow_valve.add_objects_to_application(bacnet)
-        overflow_alarm.add_objects_to_application(bacnet)
-        low_level_alarm.add_objects_to_application(bacnet)
-        operator_error_alarm.add_objects_to_application(bacnet)
+        if METRICS_PORT:
+            metrics = Registry()
+            scans = metrics.counter('plc_scans_total', 'PLC scans run')
+            scan_duration = metrics.histogram('plc_scan_duration_seconds', 'Scan execution time')
+            serve(metrics, METRICS_HOST, METRICS_PORT)
+            print(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
         
-        bacnet_objects = {
-            'tankLevel': tank_level.objects["TankLevel"],
-            'inflowRate': inflow_rate.objects["InflowRate"],
-            'outflowRate': outflow_rate.objects["OutflowRate"],
-            'emergencyStop': emergency_stop.objects["EmergencyStop"],
-            'pumpSwitch': pump_switch.objects["PumpSwitch"],
-            'autoMode': auto_mode.objects["AutoMode"],
-            'pumpStatus': pump_status.objects["PumpStatus"],
-            'inflowValve': inflow_valve.objects["InflowValve"],
-            'outflowValve': outflow_valve.objects["OutflowValve"],
-            'overflowAlarm': overflow_alarm.objects["OverflowAlarm"],
-            'lowLevelAlarm': low_level_alarm.objects["LowLevelAlarm"],
-            'operatorErrorAlarm': operator_error_alarm.objects["OperatorErrorAlarm"]
-        }
+        def scan():
+            plc_logic(shadow, engine)
+            if history:
+                history.append(time.time(), engine)
         
-        print(f"PLC running on BACnet device {BACNET_DEVICE_ID} at {BACNET_IP}")
-        print("Water Treatment Plant Control System Ready")
+        profiler = profiling.from_env("bacnet-plc")
+        if profiler:
+            scan = profiler.wrap(scan)
         
         while is_active:
             try:
-                plc_logic(bacnet_objects)
+                started = time.perf_counter()
+                scan()
+                if METRICS_PORT:
+                    scan_duration.observe(time.perf_counter() - started)
+                    scans.inc()
                 
                 await asyncio.sleep(1)
                 
@@ -184,6 +95,8 @@ async def run_bacnet_plc():
                 await asyncio.sleep(1)
         
         print("Stopping BACnet server...")
+        if history:
+            history.close()
         bacnet.disconnect()
         
     except asyncio.CancelledError:
@@ -0,0 +1,61 @@
+"""
+Aloha Water Treatment Plant Shadow State
+Plain copy of the BACnet presentValues that the control logic works on each tick
+"""
+
+from functools import partial
+from importlib import metadata
+
+
+def plain(value):
+    """
+    Python value of a presentValue: float for Real, int for enumerations
+    such as BinaryPV
+    """
+    return float(value) if isinstance(value, float) else int(value)
+
+
+def monitor_property(obj, prop, callback):
+    """
+    Have obj call callback(old_value, new_value) whenever prop changes.
+    bacpypes3 offers no public hook for this, so it goes through the same
+    internal property monitors its COV detection uses. The bacpypes3 version
+    is pinned in requirements.txt; if the monitors are gone, this raises
+    rather than leaving the shadow state silently stale.
+    """
+    monitors = getattr(obj, '_property_monitors', None)
+    if not isinstance(monitors, dict):
+        raise RuntimeError(
+            f"bacpypes3 {metadata.version('bacpypes3')} has no property monitors on "
+            f"{type(obj).__name__}; install the version pinned in requirements.txt"
+        )
+    monitors.setdefault(prop, []).append(callback)
+
+
+class ShadowState:
+    """
+    Name -> value mapping over the plant's BACnet objects. Each object's
+    presentValue is read once at start; after that a property monitor copies
+    in every change, including writes from BACnet clients, so a tick reads
+    nothing through the object machinery. Assigning a value writes it to the
+    object only if it differs from the current presentValue.
+    """
+
+    def __init__(self, bacnet_objects):
+        self.objects = bacnet_objects
+        self.values = {}
+        for key, obj in bacnet_objects.items():
+            self.values[key] = plain(obj.presentValue)
+            monitor_property(obj, 'presentValue', partial(self._changed, key))
+
+    def _changed(self, key, old_value, new_value):
+        self.values[key] = plain(new_value)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        # The monitor records the resulting presentValue, which for a
+        # commandable object may still be a higher priority client write
+        if self.values[key] != value:
+            self.objects[key].presentValue = value
@@ -0,0 +1,97 @@
+"""
+Aloha Water Treatment Plant Benchmarks
+HMI /update and /write latency for the Modbus and BACnet HMI apps
+"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+
+from bench_util import (
+    MODBUS_PLC_DIR, MODBUS_HMI_DIR, BACNET_HMI_DIR,
+    free_port, wait_for_port, wait_for_http, start_component, stop_component, summarize_latencies
+)
+
+
+def request_latencies(url, count, body=None):
+    latencies = []
+    errors = 0
+    data = json.dumps(body).encode() if body is not None else None
+    started = time.perf_counter()
+    for _ in range(count):
+        request = urllib.request.Request(url, data=data, headers={'Content-Type': "application/json"})
+        sent = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            errors += 1
+            continue
+        except OSError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - sent)
+    return summarize_latencies(latencies, time.perf_counter() - started, errors)
+
+
+def bench_app(base_url, count, write):
+    results = {'update': request_latencies(f"{base_url}/update", count)}
+    if write:
+        results['write'] = request_latencies(
+            f"{base_url}/write", count, {'control': "pumpSwitch", 'value': 1}
+        )
+    return results
+
+
+def bench_modbus_hmi(count):
+    plc_port = free_port()
+    http_port = free_port()
+    plc = start_component(MODBUS_PLC_DIR, {'MODBUS_HOST': "127.0.0.1", 'MODBUS_PORT': plc_port})
+    hmi = None
+    try:
+        if not wait_for_port(plc_port):
+            return {'error': "Modbus PLC did not start"}
+        hmi = start_component(MODBUS_HMI_DIR, {
+            'MODBUS_HOST': "127.0.0.1",
+            'MODBUS_PORT': plc_port,
+            'FLASK_PORT': http_port,
+        })
+        base_url = f"http://127.0.0.1:{http_port}"
+        if not wait_for_http(base_url + "/update"):
+            return {'error': "Modbus HMI did not start"}
+        return bench_app(base_url, count, write=True)
+    finally:
+        if hmi is not None:
+            stop_component(hmi)
+        stop_component(plc)
+
+
+def bench_bacnet_hmi(count, device_ip=None):
+    """
+    A BACnet PLC cannot share a host with the HMI, so /write is only measured
+    when device_ip points at a PLC running elsewhere
+    """
+    http_port = free_port()
+    hmi = start_component(BACNET_HMI_DIR, {
+        'DEVICE_IP': device_ip or "127.0.0.1",
+        'FLASK_PORT': http_port,
+    })
+    try:
+        base_url = f"http://127.0.0.1:{http_port}"
+        if not wait_for_http(base_url + "/update"):
+            return {'error': "BACnet HMI did not start"}
+        results = bench_app(base_url, count, write=device_ip is not None)
+        if device_ip is None:
+            results['write'] = {'skipped': "no BACnet PLC given, pass --bacnet-device-ip"}
+        return results
+    finally:
+        stop_component(hmi)
+
+
+def run(count=500, bacnet_device_ip=None):
+    return {
+        'modbus': bench_modbus_hmi(count),
+        'bacnet': bench_bacnet_hmi(count, bacnet_device_ip),
+    }
@@ -0,0 +1,75 @@
+"""
+Aloha Water Treatment Plant Benchmarks
+Modbus server throughput and latency against the PLC's StartTcpServer
+"""
+
+import asyncio
+import time
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from bench_util import MODBUS_PLC_DIR, free_port, wait_for_port, start_component, stop_component, summarize_latencies
+
+HR_IN_FLOW = 6
+REGISTER_COUNT = 10
+
+
+async def client_loop(client, operation, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if operation == "read":
+                response = await client.read_holding_registers(0, count=REGISTER_COUNT)
+            else:
+                response = await client.write_register(HR_IN_FLOW, 50)
+            if response.isError():
+                errors[0] += 1
+                continue
+        except Exception:
+            errors[0] += 1
+            await asyncio.sleep(0.01)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_phase(port, clients, operation, duration):
+    connections = [AsyncModbusTcpClient("127.0.0.1", port=port, timeout=5, retries=0) for _ in range(clients)]
+    await asyncio.gather(*(client.connect() for client in connections))
+    connected = [client for client in connections if client.connected]
+
+    latencies = []
+    errors = [0]
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client_loop(client, operation, deadline, latencies, errors) for client in connected))
+    elapsed = time.perf_counter() - started
+
+    for client in connections:
+        client.close()
+
+    summary = summarize_latencies(latencies, elapsed, errors[0])
+    summary['clients'] = clients
+    summary['connected'] = len(connected)
+    return summary
+
+
+def run(client_counts=(1, 10, 100, 500), duration=3.0, scan_period_ms=100):
+    port = free_port()
+    plc = start_component(MODBUS_PLC_DIR, {
+        'MODBUS_HOST': "127.0.0.1",
+        'MODBUS_PORT': port,
+        'SCAN_PERIOD_MS': scan_period_ms,
+    })
+    try:
+        if not wait_for_port(port):
+            return {'error': "Modbus PLC did not start"}
+
+        results = {'scan_period_ms': scan_period_ms}
+        for operation in ("read", "write"):
+            for clients in client_counts:
+                results[f"{operation}_clients_{clients}"] = asyncio.run(
+                    run_phase(port, clients, operation, duration)
+                )
+        return results
+    finally:
+        stop_component(plc)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant Benchmarks
+PLC scan cost: plc_logic ticks per second for the Modbus and BACnet PLCs
+
+Each protocol runs in its own process because both PLC directories define
+modules named plc and plc_logic.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from bench_util import MODBUS_PLC_DIR, BACNET_PLC_DIR, COMMON_DIR
+
+
+def measure(tick, duration):
+    ticks = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            tick()
+        ticks += 100
+    elapsed = time.perf_counter() - started
+    return {
+        'ticks': ticks,
+        'elapsed_s': round(elapsed, 3),
+        'ticks_per_s': round(ticks / elapsed, 1),
+        'us_per_tick': round(elapsed / ticks * 1e6, 3),
+    }
+
+
+def bench_modbus(duration, plants):
+    sys.path.insert(0, COMMON_DIR)
+    sys.path.insert(0, MODBUS_PLC_DIR)
+    from plc import setup_modbus_server, UNIT_ID_MAX
+    from plc_logic import plc_logic
+    from plant_engine import PlantEngine
+
+    results = {}
+    for count in plants:
+        # setup_modbus_server caps a context at UNIT_ID_MAX plants, so larger
+        # fleets are built in batches
+        images = []
+        while len(images) < count:
+            _, _, batch = setup_modbus_server(min(UNIT_ID_MAX, count - len(images)))
+            images.extend(plant.image for plant in batch)
+        for image in images:
+            image.holding_registers.block.setValues(3, [1])
+            image.coils.block.setValues(2, [True])
+        engine = PlantEngine(count)
+
+        def tick():
+            for image in images:
+                image.load()
+            plc_logic(images, engine, dt=0.1)
+            for image in images:
+                image.flush()
+
+        result = measure(tick, duration)
+        result['plant_ticks_per_s'] = round(result['ticks_per_s'] * count, 1)
+        results[f"plants_{count}"] = result
+    return results
+
+
+def bench_bacnet(duration):
+    sys.path.insert(0, COMMON_DIR)
+    sys.path.insert(0, BACNET_PLC_DIR)
+    import BAC0
+    from plc import create_bacnet_objects
+    from plc_logic import plc_logic
+    from plant_engine import PlantEngine
+    from shadow_state import ShadowState
+
+    BAC0.log_level('silence')
+    _, bacnet_objects = create_bacnet_objects()
+    shadow = ShadowState(bacnet_objects)
+    bacnet_objects['pumpSwitch'].presentValue = True
+    engine = PlantEngine(1)
+
+    return {'plants_1': measure(lambda: plc_logic(shadow, engine), duration)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure plc_logic ticks per second")
+    parser.add_argument("protocol", choices=("modbus", "bacnet"))
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per measurement")
+    parser.add_argument("--plants", type=int, nargs="+", default=[1, 100], help="Modbus fleet sizes")
+    args = parser.parse_args()
+
+    if args.protocol == "modbus":
+        results = bench_modbus(args.duration, args.plants)
+    else:
+        results = bench_bacnet(args.duration)
+    json.dump(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant Benchmarks
+Startup cost: wall time from spawn until each component answers its readiness
+check, and its resident memory at that moment
+
+The HMIs are started without a PLC, so they measure their own startup; the
+BACnet PLC binds 127.0.0.1 and needs UDP port 47808 free.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from bench_util import (
+    MODBUS_PLC_DIR, MODBUS_HMI_DIR, BACNET_PLC_DIR, BACNET_HMI_DIR, COMMON_DIR,
+    free_port, start_component, stop_component
+)
+
+sys.path.insert(0, COMMON_DIR)
+from launcher import port_ready, http_ready, bacnet_ready, wait_for
+
+READY_TIMEOUT = 30.0
+# Fine enough not to round the startup times measured
+PROBE_INTERVAL = 0.01
+BACNET_DEVICE_ID = 1001
+COMPONENTS = ("modbus_plc", "bacnet_plc", "modbus_hmi", "modbus_hmi_async", "bacnet_hmi")
+
+
+def component_spec(name):
+    """
+    (script directory, script, environment, readiness probe) of a component
+    """
+    if name == "modbus_plc":
+        port = free_port()
+        return MODBUS_PLC_DIR, "plc.py", {'MODBUS_HOST': "127.0.0.1", 'MODBUS_PORT': port}, \
+            port_ready("127.0.0.1", port)
+    if name == "bacnet_plc":
+        return BACNET_PLC_DIR, "plc.py", {'BACNET_IP': "127.0.0.1/24"}, \
+            bacnet_ready("127.0.0.1", BACNET_DEVICE_ID, timeout=PROBE_INTERVAL)
+    http_port = free_port()
+    probe = http_ready(f"http://127.0.0.1:{http_port}/update")
+    if name == "bacnet_hmi":
+        return BACNET_HMI_DIR, "HMI.py", {'DEVICE_IP': "127.0.0.1", 'FLASK_PORT': http_port}, probe
+    script = "HMI_async.py" if name == "modbus_hmi_async" else "HMI.py"
+    env = {'MODBUS_HOST': "127.0.0.1", 'MODBUS_PORT': free_port(), 'FLASK_PORT': http_port}
+    return MODBUS_HMI_DIR, script, env, probe
+
+
+def rss_mb(pid):
+    # Linux only; elsewhere memory is not reported
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+
+def measure(name):
+    script_dir, script, env, probe = component_spec(name)
+    started = time.perf_counter()
+    process = start_component(script_dir, env, script)
+    try:
+        if not wait_for(probe, READY_TIMEOUT, process, PROBE_INTERVAL):
+            return None
+        ready = time.perf_counter() - started
+        return {'ready_s': ready, 'rss_mb': rss_mb(process.pid)}
+    finally:
+        stop_component(process)
+
+
+def bench_component(name, runs):
+    samples = []
+    for _ in range(runs):
+        sample = measure(name)
+        if sample is None:
+            return {'error': f"{name} did not become ready within {READY_TIMEOUT:g}s"}
+        samples.append(sample)
+    times = [sample['ready_s'] for sample in samples]
+    memory = [sample['rss_mb'] for sample in samples if sample['rss_mb'] is not None]
+    return {
+        'runs': runs,
+        'ready_ms_median': round(statistics.median(times) * 1000.0, 1),
+        'ready_ms_min': round(min(times) * 1000.0, 1),
+        'ready_ms_max': round(max(times) * 1000.0, 1),
+        'rss_mb_median': statistics.median(memory) if memory else None,
+    }
+
+
+def run(runs=5, components=COMPONENTS):
+    return {name: bench_component(name, runs) for name in components}
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Components whose median ready time or memory grew by more than tolerance
+    (a fraction) over baseline
+    """
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or 'error' in before or 'error' in result:
+            continue
+        for key in ('ready_ms_median', 'rss_mb_median'):
+            if before.get(key) and result.get(key) and result[key] > before[key] * (1 + tolerance):
+                found.append(f"{name} {key} {before[key]} -> {result[key]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure PLC and HMI startup time and memory")
+    parser.add_argument("components", nargs="*", help=f"any of {', '.join(COMPONENTS)} (default all)")
+    parser.add_argument("--runs", type=int, default=5, help="starts per component")
+    parser.add_argument("--baseline", help="earlier results (this tool's or run_benchmarks.py's JSON) to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth over the baseline, as a fraction")
+    args = parser.parse_args()
+    unknown = set(args.components) - set(COMPONENTS)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+
+    results = run(args.runs, args.components or COMPONENTS)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        baseline = baseline.get('results', {}).get('startup', baseline)
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f"Regression: {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Aloha Water Treatment Plant Benchmarks
+Shared helpers for starting components and summarising latencies
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MODBUS_PLC_DIR = os.path.join(ROOT, "modbus-sim", "plc")
+MODBUS_HMI_DIR = os.path.join(ROOT, "modbus-sim", "hmi")
+BACNET_PLC_DIR = os.path.join(ROOT, "bacnet-sim", "plc")
+BACNET_HMI_DIR = os.path.join(ROOT, "bacnet-sim", "hmi")
+COMMON_DIR = os.path.join(ROOT, "common")
+
+READY_TIMEOUT = 15.0
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, host="127.0.0.1", timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def wait_for_http(url, timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1.0) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def start_component(script_dir, env_overrides, script=None):
+    env = os.environ.copy()
+    env.update({key: str(value) for key, value in env_overrides.items()})
+    return subprocess.Popen(
+        [sys.executable, "-u", script or script_name(script_dir)],
+        cwd=script_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def script_name(script_dir):
+    return "HMI.py" if os.path.basename(script_dir) == "hmi" else "plc.py"
+
+
+def stop_component(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies, elapsed, errors=0):
+    """
+    Summary dict of request count, rate and latency percentiles in milliseconds
+    """
+    values = sorted(latencies)
+    summary = {
+        'requests': len(values),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(values) / elapsed, 1) if elapsed > 0 else None,
+    }
+    for name, fraction in (('p50_ms', 0.50), ('p99_ms', 0.99), ('max_ms', 1.0)):
+        value = percentile(values, fraction)
+        summary[name] = round(value * 1000.0, 3) if value is not None else None
+    return summary
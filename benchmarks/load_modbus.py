@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant Modbus Load Generator
+Drives a running Modbus PLC with many concurrent asyncio clients sending a
+configurable mix of requests, reporting throughput, errors and latency
+percentiles every interval, optionally ramping the client count until the
+server saturates
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException
+
+from bench_util import percentile
+
+# Documented register map
+COIL_COUNT = 9
+REGISTER_COUNT = 10
+SNAPSHOT_COUNT = 6
+HR_IN_FLOW = 6
+WRITE_FLOW = 50
+
+OPERATIONS = {
+    'read_coils': lambda client, unit: client.read_coils(0, count=COIL_COUNT, device_id=unit),
+    'read_holding_registers': lambda client, unit: client.read_holding_registers(0, count=REGISTER_COUNT, device_id=unit),
+    'read_input_registers': lambda client, unit: client.read_input_registers(0, count=SNAPSHOT_COUNT, device_id=unit),
+    'write_register': lambda client, unit: client.write_register(HR_IN_FLOW, WRITE_FLOW, device_id=unit),
+}
+DEFAULT_MIX = "read_coils=45,read_holding_registers=45,write_register=10"
+
+PERCENTILES = (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99), ('p999_ms', 0.999))
+# Connections opened at once, so thousands of clients do not flood the listen backlog
+CONNECT_CONCURRENCY = 200
+# A stage that adds clients but gains less throughput than this is saturated
+SATURATION_GAIN = 1.05
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of {name} must be a number")
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    total = len(values) + errors
+    summary = {
+        'requests': len(values),
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'requests_per_s': round(len(values) / elapsed, 1) if elapsed > 0 else None,
+    }
+    for name, fraction in PERCENTILES:
+        value = percentile(values, fraction)
+        summary[name] = round(value * 1000.0, 3) if value is not None else None
+    return summary
+
+
+def format_summary(summary):
+    latencies = " ".join(
+        f"{name[:-3]} {summary[name]:.2f}" if summary[name] is not None else f"{name[:-3]} -"
+        for name, _ in PERCENTILES
+    )
+    return (f"{summary['requests_per_s'] or 0:9.1f} req/s  errors {summary['error_rate'] * 100:5.2f}%  "
+            f"latency ms {latencies}")
+
+
+class Stats:
+    """
+    Latencies and errors since the last window() call, plus per stage totals
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.stage_latencies = []
+        self.stage_errors = 0
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def error(self):
+        self.errors += 1
+
+    def window(self):
+        latencies, errors = self.latencies, self.errors
+        self.latencies, self.errors = [], 0
+        self.stage_latencies.extend(latencies)
+        self.stage_errors += errors
+        return latencies, errors
+
+    def stage(self):
+        latencies, errors = self.stage_latencies, self.stage_errors
+        self.stage_latencies, self.stage_errors = [], 0
+        return latencies, errors
+
+
+class LoadGenerator:
+    def __init__(self, host, port, mix, units, think, timeout, seed):
+        self.host = host
+        self.port = port
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.units = units
+        self.think = think
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = Stats()
+        self.clients = []
+        self.tasks = []
+        self.connect_failures = 0
+        self.running = True
+
+    async def _open(self, limit):
+        client = AsyncModbusTcpClient(self.host, port=self.port, timeout=self.timeout, retries=0, reconnect_delay=0)
+        async with limit:
+            connected = await client.connect()
+        if not connected:
+            self.connect_failures += 1
+            client.close()
+            return None
+        return client
+
+    async def grow(self, count):
+        """
+        Connect count more clients and start their request loops
+        """
+        limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+        opened = await asyncio.gather(*(self._open(limit) for _ in range(count)))
+        for client in opened:
+            if client is None:
+                continue
+            unit = 1 + len(self.clients) % self.units
+            rng = random.Random(self.random.random())
+            self.clients.append(client)
+            self.tasks.append(asyncio.create_task(self._client_loop(client, unit, rng)))
+        return sum(client is not None for client in opened)
+
+    async def _client_loop(self, client, unit, rng):
+        while self.running:
+            operation = rng.choices(self.operations, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await OPERATIONS[operation](client, unit)
+                failed = response.isError()
+            except (ModbusException, OSError, asyncio.TimeoutError):
+                failed = True
+            if failed:
+                self.stats.error()
+                if not client.connected:
+                    # Dropped by the server; stay out of the measurement rather than spin
+                    return
+            else:
+                self.stats.record(time.perf_counter() - started)
+            if self.think:
+                await asyncio.sleep(self.think)
+
+    @property
+    def active(self):
+        return sum(not task.done() for task in self.tasks)
+
+    async def stop(self):
+        self.running = False
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for client in self.clients:
+            client.close()
+
+
+async def run_stage(generator, duration, interval, report, log):
+    """
+    Run the current clients for duration seconds, logging every interval
+    """
+    started = time.perf_counter()
+    window_started = started
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(min(interval, max(0.0, deadline - time.perf_counter())))
+        now = time.perf_counter()
+        latencies, errors = generator.stats.window()
+        summary = summarize(latencies, errors, now - window_started)
+        summary['t_s'] = round(now - report['started'], 3)
+        summary['clients'] = generator.active
+        report['intervals'].append(summary)
+        log(f"t={summary['t_s']:7.1f}s clients {summary['clients']:5d}  {format_summary(summary)}")
+        window_started = now
+    latencies, errors = generator.stats.stage()
+    summary = summarize(latencies, errors, time.perf_counter() - started)
+    summary['clients'] = generator.active
+    return summary
+
+
+def saturated(stage, previous, args):
+    if stage['error_rate'] > args.max_error_rate:
+        return f"error rate {stage['error_rate'] * 100:.2f}% above {args.max_error_rate * 100:g}%"
+    if args.max_p99_ms is not None and stage['p99_ms'] is not None and stage['p99_ms'] > args.max_p99_ms:
+        return f"p99 {stage['p99_ms']:.2f} ms above {args.max_p99_ms:g} ms"
+    if previous and (stage['requests_per_s'] or 0) < (previous['requests_per_s'] or 0) * SATURATION_GAIN:
+        return f"throughput {stage['requests_per_s']} req/s no longer grows with clients"
+    return None
+
+
+async def run(args):
+    log = lambda line: print(line, file=sys.stderr)
+    generator = LoadGenerator(args.host, args.port, args.mix, args.units, args.think, args.timeout, args.seed)
+    report = {
+        'config': {
+            'host': args.host, 'port': args.port, 'mix': args.mix, 'units': args.units,
+            'think_s': args.think, 'clients': args.clients, 'ramp_step': args.ramp_step,
+        },
+        'started': time.perf_counter(),
+        'intervals': [],
+        'stages': [],
+    }
+
+    try:
+        target = args.clients
+        previous = None
+        while True:
+            opened = await generator.grow(target - len(generator.clients))
+            log(f"Stage: {generator.active} clients ({opened} connected this stage, "
+                f"{generator.connect_failures} connection failures so far)")
+            stage = await run_stage(generator, args.duration, args.interval, report, log)
+            report['stages'].append(stage)
+            log(f"Stage with {stage['clients']} clients: {format_summary(stage)}")
+
+            if not args.ramp_step:
+                break
+            reason = saturated(stage, previous, args)
+            if reason:
+                best = max(report['stages'], key=lambda s: s['requests_per_s'] or 0)
+                report['saturation'] = {'clients': stage['clients'], 'reason': reason, 'peak': best}
+                log(f"Saturated at {stage['clients']} clients: {reason}; "
+                    f"peak {best['requests_per_s']} req/s with {best['clients']} clients")
+                break
+            if target >= args.max_clients:
+                log(f"Reached --max-clients {args.max_clients} without saturating")
+                break
+            previous = stage
+            target = min(target + args.ramp_step, args.max_clients)
+    finally:
+        await generator.stop()
+
+    report['connect_failures'] = generator.connect_failures
+    del report['started']
+    return report
+
+
+def raise_file_limit():
+    # Every client is a socket; lift the soft descriptor limit to the hard one
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a Modbus PLC with many concurrent asyncio clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--clients", type=int, default=100, help="concurrent clients (first stage when ramping)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"operation=weight list (default {DEFAULT_MIX}); operations: {', '.join(OPERATIONS)}")
+    parser.add_argument("--units", type=int, default=1, help="spread clients over unit IDs 1..N (fleet mode)")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each client waits between requests")
+    parser.add_argument("--timeout", type=float, default=2.0, help="request timeout in seconds")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run or ramp stage")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between reports")
+    parser.add_argument("--ramp-step", type=int, default=0, help="clients added per stage until saturation (0 = no ramp)")
+    parser.add_argument("--max-clients", type=int, default=10000, help="stop ramping at this many clients")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate that counts as saturated")
+    parser.add_argument("--max-p99-ms", type=float, help="p99 latency that counts as saturated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    raise_file_limit()
+    report = asyncio.run(run(args))
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
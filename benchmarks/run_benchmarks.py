@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant Benchmarks
+Runs the benchmark suites on localhost and writes the results as JSON
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from importlib import metadata
+
+import bench_hmi
+import bench_modbus_server
+import bench_startup
+
+SUITES = ("plc", "modbus", "hmi", "startup")
+PACKAGES = ("pymodbus", "flask", "BAC0", "numpy")
+
+
+def package_versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def run_plc_logic(duration, plants):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_plc_logic.py")
+    results = {}
+    for protocol in ("modbus", "bacnet"):
+        command = [sys.executable, script, protocol, "--duration", str(duration)]
+        if protocol == "modbus":
+            command += ["--plants"] + [str(count) for count in plants]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode == 0:
+            results[protocol] = json.loads(completed.stdout)
+        else:
+            results[protocol] = {'error': completed.stderr.strip().splitlines()[-1:]}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Aloha Water Treatment benchmark suite")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file ('-' for stdout)")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per timed measurement")
+    parser.add_argument("--plants", type=int, nargs="+", default=[1, 100, 1000], help="Modbus fleet sizes for plc_logic")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100, 500], help="concurrent Modbus clients")
+    parser.add_argument("--requests", type=int, default=500, help="requests per HMI endpoint")
+    parser.add_argument("--bacnet-device-ip", help="BACnet PLC to measure BACnet HMI /write against")
+    parser.add_argument("--startup-runs", type=int, default=5, help="starts per component for startup")
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packages': package_versions(),
+        'results': {},
+    }
+
+    if "plc" in args.suites:
+        print("Running plc_logic benchmark...", file=sys.stderr)
+        report['results']['plc_logic'] = run_plc_logic(args.duration, args.plants)
+    if "modbus" in args.suites:
+        print("Running Modbus server benchmark...", file=sys.stderr)
+        report['results']['modbus_server'] = bench_modbus_server.run(args.clients, args.duration)
+    if "hmi" in args.suites:
+        print("Running HMI benchmark...", file=sys.stderr)
+        report['results']['hmi'] = bench_hmi.run(args.requests, args.bacnet_device_ip)
+    if "startup" in args.suites:
+        print("Running startup benchmark...", file=sys.stderr)
+        report['results']['startup'] = bench_startup.run(args.startup_runs)
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
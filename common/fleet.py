@@ -0,0 +1,169 @@
+"""
+Aloha Water Treatment Plant Fleet
+Spreads plants over worker PLC processes and serves one view of the whole
+fleet: health, merged metrics and plant state
+"""
+
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Registry, serve
+
+# Modbus unit IDs a worker can give its plants
+UNIT_ID_MAX = 247
+SCRAPE_TIMEOUT = 2.0
+SCRAPE_THREADS = 32
+SCAN_SAMPLES = {
+    'scans': 'plc_scans_total',
+    'overruns': 'plc_scan_overruns_total',
+    'skipped': 'plc_scans_skipped_total',
+}
+
+
+def shard(plants, workers, per_worker=UNIT_ID_MAX):
+    """
+    Number of plants for each worker, as even as possible
+    """
+    if workers < 1 or plants < workers:
+        raise ValueError(f"cannot spread {plants} plants over {workers} workers")
+    if plants > workers * per_worker:
+        raise ValueError(f"{plants} plants need at least {-(-plants // per_worker)} workers "
+                         f"of {per_worker} plants each")
+    share, extra = divmod(plants, workers)
+    return [share + (i < extra) for i in range(workers)]
+
+
+def add_label(line, name, value):
+    """
+    A sample line of the Prometheus text format with one more label
+    """
+    label = f'{name}="{value}"'
+    if "{" in line:
+        metric, labels = line.split("{", 1)
+        return f"{metric}{{{label},{labels}"
+    metric, sample = line.split(" ", 1)
+    return f"{metric}{{{label}}} {sample}"
+
+
+def merge_metrics(pages):
+    """
+    One exposition from (worker, text) pairs. Every sample gains a worker
+    label. The format wants all samples of a metric after a single HELP and
+    TYPE, so the samples are grouped by metric.
+    """
+    families = {}
+    for worker, text in pages:
+        family = families.setdefault(None, ([], []))
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and not line.startswith("#"):
+                family[1].append(add_label(line, "worker", worker))
+    lines = []
+    for headers, samples in families.values():
+        lines += headers + samples
+    return "\n".join(lines) + "\n"
+
+
+def plain_samples(text):
+    """
+    Values of the samples without labels, by metric name
+    """
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.split(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+class Worker:
+    """
+    A fleet member: its launcher component, the base URL of its metrics port
+    and the Modbus port and plant count it serves
+    """
+
+    def __init__(self, component, url, port=None, plants=1):
+        self.component = component
+        self.url = url
+        self.port = port
+        self.plants = plants
+
+
+class FleetMonitor:
+    """
+    Serves /health, /metrics and /state for a list of Workers. Nothing is
+    collected in the background: each request scrapes every worker's
+    metrics port, in parallel.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=min(len(workers), SCRAPE_THREADS))
+        self.registry = Registry()
+        self.up = self.registry.gauge('fleet_worker_up', 'Whether the worker answered the last scrape', ('worker',))
+        self.restarts = self.registry.gauge('fleet_worker_restarts', 'Times the worker was restarted', ('worker',))
+
+    def _fetch(self, worker, path):
+        try:
+            with urllib.request.urlopen(worker.url + path, timeout=SCRAPE_TIMEOUT) as response:
+                return response.read().decode()
+        except OSError:
+            return None
+
+    def _fetch_all(self, path):
+        return list(self.pool.map(lambda worker: self._fetch(worker, path), self.workers))
+
+    def render(self):
+        pages = self._fetch_all("/metrics")
+        for worker, page in zip(self.workers, pages):
+            self.up.set(int(page is not None), worker.component.name)
+            self.restarts.set(worker.component.restarts, worker.component.name)
+        merged = merge_metrics(
+            (worker.component.name, page) for worker, page in zip(self.workers, pages) if page is not None
+        )
+        return self.registry.render() + merged
+
+    def health(self):
+        workers = []
+        for worker, page in zip(self.workers, self._fetch_all("/metrics")):
+            process = worker.component.process
+            entry = {
+                'name': worker.component.name,
+                'port': worker.port,
+                'plants': worker.plants,
+                'pid': process.pid if process else None,
+                'ready': worker.component.is_ready.is_set(),
+                'up': page is not None,
+                'restarts': worker.component.restarts,
+            }
+            samples = plain_samples(page) if page is not None else {}
+            for key, name in SCAN_SAMPLES.items():
+                entry[key] = int(samples[name]) if name in samples else None
+            workers.append(entry)
+
+        healthy = all(entry['ready'] and entry['up'] for entry in workers)
+        summary = {
+            'healthy': healthy,
+            'workers_up': sum(entry['up'] for entry in workers),
+            'plants': sum(entry['plants'] for entry in workers),
+        }
+        for key in SCAN_SAMPLES:
+            summary[key] = sum(entry[key] or 0 for entry in workers)
+        summary['workers'] = workers
+        return 200 if healthy else 503, "application/json", json.dumps(summary)
+
+    def state(self):
+        plants = []
+        for worker, page in zip(self.workers, self._fetch_all("/state")):
+            if page is None:
+                continue
+            for unit_id, registers in json.loads(page).items():
+                plants.append(dict(worker=worker.component.name, port=worker.port, unit_id=int(unit_id), **registers))
+        return 200, "application/json", json.dumps({'plants': plants})
+
+    def serve(self, host, port):
+        return serve(self, host, port, {'/health': self.health, '/state': self.state})
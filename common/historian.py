@@ -0,0 +1,240 @@
+"""
+Aloha Water Treatment Plant Historian
+Fixed-size in-memory history of the plant tags with time-range queries
+downsampled to min/max/mean
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# Seconds of history kept by default
+HISTORY_SPAN = 7 * 24 * 3600
+# A week of samples at 1 Hz
+DEFAULT_CAPACITY = HISTORY_SPAN
+DEFAULT_POINTS = 500
+MAX_POINTS = 10000
+
+# Sample times are stored as uint32 milliseconds after base; base moves
+# forward before the offsets run out (after about 49 days)
+REBASE_LIMIT = 2**32 - 1 - 24 * 3600 * 1000
+
+# HMI field -> storage: 'bool' is one bit per sample, anything else a NumPy dtype
+PLANT_TAGS = {
+    'tankVolume': 'uint16',
+    'inflowRate': 'uint16',
+    'outflowRate': 'uint16',
+    'emergencyStopStatus': 'bool',
+    'pumpSwitchStatus': 'bool',
+    'pumpStatus': 'bool',
+    'inflowValveStatus': 'bool',
+    'outflowValveStatus': 'bool',
+    'inflowMode': 'bool',
+    'overflowed': 'bool',
+    'lowLevelAlarm': 'bool',
+    'operatorErrorAlarm': 'bool',
+}
+
+
+def capacity_for(interval, span=HISTORY_SPAN):
+    """
+    Samples needed to hold span seconds of history recorded every interval
+    seconds
+    """
+    return max(int(round(span / interval)), 1)
+
+
+def downsample(times, columns, points):
+    """
+    Split the samples into at most points consecutive buckets of equal size
+    and return each bucket's mean time and min, max and mean per column
+    """
+    count = len(times)
+    if count == 0:
+        empty = {'min': [], 'max': [], 'mean': []}
+        return [], {tag: dict(empty) for tag in columns}
+    if count <= points:
+        starts = np.arange(count)
+    else:
+        starts = np.linspace(0, count, points, endpoint=False).astype(np.int64)
+    sizes = np.diff(np.append(starts, count))
+
+    bucket_times = np.add.reduceat(times, starts) / sizes
+    summaries = {}
+    for tag, values in columns.items():
+        values = values.astype(np.float64)
+        summaries[tag] = {
+            'min': np.minimum.reduceat(values, starts).tolist(),
+            'max': np.maximum.reduceat(values, starts).tolist(),
+            'mean': np.round(np.add.reduceat(values, starts) / sizes, 3).tolist(),
+        }
+    return np.round(bucket_times, 3).tolist(), summaries
+
+
+def parse_query(args, tags):
+    """
+    Historian.query keyword arguments from /history request arguments:
+    tags (comma separated), start and end (Unix seconds) and points
+    """
+    query = {}
+    if args.get('tags'):
+        query['tags'] = args['tags'].split(',')
+        unknown = [tag for tag in query['tags'] if tag not in tags]
+        if unknown:
+            raise ValueError(f"Unknown tags: {', '.join(unknown)}")
+    for name in ('start', 'end'):
+        if args.get(name):
+            try:
+                query[name] = float(args[name])
+            except ValueError:
+                raise ValueError(f"{name} must be a Unix timestamp in seconds")
+    if args.get('points'):
+        try:
+            query['points'] = int(args['points'])
+        except ValueError:
+            raise ValueError("points must be an integer")
+        if not 1 <= query['points'] <= MAX_POINTS:
+            raise ValueError(f"points must be between 1 and {MAX_POINTS}")
+    return query
+
+
+class Historian:
+    """
+    Ring buffer of samples, one preallocated array per tag, so memory is
+    fixed by the capacity however long it runs. Once full, each new sample
+    overwrites the oldest. Safe to record from one thread while others query.
+    """
+
+    def __init__(self, tags=PLANT_TAGS, capacity=DEFAULT_CAPACITY):
+        self.tags = dict(tags)
+        self.capacity = capacity
+        self.base = None
+        self.times = np.zeros(capacity, dtype=np.uint32)
+        self.columns = {}
+        self.limits = {}
+        for tag, kind in self.tags.items():
+            if kind == 'bool':
+                self.columns[tag] = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+            else:
+                self.columns[tag] = np.zeros(capacity, dtype=kind)
+                if np.issubdtype(self.columns[tag].dtype, np.integer):
+                    info = np.iinfo(self.columns[tag].dtype)
+                    self.limits[tag] = (int(info.min), int(info.max))
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def record(self, values, timestamp=None):
+        """
+        Append one sample of every tag. Returns False, recording nothing, if
+        any tag has no value yet.
+        """
+        if any(values.get(tag) is None for tag in self.tags):
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            if self.base is None:
+                self.base = timestamp
+            offset = int(round((timestamp - self.base) * 1000.0))
+            if offset > REBASE_LIMIT:
+                offset -= self._rebase(offset)
+            if self.count:
+                # Keep times sorted if the wall clock steps back
+                offset = max(offset, int(self.times[self.head - 1]))
+
+            index = self.head
+            self.times[index] = offset
+            for tag, kind in self.tags.items():
+                column = self.columns[tag]
+                if kind == 'bool':
+                    byte, bit = divmod(index, 8)
+                    column[byte] = (int(column[byte]) & ~(1 << bit)) | (bool(values[tag]) << bit)
+                elif tag in self.limits:
+                    low, high = self.limits[tag]
+                    column[index] = min(max(int(values[tag]), low), high)
+                else:
+                    column[index] = values[tag]
+            self.head = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        return True
+
+    def _rebase(self, offset):
+        """
+        Move base up to the oldest sample, or further if offset still would
+        not fit, in which case samples older than the representable span all
+        end up at the new base. Returns the shift in milliseconds.
+        """
+        indices = self._indices()
+        oldest = int(self.times[indices[0]]) if len(indices) else offset
+        shift = oldest if offset - oldest <= REBASE_LIMIT else offset - REBASE_LIMIT // 2
+        self.times[indices] = np.maximum(self.times[indices].astype(np.int64) - shift, 0)
+        self.base += shift / 1000.0
+        return shift
+
+    def _segments(self):
+        # Physical (start, stop) slices of the ring in chronological order
+        if self.count < self.capacity:
+            return [(0, self.count)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def _indices(self, start=None, end=None):
+        """
+        Physical indices of the samples between start and end offsets, oldest
+        first, found by binary search in each sorted segment
+        """
+        pieces = []
+        for first, stop in self._segments():
+            segment = self.times[first:stop]
+            low = 0 if start is None else int(np.searchsorted(segment, start, side='left'))
+            high = len(segment) if end is None else int(np.searchsorted(segment, end, side='right'))
+            if high > low:
+                pieces.append(np.arange(first + low, first + high))
+        if not pieces:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(pieces)
+
+    def _column(self, tag, indices):
+        column = self.columns[tag]
+        if self.tags[tag] == 'bool':
+            return np.unpackbits(column, bitorder='little')[indices]
+        return column[indices]
+
+    def query(self, tags=None, start=None, end=None, points=DEFAULT_POINTS):
+        """
+        Samples between start and end (Unix seconds, inclusive, default the
+        whole buffer) downsampled to at most points buckets
+        """
+        tags = list(self.tags) if tags is None else tags
+        with self.lock:
+            if self.base is None:
+                indices = np.zeros(0, dtype=np.int64)
+            else:
+                to_offset = lambda t: max(0, int(round((t - self.base) * 1000.0)))
+                indices = self._indices(
+                    None if start is None else to_offset(start),
+                    None if end is None else to_offset(end),
+                )
+                if end is not None and end < self.base:
+                    indices = indices[:0]
+            base = self.base or 0.0
+            times = base + self.times[indices] / 1000.0
+            columns = {tag: self._column(tag, indices) for tag in tags}
+
+        bucket_times, summaries = downsample(times, columns, points)
+        return {
+            'start': start,
+            'end': end,
+            'samples': len(times),
+            'time': bucket_times,
+            'tags': summaries,
+        }
@@ -0,0 +1,268 @@
+"""
+Aloha Water Treatment Plant History Store
+Durable scan-by-scan plant history: append-only fixed-width column files,
+written in batches off the scan thread and read back through mmap
+"""
+
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+# Column -> dtype. Every column file holds one value per plant per scan;
+# time is shared by all plants.
+COLUMNS = {
+    'time': 'float64',
+    'tankVolume': 'uint16',
+    'inflowRate': 'uint16',
+    'outflowRate': 'uint16',
+    'status': 'uint16',
+}
+
+# Bit n of the status column, in the same order as the Modbus coils
+STATUS_FIELDS = (
+    'emergencyStopStatus', 'pumpSwitchStatus', 'pumpStatus', 'inflowValveStatus',
+    'outflowValveStatus', 'inflowMode', 'overflowed', 'lowLevelAlarm', 'operatorErrorAlarm'
+)
+STATUS_BITS = 1 << np.arange(len(STATUS_FIELDS), dtype=np.uint16)
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 1.0
+QUEUE_BATCHES = 64
+
+
+def column_path(directory, name):
+    return os.path.join(directory, f"{name}.bin")
+
+
+def open_columns(directory, plants):
+    """
+    Create the store in directory, or check that an existing one matches
+    plants and cut every column back to the scans all of them hold in full
+    (a crash can leave a partly written batch). Returns the scan count.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, META_FILE)
+    meta = {'version': FORMAT_VERSION, 'plants': plants, 'columns': COLUMNS}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            existing = json.load(f)
+        if existing != meta:
+            raise ValueError(
+                f"History in {directory} was written for {existing.get('plants')} plants "
+                f"with a different layout; use another HISTORY_DIR"
+            )
+    else:
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    scans = None
+    for name, dtype in COLUMNS.items():
+        path = column_path(directory, name)
+        width = np.dtype(dtype).itemsize * (1 if name == 'time' else plants)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        scans = size // width if scans is None else min(scans, size // width)
+    for name, dtype in COLUMNS.items():
+        path = column_path(directory, name)
+        width = np.dtype(dtype).itemsize * (1 if name == 'time' else plants)
+        with open(path, "ab") as f:
+            f.truncate(scans * width)
+    return scans
+
+
+def status_word(engine):
+    flags = np.stack((
+        engine.estop, engine.switch, engine.pump, engine.in_valve, engine.out_valve,
+        engine.manual, engine.overflow_alarm, engine.low_level_alarm, engine.operator_error_alarm
+    ), axis=1)
+    return flags @ STATUS_BITS
+
+
+class HistoryWriter:
+    """
+    Appends the plant engine's state once per scan. append() only copies
+    into a preallocated batch; full batches, or any batch older than
+    flush_interval, go to a writer thread that appends them to the column
+    files. If the disk falls behind and the queue fills, batches are
+    dropped and counted rather than stalling the scan.
+    """
+
+    def __init__(self, directory, plants, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.plants = plants
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.scans = open_columns(directory, plants)
+        self.last_time = self._last_time()
+        self.dropped = 0
+
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self._new_batch()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _last_time(self):
+        if self.scans == 0:
+            return 0.0
+        with open(column_path(self.directory, 'time'), "rb") as f:
+            f.seek((self.scans - 1) * 8)
+            return float(np.frombuffer(f.read(8), dtype=np.float64)[0])
+
+    def _new_batch(self):
+        self.batch = {
+            name: np.zeros(self.batch_size if name == 'time' else (self.batch_size, self.plants), dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        self.batch_length = 0
+        self.batch_started = time.monotonic()
+
+    def append(self, timestamp, engine):
+        # Times must not go backwards or range searches break; hold them if the wall clock steps back
+        timestamp = max(timestamp, self.last_time)
+        self.last_time = timestamp
+
+        row = self.batch_length
+        batch = self.batch
+        batch['time'][row] = timestamp
+        batch['tankVolume'][row] = np.clip(np.trunc(engine.level), 0, 0xFFFF)
+        batch['inflowRate'][row] = np.clip(engine.in_flow, 0, 0xFFFF)
+        batch['outflowRate'][row] = np.clip(engine.out_flow, 0, 0xFFFF)
+        batch['status'][row] = status_word(engine)
+        self.batch_length += 1
+
+        if self.batch_length == self.batch_size or time.monotonic() - self.batch_started >= self.flush_interval:
+            self._hand_off()
+
+    def _hand_off(self):
+        if self.batch_length == 0:
+            return
+        batch = {name: values[:self.batch_length] for name, values in self.batch.items()}
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += self.batch_length
+        self._new_batch()
+
+    def _write_loop(self):
+        files = {name: open(column_path(self.directory, name), "ab") for name in COLUMNS}
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                for name, values in batch.items():
+                    files[name].write(values.tobytes())
+                # Flush the time column last so readers never see a time
+                # before the values that go with it
+                for name in COLUMNS:
+                    if name != 'time':
+                        files[name].flush()
+                files['time'].flush()
+                self.scans += len(batch['time'])
+        finally:
+            for f in files.values():
+                f.close()
+
+    def close(self):
+        self._hand_off()
+        self.queue.put(None)
+        self.thread.join()
+        if self.dropped:
+            print(f"History: dropped {self.dropped} scans because the disk fell behind")
+
+
+class HistoryStore:
+    """
+    Read side of a history directory. Columns are memory mapped, so a range
+    query is a binary search on the time column and the arrays returned are
+    views into the files, copied only when used. Call refresh() to see scans
+    appended since the store was opened.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported history format {meta.get('version')} in {directory}")
+        self.plants = meta['plants']
+        self.columns = {}
+        self.scans = 0
+        self.refresh()
+
+    def refresh(self):
+        scans = None
+        for name, dtype in COLUMNS.items():
+            width = np.dtype(dtype).itemsize * (1 if name == 'time' else self.plants)
+            size = os.path.getsize(column_path(self.directory, name)) // width
+            scans = size if scans is None else min(scans, size)
+        self.scans = scans
+        for name, dtype in COLUMNS.items():
+            if scans == 0:
+                shape = (0,) if name == 'time' else (0, self.plants)
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+                continue
+            shape = (scans,) if name == 'time' else (scans, self.plants)
+            self.columns[name] = np.memmap(column_path(self.directory, name), dtype=dtype, mode='r', shape=shape)
+        return scans
+
+    def __len__(self):
+        return self.scans
+
+    def range(self, start=None, end=None):
+        """
+        (first, stop) scan indices with start <= time <= end
+        """
+        times = self.columns['time']
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        stop = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+        return first, max(first, stop)
+
+    def query(self, start=None, end=None):
+        """
+        Column name -> view of the scans in the time range; plant columns
+        are (scans, plants)
+        """
+        first, stop = self.range(start, end)
+        return {name: values[first:stop] for name, values in self.columns.items()}
+
+    def fields(self, start=None, end=None, plant=0):
+        """
+        time and HMI field name -> array for one plant, status decoded
+        """
+        columns = self.query(start, end)
+        fields = {
+            'time': columns['time'],
+            'tankVolume': columns['tankVolume'][:, plant],
+            'inflowRate': columns['inflowRate'][:, plant],
+            'outflowRate': columns['outflowRate'][:, plant],
+        }
+        status = columns['status'][:, plant]
+        for bit, name in enumerate(STATUS_FIELDS):
+            fields[name] = (status >> bit) & 1
+        return fields
+
+    def export_csv(self, out, start=None, end=None, plants=None):
+        """
+        Write one CSV row per plant per scan to the open text file out
+        """
+        plants = range(self.plants) if plants is None else plants
+        writer = csv.writer(out)
+        writer.writerow(('plant', 'time', 'tankVolume', 'inflowRate', 'outflowRate') + STATUS_FIELDS)
+        for plant in plants:
+            fields = self.fields(start, end, plant)
+            for row in zip(*(values.tolist() for values in fields.values())):
+                writer.writerow((plant,) + row)
+
+    def export_npz(self, path, start=None, end=None):
+        """
+        Save the raw columns in the time range, status still packed
+        """
+        np.savez_compressed(path, plants=self.plants, status_fields=STATUS_FIELDS, **self.query(start, end))
@@ -0,0 +1,237 @@
+"""
+Aloha Water Treatment Plant Launcher
+Starts PLC and HMI processes in parallel, holds each one back until what it
+depends on answers a readiness probe, and restarts any that exit
+"""
+
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+READY_TIMEOUT = 60.0
+PROBE_INTERVAL = 0.1
+PROBE_TIMEOUT = 0.5
+RESTART_DELAY_MIN = 1.0
+RESTART_DELAY_MAX = 30.0
+# A process that ran this long before exiting is restarted without backoff
+STABLE_RUNTIME = 30.0
+STOP_TIMEOUT = 5.0
+
+BACNET_PORT = 47808
+
+
+def port_ready(host, port):
+    """
+    Probe: a TCP connection to host:port is accepted
+    """
+    def probe():
+        try:
+            with socket.create_connection((host, port), timeout=PROBE_TIMEOUT):
+                return True
+        except OSError:
+            return False
+    return probe
+
+
+def http_ready(url):
+    """
+    Probe: GET url answers 200
+    """
+    def probe():
+        try:
+            with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT) as response:
+                return response.status == 200
+        except OSError:
+            return False
+    return probe
+
+
+def who_is(device_id):
+    """
+    BVLC original-unicast Who-Is limited to one device instance
+    """
+    instance = struct.pack(">I", device_id)[1:]
+    apdu = bytes([0x10, 0x08, 0x0B]) + instance + bytes([0x1B]) + instance
+    npdu = bytes([0x01, 0x00])
+    return bytes([0x81, 0x0A]) + struct.pack(">H", 4 + len(npdu) + len(apdu)) + npdu + apdu
+
+
+def bacnet_ready(ip, device_id, port=BACNET_PORT, timeout=PROBE_TIMEOUT):
+    """
+    Probe: the device answers a Who-Is with an I-Am within timeout seconds
+    """
+    # I-Am service and its device object identifier (object type 8)
+    expected = bytes([0x10, 0x00, 0xC4]) + struct.pack(">I", (8 << 22) | device_id)
+
+    def probe():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            try:
+                sock.sendto(who_is(device_id), (ip, port))
+                deadline = time.monotonic() + timeout
+                while time.monotonic() < deadline:
+                    data, _ = sock.recvfrom(1500)
+                    if expected in data:
+                        return True
+            except OSError:
+                pass
+        return False
+    return probe
+
+
+def all_ready(*probes):
+    """
+    Probe: every one of probes passes
+    """
+    def probe():
+        return all(check() for check in probes)
+    return probe
+
+
+def wait_for(probe, timeout=READY_TIMEOUT, process=None, interval=PROBE_INTERVAL):
+    """
+    Poll probe every interval seconds until it passes. Returns False on
+    timeout or if process exits first.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if probe():
+            return True
+        if process is not None and process.poll() is not None:
+            return False
+        time.sleep(interval)
+    return False
+
+
+class Component:
+    """
+    One process to run: a script started in its directory with extra
+    environment variables. ready is its readiness probe; the component is
+    only started once every component in depends is ready. Without a script
+    the component runs elsewhere and is only probed.
+    """
+
+    def __init__(self, name, script_dir, script, env, ready, depends=()):
+        self.name = name
+        self.script_dir = script_dir
+        self.script = script
+        self.env = env
+        self.ready = ready
+        self.depends = list(depends)
+        self.process = None
+        self.is_ready = threading.Event()
+        self.started = 0.0
+        self.restarts = 0
+        self.restart_delay = RESTART_DELAY_MIN
+        self.next_start = None
+
+
+class Supervisor:
+    def __init__(self, components, log_dir=None, restart=True):
+        self.components = components
+        self.log_dir = log_dir
+        self.restart = restart
+        self.stopping = threading.Event()
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+    def _spawn(self, component):
+        if component.script is None:
+            return
+        env = os.environ.copy()
+        env.update({key: str(value) for key, value in component.env.items()})
+        output = None
+        if self.log_dir:
+            output = open(os.path.join(self.log_dir, f"{component.name}.log"), "ab")
+        try:
+            component.process = subprocess.Popen(
+                [sys.executable, "-u", component.script],
+                cwd=component.script_dir,
+                env=env,
+                stdout=output,
+                stderr=subprocess.STDOUT if output else None
+            )
+        finally:
+            if output:
+                output.close()
+        component.started = time.monotonic()
+
+    def _bring_up(self, component):
+        for dependency in component.depends:
+            while not dependency.is_ready.wait(PROBE_INTERVAL):
+                if self.stopping.is_set():
+                    return
+        if self.stopping.is_set():
+            return
+        self._spawn(component)
+        self._await_ready(component)
+
+    def _await_ready(self, component):
+        started = time.monotonic()
+        if wait_for(component.ready, READY_TIMEOUT, component.process):
+            component.is_ready.set()
+            print(f"{component.name} ready in {time.monotonic() - started:.1f}s")
+        elif component.process is None or component.process.poll() is None:
+            print(f"{component.name} not ready after {READY_TIMEOUT:g}s")
+
+    def start(self):
+        """
+        Start every component as soon as its dependencies are ready and
+        return once all are ready, or have failed or timed out
+        """
+        started = time.monotonic()
+        threads = [threading.Thread(target=self._bring_up, args=(component,), daemon=True)
+                   for component in self.components]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ready = sum(component.is_ready.is_set() for component in self.components)
+        print(f"{ready} of {len(self.components)} components ready in {time.monotonic() - started:.1f}s")
+        return ready == len(self.components)
+
+    def supervise(self):
+        """
+        Restart components that exit, with backoff, until stop() is called
+        """
+        while not self.stopping.wait(0.5):
+            now = time.monotonic()
+            for component in self.components:
+                process = component.process
+                if process is None or process.poll() is None:
+                    continue
+                if not self.restart:
+                    continue
+                if component.next_start is None:
+                    component.is_ready.clear()
+                    if now - component.started >= STABLE_RUNTIME:
+                        component.restart_delay = RESTART_DELAY_MIN
+                    component.next_start = now + component.restart_delay
+                    print(f"{component.name} exited with code {process.returncode}, "
+                          f"restarting in {component.restart_delay:g}s")
+                    component.restart_delay = min(component.restart_delay * 2, RESTART_DELAY_MAX)
+                elif now >= component.next_start:
+                    component.next_start = None
+                    component.restarts += 1
+                    self._spawn(component)
+                    threading.Thread(target=self._await_ready, args=(component,), daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        # Dependents first, so HMIs do not log a burst of errors as their PLC goes away
+        running = [component.process for component in reversed(self.components)
+                   if component.process is not None and component.process.poll() is None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in running:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
@@ -0,0 +1,296 @@
+"""
+Aloha Water Treatment Plant Metrics
+Counters, gauges and histograms rendered in the Prometheus text format, for
+/metrics on the HMIs and a side HTTP port on the PLCs
+"""
+
+import bisect
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bucket edges in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# HMI endpoints whose handling time is measured
+TIMED_PATHS = ('/update', '/write')
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def histogram_lines(name, label_names, label_values, bounds, counts, total):
+    """
+    Sample lines of one histogram series. counts holds one count per bound
+    plus the overflow bucket, not cumulated.
+    """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(tuple(bounds) + (float("inf"),), counts):
+        cumulative += count
+        labels = format_labels(label_names, label_values, ("le", format_value(float(bound))))
+        lines.append(f"{name}_bucket{labels} {cumulative}")
+    labels = format_labels(label_names, label_values)
+    lines.append(f"{name}_sum{labels} {format_value(float(total))}")
+    lines.append(f"{name}_count{labels} {cumulative}")
+    return lines
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        return self.header() + self.samples()
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonic count per label set. With function the value is read from it
+    at scrape time instead, for counts something else already keeps.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        # Unlabelled series are exported from the start, at zero
+        self.values = {} if self.label_names else {(): 0}
+        self.function = function
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            return [f"{self.name} {format_value(self.function())}"]
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}" for labels, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(buckets)
+        # labels -> [bucket counts, sum]
+        self.series = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.bounds) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self.lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self.series.items())
+        lines = []
+        for labels, counts, total in series:
+            lines += histogram_lines(self.name, self.label_names, labels, self.bounds, counts, total)
+        return lines
+
+
+class ScanHistogram(Metric):
+    """
+    A scan_scheduler.Histogram (bounds in milliseconds) exposed as a
+    histogram in seconds, read at scrape time so the scan loop pays nothing
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, source):
+        super().__init__(name, help)
+        self.source = source
+
+    def samples(self):
+        source = self.source()
+        bounds = [bound / 1000.0 for bound in source.bounds_ms]
+        return histogram_lines(self.name, (), (), bounds, list(source.counts), source.total)
+
+
+class ForwardedRegistry:
+    """
+    The metrics of a Registry in another process, which renders them on
+    every scrape when asked over a multiprocessing pipe (see
+    answer_renders). Added to a Registry like a metric; renders nothing
+    while the other process does not answer.
+    """
+
+    def __init__(self, connection, timeout=1.0):
+        self.connection = connection
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def render(self):
+        with self.lock:
+            try:
+                # Drop an answer that came too late for the previous scrape
+                while self.connection.poll():
+                    self.connection.recv()
+                self.connection.send(None)
+                if self.connection.poll(self.timeout):
+                    return self.connection.recv().splitlines()
+            except (EOFError, OSError):
+                pass
+        return []
+
+
+def answer_renders(registry, connection):
+    """
+    Answer every request a ForwardedRegistry sends over connection with
+    registry rendered, from a daemon thread
+    """
+    def answer():
+        while True:
+            try:
+                connection.recv()
+                connection.send(registry.render())
+            except (EOFError, OSError):
+                return
+
+    thread = threading.Thread(target=answer, daemon=True)
+    thread.start()
+    return thread
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        return self.add(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self.add(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class HMIMetrics:
+    """
+    Metrics every HMI exports: PLC poll round trips and failures, the age of
+    the data it shows and the handling time of TIMED_PATHS
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        self.poll_duration = self.registry.histogram(
+            'hmi_poll_duration_seconds', 'Round trip of one PLC poll cycle'
+        )
+        self.poll_errors = self.registry.counter('hmi_poll_errors_total', 'PLC poll cycles that failed')
+        self.write_errors = self.registry.counter('hmi_write_errors_total', 'Commands the PLC rejected')
+        self.registry.gauge(
+            'hmi_data_age_seconds', 'Seconds since the data shown was last read from the PLC', function=self.age
+        )
+        self.request_duration = self.registry.histogram(
+            'hmi_request_duration_seconds', 'HTTP request handling time', ('endpoint',)
+        )
+        self.last_update = None
+
+    def polled(self, seconds):
+        self.poll_duration.observe(seconds)
+        self.updated()
+
+    def updated(self):
+        self.last_update = time.monotonic()
+
+    def age(self):
+        if self.last_update is None:
+            return float("nan")
+        return time.monotonic() - self.last_update
+
+    def request_done(self, path, seconds):
+        if path in TIMED_PATHS:
+            self.request_duration.observe(seconds, path)
+
+
+def serve(registry, host, port, routes=None):
+    """
+    Serve registry at /metrics from a daemon thread and return the server.
+    routes maps further paths to functions returning (status, content type,
+    body).
+    """
+    # Imported here so processes without a metrics port do not load it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handlers = {'/metrics': lambda: (200, CONTENT_TYPE, registry.render())}
+    handlers.update(routes or {})
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            handler = handlers.get(self.path.split("?", 1)[0])
+            if handler is None:
+                self.send_error(404)
+                return
+            status, content_type, body = handler()
+            body = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,108 @@
+"""
+Aloha Water Treatment Plant Physics Engine
+Vectorized control law and tank model for many plants at once
+"""
+
+import numpy as np
+
+TANK_MAX = 10000
+RATE_MIN = 50
+TARGET_VOLUME = int(2 / 3 * TANK_MAX)
+LOW_LEVEL = 1000
+HIGH_LEVEL = 9000
+
+# Auto mode inflow bands: (deficit above, inflow)
+DEFICIT_BANDS = ((3000, RATE_MIN + 80), (1500, RATE_MIN + 40), (500, RATE_MIN + 20))
+OVERFILL_BAND = 500
+
+
+class PlantEngine:
+    """
+    State of count plants held as one array per signal, index i being plant i.
+
+    Front ends write the operator inputs (estop, switch, manual, in_flow,
+    out_flow) and any externally changed level or overflow alarm, call
+    step(), then publish the outputs. manual is the mode select: False is
+    auto, True is manual. In manual mode in_flow and out_flow are the
+    operator requested rates; in auto mode step() overwrites them.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+        self.level = np.zeros(count, dtype=np.float64)
+        self.in_flow = np.zeros(count, dtype=np.int64)
+        self.out_flow = np.zeros(count, dtype=np.int64)
+
+        self.estop = np.zeros(count, dtype=bool)
+        self.switch = np.zeros(count, dtype=bool)
+        self.manual = np.zeros(count, dtype=bool)
+
+        self.pump = np.zeros(count, dtype=bool)
+        self.in_valve = np.zeros(count, dtype=bool)
+        self.out_valve = np.zeros(count, dtype=bool)
+
+        self.overflow_alarm = np.zeros(count, dtype=bool)
+        self.low_level_alarm = np.zeros(count, dtype=bool)
+        self.operator_error_alarm = np.zeros(count, dtype=bool)
+
+    def sync_level(self, levels):
+        """
+        Take levels reported by a front end, keeping the fractional volume of
+        every plant whose integer reading has not been changed externally
+        """
+        levels = np.asarray(levels, dtype=np.float64)
+        changed = np.trunc(self.level) != levels
+        self.level[changed] = levels[changed]
+
+    def step(self, dt=1.0):
+        """
+        Advance every plant by dt seconds
+        """
+        requested_in_flow = self.in_flow.copy()
+        requested_out_flow = self.out_flow.copy()
+        reading = np.trunc(self.level)
+
+        run = self.switch & ~self.estop
+        auto = run & ~self.manual
+
+        in_flow = np.where(run, requested_in_flow, 0)
+        out_flow = np.where(run, requested_out_flow, 0)
+        out_valve = run.copy()
+
+        auto_in_flow = np.select(
+            [TARGET_VOLUME - reading > deficit for deficit, _ in DEFICIT_BANDS]
+            + [reading > TARGET_VOLUME + OVERFILL_BAND],
+            [rate for _, rate in DEFICIT_BANDS] + [0],
+            default=RATE_MIN
+        )
+        in_flow = np.where(auto, auto_in_flow, in_flow)
+
+        auto_drained = auto & (reading <= LOW_LEVEL)
+        out_flow = np.where(auto, RATE_MIN, out_flow)
+        out_flow[auto_drained] = 0
+        out_valve[auto_drained] = False
+
+        level = np.where(run, self.level + (in_flow - out_flow) * dt, self.level)
+
+        empty = run & (level < 0)
+        overflow = run & (level > TANK_MAX)
+        level[empty] = 0
+        level[overflow] = TANK_MAX
+        in_flow[overflow & ~self.manual] = 0
+
+        self.overflow_alarm[overflow] = True
+        self.overflow_alarm[run & ~empty & (level < TANK_MAX)] = False
+
+        self.low_level_alarm = (level <= LOW_LEVEL) & (out_flow > 0)
+        self.operator_error_alarm = self.manual & (
+            ((level <= LOW_LEVEL) & (requested_out_flow > 0))
+            | ((level >= HIGH_LEVEL) & (requested_in_flow > 0))
+        )
+
+        self.level = level
+        self.in_flow = in_flow
+        self.out_flow = out_flow
+        self.pump = run
+        self.in_valve = run.copy()
+        self.out_valve = out_valve
@@ -0,0 +1,249 @@
+"""
+Aloha Water Treatment Plant Profiling
+Opt-in sampled cProfile and tracemalloc around PLC scans and HMI request
+handlers, with periodic reports written to a directory
+"""
+
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_START = os.getenv("PROFILE_START", "0") == "1"
+PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "10"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "60"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "0") == "1"
+MEMORY_FRAMES = 5
+
+# Not available on Windows; there profiling can only be switched on at start
+TOGGLE_SIGNAL = getattr(signal, "SIGUSR1", None)
+
+
+class _Stepped:
+    """
+    Awaitable that drives a coroutine one step at a time with the profile
+    enabled only during each step
+    """
+
+    def __init__(self, coroutine, profile):
+        self.coroutine = coroutine
+        self.profile = profile
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                if error is None:
+                    future = self.coroutine.send(value)
+                else:
+                    future = self.coroutine.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+            value, error = None, None
+            try:
+                value = yield future
+            except BaseException as e:
+                error = e
+
+
+def take_snapshot():
+    # Leave out the profiler's own allocations
+    return tracemalloc.take_snapshot().filter_traces(tuple(
+        tracemalloc.Filter(False, path)
+        for path in (tracemalloc.__file__, pstats.__file__, cProfile.__file__, __file__, "<frozen importlib._bootstrap>")
+    ))
+
+
+class Profiler:
+    """
+    Profiles every n-th call of the functions passed through wrap() while
+    enabled. cProfile only follows the calling thread, so calls made while
+    another thread holds the profile run unprofiled. A background thread
+    writes a CPU report (and, with memory, the allocation growth since the
+    previous report) every interval seconds and when profiling is switched
+    off. While disabled a wrapped call costs one attribute check.
+    """
+
+    def __init__(self, name, directory, every=PROFILE_EVERY, interval=PROFILE_INTERVAL,
+                 top=PROFILE_TOP, memory=PROFILE_MEMORY):
+        self.name = name
+        self.directory = directory
+        self.every = max(1, every)
+        self.interval = interval
+        self.top = top
+        self.memory = memory
+        os.makedirs(directory, exist_ok=True)
+
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.sampled = 0
+        self.started = time.time()
+        self.snapshot = None
+        self.wake = threading.Event()
+        threading.Thread(target=self._report_loop, daemon=True).start()
+
+    def wrap(self, function):
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            self.calls += 1
+            if self.calls % self.every or not self.lock.acquire(blocking=False):
+                return function(*args, **kwargs)
+            try:
+                self.sampled += 1
+                self.profile.enable()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.profile.disable()
+            finally:
+                self.lock.release()
+        return profiled
+
+    def wrap_async(self, function):
+        """
+        wrap() for coroutine functions. The profile only runs while the
+        coroutine itself executes, between its awaits, so the work of other
+        tasks on the event loop is not counted against it.
+        """
+        @functools.wraps(function)
+        async def profiled(*args, **kwargs):
+            if not self.enabled:
+                return await function(*args, **kwargs)
+            self.calls += 1
+            if self.calls % self.every or not self.lock.acquire(blocking=False):
+                return await function(*args, **kwargs)
+            try:
+                self.sampled += 1
+                # The lock is held until the coroutine finishes, so report()
+                # cannot swap the profile between its steps
+                return await _Stepped(function(*args, **kwargs), self.profile)
+            finally:
+                self.lock.release()
+        return profiled
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.started = time.time()
+        if self.memory:
+            tracemalloc.start(MEMORY_FRAMES)
+            self.snapshot = take_snapshot()
+        self.enabled = True
+        print(f"Profiling {self.name} every {self.every} calls, reports in {self.directory}")
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        # The report thread writes the last report and stops tracemalloc
+        self.wake.set()
+        print(f"Profiling {self.name} off")
+
+    def toggle(self, signum=None, frame=None):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def install_signal(self):
+        if TOGGLE_SIGNAL is not None:
+            signal.signal(TOGGLE_SIGNAL, self.toggle)
+
+    def _report_loop(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.enabled and not self.sampled and self.snapshot is None:
+                continue
+            try:
+                self.report()
+            except Exception as e:
+                print(f"Error writing profile report: {e}")
+            if not self.enabled and self.snapshot is not None:
+                self.snapshot = None
+                tracemalloc.stop()
+
+    def report(self):
+        """
+        Write the reports for the period since the last one and start a new
+        period
+        """
+        with self.lock:
+            profile, self.profile = self.profile, cProfile.Profile()
+            calls, sampled, started = self.calls, self.sampled, self.started
+            self.calls = self.sampled = 0
+            self.started = time.time()
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        base = os.path.join(self.directory, f"{self.name}-{stamp}")
+        period = (f"{time.strftime('%H:%M:%S', time.localtime(started))} to "
+                  f"{time.strftime('%H:%M:%S', time.localtime(self.started))}")
+
+        if sampled:
+            profile.dump_stats(f"{base}.prof")
+            out = io.StringIO()
+            out.write(f"{self.name} CPU profile, {period}\n")
+            out.write(f"{sampled} of {calls} calls profiled (every {self.every})\n\n")
+            stats = pstats.Stats(profile, stream=out).strip_dirs()
+            out.write(f"Top {self.top} by cumulative time\n")
+            stats.sort_stats("cumulative").print_stats(self.top)
+            out.write(f"Top {self.top} by own time\n")
+            stats.sort_stats("tottime").print_stats(self.top)
+            with open(f"{base}-cpu.txt", "w") as f:
+                f.write(out.getvalue())
+
+        if self.snapshot is not None and tracemalloc.is_tracing():
+            snapshot = take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            growth = snapshot.compare_to(self.snapshot, "lineno")
+            self.snapshot = snapshot
+            with open(f"{base}-memory.txt", "w") as f:
+                f.write(f"{self.name} allocation growth, {period}\n")
+                f.write(f"Traced {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n\n")
+                f.write(f"Top {self.top} by growth\n")
+                for stat in growth[:self.top]:
+                    f.write(f"{stat}\n")
+
+
+def from_env(name):
+    """
+    Profiler configured from the PROFILE_* environment variables, toggled by
+    SIGUSR1, or None when PROFILE_DIR is not set
+    """
+    if not PROFILE_DIR:
+        return None
+    profiler = Profiler(name, PROFILE_DIR)
+    profiler.install_signal()
+    if PROFILE_START:
+        profiler.enable()
+    return profiler
+
+
+def wrap_views(app, profiler, skip=("static", "stream")):
+    """
+    Profile the view functions of a Flask or Quart app. The streaming views
+    return generators, so profiling them would only time the generator's
+    creation.
+    """
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint in skip:
+            continue
+        if inspect.iscoroutinefunction(view):
+            app.view_functions[endpoint] = profiler.wrap_async(view)
+        else:
+            app.view_functions[endpoint] = profiler.wrap(view)
@@ -0,0 +1,181 @@
+"""
+Aloha Water Treatment Plant Scan Scheduler
+Deadline-based periodic scan loop with overrun handling and timing statistics
+"""
+
+import math
+import time
+
+SCAN_PERIOD_MIN = 0.01
+
+POLICY_SKIP = "skip"
+POLICY_CATCHUP = "catchup"
+POLICIES = (POLICY_SKIP, POLICY_CATCHUP)
+
+# Upper bucket edges in milliseconds, the last bucket catches everything above
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, bounds_ms=HISTOGRAM_BOUNDS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        value_ms = seconds * 1000.0
+        index = 0
+        for bound in self.bounds_ms:
+            if value_ms <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        """
+        Upper bucket edge (seconds) below which the given fraction of samples fall
+        """
+        if not self.count:
+            return 0.0
+        target = math.ceil(fraction * self.count)
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                if index < len(self.bounds_ms):
+                    return self.bounds_ms[index] / 1000.0
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        labels = [f"<={bound}ms" for bound in self.bounds_ms] + [f">{self.bounds_ms[-1]}ms"]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.mean() * 1000.0, 3),
+            'max_ms': round(self.max * 1000.0, 3),
+            'p50_ms': round(self.percentile(0.50) * 1000.0, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000.0, 3),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class ScanStats:
+    def __init__(self):
+        self.scans = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.execution = Histogram()
+        self.jitter = Histogram()
+
+    def as_dict(self):
+        return {
+            'scans': self.scans,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'execution': self.execution.as_dict(),
+            'jitter': self.jitter.as_dict(),
+        }
+
+    def summary(self):
+        return (
+            f"scans={self.scans} overruns={self.overruns} skipped={self.skipped} "
+            f"exec mean={self.execution.mean() * 1000:.2f}ms max={self.execution.max * 1000:.2f}ms "
+            f"jitter mean={self.jitter.mean() * 1000:.2f}ms p99<={self.jitter.percentile(0.99) * 1000:.2f}ms "
+            f"max={self.jitter.max * 1000:.2f}ms"
+        )
+
+
+class VirtualClock:
+    """
+    Clock for ScanScheduler that only moves when slept on, so scans run as
+    fast as the CPU allows while the schedule sees real periods
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+
+class ScanScheduler:
+    """
+    Runs a scan callable on a fixed period against monotonic-clock deadlines.
+
+    A scan that finishes after its next deadline is an overrun. With the
+    "skip" policy the missed deadlines are dropped and the schedule resumes on
+    the next slot of the original grid; with "catchup" the missed scans run
+    back to back until the schedule is current again.
+
+    During a scan, elapsed is the scheduled time since the previous scan:
+    one period, or more after skipped scans, so simulated time keeps pace
+    with the clock under either policy.
+    """
+
+    def __init__(self, period, policy=POLICY_SKIP, clock=time.monotonic, sleep=time.sleep):
+        if period < SCAN_PERIOD_MIN:
+            raise ValueError(f"Scan period must be at least {SCAN_PERIOD_MIN}s, got {period}s")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overrun policy '{policy}', expected one of {POLICIES}")
+
+        self.period = period
+        self.policy = policy
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = ScanStats()
+        self.elapsed = period
+
+    def run(self, scan, is_running, report=None, report_interval=0):
+        """
+        Call scan() once per period while is_running() is true.
+
+        If report is given it is called with the stats every report_interval
+        seconds of scheduled time.
+        """
+        deadline = self.clock()
+        previous = deadline - self.period
+        next_report = deadline + report_interval
+
+        while is_running():
+            now = self.clock()
+            if now < deadline:
+                self.sleep(deadline - now)
+                now = self.clock()
+
+            self.stats.jitter.record(now - deadline)
+            self.elapsed = deadline - previous
+            previous = deadline
+            try:
+                scan()
+            finally:
+                finished = self.clock()
+                self.stats.execution.record(finished - now)
+                self.stats.scans += 1
+
+            deadline += self.period
+            if finished > deadline:
+                self.stats.overruns += 1
+                if self.policy == POLICY_SKIP:
+                    missed = math.floor((finished - deadline) / self.period) + 1
+                    self.stats.skipped += missed
+                    deadline += missed * self.period
+
+            if report is not None and report_interval > 0 and deadline >= next_report:
+                report(self.stats)
+                while next_report <= deadline:
+                    next_report += report_interval
+
+        return self.stats
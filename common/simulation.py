@@ -0,0 +1,135 @@
+"""
+Aloha Water Treatment Plant Headless Simulation
+Runs the plant engine on a virtual clock with scripted operator commands
+"""
+
+import numpy as np
+
+from plant_engine import PlantEngine
+from scan_scheduler import ScanScheduler, VirtualClock
+
+CONTROLS = ('pumpSwitch', 'emergencyStop', 'inflowMode', 'inflowRate', 'outflowRate')
+
+# Trajectory fields, named as in the HMI /update payload
+FIELDS = (
+    'tankVolume', 'inflowRate', 'outflowRate', 'pumpSwitchStatus', 'emergencyStopStatus',
+    'pumpStatus', 'inflowValveStatus', 'outflowValveStatus', 'inflowMode', 'overflowed',
+    'lowLevelAlarm', 'operatorErrorAlarm'
+)
+ALARM_FIELDS = ('overflowed', 'lowLevelAlarm', 'operatorErrorAlarm')
+
+# Tolerance for matching command times against accumulated virtual time
+TIME_EPSILON = 1e-9
+
+
+class Command:
+    def __init__(self, time, control, value, plant=None):
+        if control not in CONTROLS:
+            raise ValueError(f"Unknown control '{control}', expected one of {CONTROLS}")
+        self.time = float(time)
+        self.control = control
+        self.value = int(value)
+        self.plant = plant
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry['time'], entry['control'], entry['value'], entry.get('plant'))
+
+
+class Trajectory:
+    """
+    Plant state after every scan: times[k] is the virtual time at the end of
+    scan k and fields[name][k, i] the value for plant i
+    """
+
+    def __init__(self, steps, plants):
+        self.times = np.zeros(steps, dtype=np.float64)
+        self.fields = {name: np.zeros((steps, plants), dtype=np.int64) for name in FIELDS}
+        self.length = 0
+
+    def record(self, time, engine):
+        k = self.length
+        self.times[k] = time
+        fields = self.fields
+        fields['tankVolume'][k] = np.trunc(engine.level)
+        fields['inflowRate'][k] = engine.in_flow
+        fields['outflowRate'][k] = engine.out_flow
+        fields['pumpSwitchStatus'][k] = engine.switch
+        fields['emergencyStopStatus'][k] = engine.estop
+        fields['pumpStatus'][k] = engine.pump
+        fields['inflowValveStatus'][k] = engine.in_valve
+        fields['outflowValveStatus'][k] = engine.out_valve
+        fields['inflowMode'][k] = engine.manual
+        fields['overflowed'][k] = engine.overflow_alarm
+        fields['lowLevelAlarm'][k] = engine.low_level_alarm
+        fields['operatorErrorAlarm'][k] = engine.operator_error_alarm
+        self.length += 1
+
+    def alarm_events(self):
+        """
+        List of (time, plant, alarm, state) for every alarm transition
+        """
+        events = []
+        for name in ALARM_FIELDS:
+            values = self.fields[name][:self.length]
+            previous = np.vstack([np.zeros((1, values.shape[1]), dtype=values.dtype), values[:-1]])
+            steps, plants = np.nonzero(values != previous)
+            for k, i in zip(steps.tolist(), plants.tolist()):
+                events.append((float(self.times[k]), i, name, int(values[k, i])))
+        events.sort()
+        return events
+
+    def rows(self):
+        plants = self.fields['tankVolume'].shape[1]
+        for k in range(self.length):
+            for i in range(plants):
+                row = {'time': round(float(self.times[k]), 6), 'plant': i}
+                for name in FIELDS:
+                    row[name] = int(self.fields[name][k, i])
+                yield row
+
+
+class Simulation:
+    def __init__(self, plants=1, period=1.0, initial_level=0):
+        self.engine = PlantEngine(plants)
+        self.engine.level[:] = initial_level
+        self.clock = VirtualClock()
+        self.scheduler = ScanScheduler(period, clock=self.clock, sleep=self.clock.sleep)
+
+    def apply(self, command):
+        engine = self.engine
+        target = slice(None) if command.plant is None else command.plant
+        if command.control == 'pumpSwitch':
+            engine.switch[target] = bool(command.value)
+        elif command.control == 'emergencyStop':
+            engine.estop[target] = bool(command.value)
+        elif command.control == 'inflowMode':
+            engine.manual[target] = bool(command.value)
+        elif command.control == 'inflowRate':
+            engine.in_flow[target] = command.value
+        elif command.control == 'outflowRate':
+            engine.out_flow[target] = command.value
+
+    def run(self, duration, commands=()):
+        """
+        Simulate duration seconds of virtual time, applying each command at
+        the first scan at or after its time, and return the Trajectory
+        """
+        pending = sorted(commands, key=lambda command: command.time)
+        period = self.scheduler.period
+        steps = int(round(duration / period))
+        trajectory = Trajectory(steps, self.engine.count)
+        start = self.clock()
+        next_command = 0
+
+        def scan():
+            nonlocal next_command
+            elapsed = self.clock() - start
+            while next_command < len(pending) and pending[next_command].time <= elapsed + TIME_EPSILON:
+                self.apply(pending[next_command])
+                next_command += 1
+            self.engine.step(period)
+            trajectory.record(elapsed + period, self.engine)
+
+        self.scheduler.run(scan, lambda: trajectory.length < steps)
+        return trajectory
@@ -0,0 +1,121 @@
+"""
+Aloha Water Treatment Plant State Stream
+Versioned HMI state snapshots, served as JSON and fanned out to browsers as
+Server-Sent Events
+"""
+
+import asyncio
+import json
+import threading
+import types
+import uuid
+
+KEEPALIVE_INTERVAL = 15.0
+
+
+def encode(payload):
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def format_event(version, body):
+    return b"id: " + str(version).encode() + b"\ndata: " + body + b"\n\n"
+
+
+class Snapshot:
+    """
+    One published version of the HMI state. state is read-only and body is
+    the state already serialized as JSON, so readers never see a partly
+    updated cycle and never serialize it themselves.
+    """
+
+    def __init__(self, version, state, etag):
+        self.version = version
+        self.state = types.MappingProxyType(state)
+        self.etag = etag
+        self.body = encode(state)
+        self.event = format_event(version, self.body)
+
+
+class StateBroadcaster:
+    """
+    Holds the latest Snapshot. Each publish that changes something creates a
+    new Snapshot and a delta event of the changed fields, both serialized
+    once, and wakes every connected stream to send one of them.
+    """
+
+    def __init__(self, initial, keepalive=KEEPALIVE_INTERVAL):
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        # Distinguishes ETags across HMI restarts, when versions start over
+        self.epoch = uuid.uuid4().hex[:8]
+        self.snapshot = Snapshot(1, dict(initial), f"{self.epoch}-1")
+        self.delta_event = None
+        # (loop, asyncio.Event) of every stream_async client
+        self.async_waiters = set()
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def publish(self, data):
+        with self.condition:
+            current = self.snapshot.state
+            changes = {key: value for key, value in data.items() if key not in current or current[key] != value}
+            if not changes:
+                return False
+            version = self.snapshot.version + 1
+            self.delta_event = format_event(version, encode(changes))
+            self.snapshot = Snapshot(version, dict(data), f"{self.epoch}-{version}")
+            self.condition.notify_all()
+            for loop, event in self.async_waiters:
+                loop.call_soon_threadsafe(event.set)
+            return True
+
+    def _next_message(self, seen):
+        snapshot = self.snapshot
+        if snapshot.version == seen:
+            message = b": keepalive\n\n"
+        elif snapshot.version == seen + 1 and seen > 0:
+            message = self.delta_event
+        else:
+            message = snapshot.event
+        return message, snapshot.version
+
+    def stream(self):
+        """
+        Generator of SSE messages for one client: the full state first, then
+        only the fields that changed, or a full snapshot again if the client
+        fell more than one version behind
+        """
+        seen = 0
+        while True:
+            with self.condition:
+                if self.snapshot.version == seen:
+                    self.condition.wait(self.keepalive)
+                message, seen = self._next_message(seen)
+            yield message
+
+    async def stream_async(self):
+        """
+        stream() for asyncio servers; waits on the event loop instead of
+        blocking a thread per client
+        """
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self.condition:
+            self.async_waiters.add(waiter)
+        try:
+            seen = 0
+            while True:
+                if self.snapshot.version == seen:
+                    try:
+                        await asyncio.wait_for(event.wait(), self.keepalive)
+                    except asyncio.TimeoutError:
+                        pass
+                event.clear()
+                with self.condition:
+                    message, seen = self._next_message(seen)
+                yield message
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
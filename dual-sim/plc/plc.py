@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant PLC Simulation
+One plant served over Modbus TCP and BACnet/IP at the same time
+"""
+
+import asyncio
+import signal
+import sys
+import os
+import time
+from threading import Thread, Event
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+# Both PLC directories have a plc_logic module; the Modbus one goes first, as
+# the scan runs the Modbus control logic over the Modbus process image
+sys.path.insert(0, os.path.join(ROOT, "common"))
+sys.path.insert(0, os.path.join(ROOT, "modbus-sim", "plc"))
+sys.path.append(os.path.join(ROOT, "bacnet-sim", "plc"))
+
+import BAC0
+from bacpypes3.basetypes import PriorityValue
+from pymodbus.server import ModbusTcpServer
+import plc as modbus_plc
+from plc_logic import (
+    plc_logic, HR_LEVEL, HR_IN_FLOW, HR_OUT_FLOW, HR_ALARM, COIL_ESTOP, COIL_SWITCH, COIL_PUMP,
+    COIL_IN_VALVE, COIL_OUT_VALVE, COIL_AUTO, COIL_LOW_LEVEL_ALARM, COIL_OPERATOR_ERROR_ALARM
+)
+from traffic_log import TrafficRecorder
+from bacnet_objects import BACNET_DEVICE_ID, create_bacnet_objects, describe_device
+from shadow_state import ShadowState
+from scan_scheduler import ScanScheduler
+from plant_engine import PlantEngine
+from history_store import HistoryWriter
+from metrics import Registry, serve
+import profiling
+
+BACNET_IP = os.getenv("BACNET_IP", "127.0.0.1/24")
+
+# BACnet object -> (process image block, address) holding the same point
+BACNET_POINTS = {
+    'tankLevel': ('holding_registers', HR_LEVEL),
+    'inflowRate': ('holding_registers', HR_IN_FLOW),
+    'outflowRate': ('holding_registers', HR_OUT_FLOW),
+    'overflowAlarm': ('holding_registers', HR_ALARM),
+    'emergencyStop': ('coils', COIL_ESTOP),
+    'pumpSwitch': ('coils', COIL_SWITCH),
+    'autoMode': ('coils', COIL_AUTO),
+    'pumpStatus': ('coils', COIL_PUMP),
+    'inflowValve': ('coils', COIL_IN_VALVE),
+    'outflowValve': ('coils', COIL_OUT_VALVE),
+    'lowLevelAlarm': ('coils', COIL_LOW_LEVEL_ALARM),
+    'operatorErrorAlarm': ('coils', COIL_OPERATOR_ERROR_ALARM),
+}
+ANALOG_POINTS = ('tankLevel', 'inflowRate', 'outflowRate')
+
+is_active = True
+
+
+class BACnetBridge:
+    """
+    Keeps the plant's BACnet objects in step with its Modbus process image.
+    Before a scan, points that differ from what the last scan published were
+    written by a client: an image value changed by a Modbus client releases
+    any BACnet commands on the object, and a presentValue changed by a
+    BACnet client is copied into the image. After the scan the whole image
+    is published to the objects.
+    """
+
+    def __init__(self, shadow, image):
+        self.shadow = shadow
+        self.image = image
+        self.published = dict(shadow.values)
+
+    def apply_writes(self):
+        for key, (block, address) in BACNET_POINTS.items():
+            values = getattr(self.image, block)
+            if values[address] != self.published[key]:
+                self.relinquish(key)
+            elif self.shadow[key] != self.published[key]:
+                values[address] = int(self.shadow[key])
+
+    def relinquish(self, key):
+        # Published values go in at priority 16, so a client command held at
+        # a higher priority would otherwise keep hiding the Modbus write
+        obj = self.shadow.objects[key]
+        priority_array = getattr(obj, 'priorityArray', None)
+        if priority_array is None:
+            return
+        held = [index for index in range(15) if priority_array[index].null is None]
+        for index in held:
+            priority_array[index] = PriorityValue(null=())
+        if held:
+            # The commandable write path is a coroutine, and awaiting it would
+            # let requests in mid-scan; recalculate presentValue as it would,
+            # rather than rely on the array doing so on assignment
+            obj.recalculating()
+
+    def publish(self):
+        for key, (block, address) in BACNET_POINTS.items():
+            value = getattr(self.image, block)[address]
+            value = int(value) if key in ANALOG_POINTS else bool(value)
+            self.shadow[key] = value
+            self.published[key] = value
+
+
+class DualStackServer:
+    """
+    Runs the Modbus TCP server and the BACnet application on one event loop
+    in a background thread. The scan is run on that loop too, so no request
+    from either protocol is handled in the middle of a scan.
+    """
+
+    def __init__(self, context, identity, recorder=None, trace_pdu=None, trace_connect=None):
+        self.context = context
+        self.identity = identity
+        self.recorder = recorder
+        self.trace_pdu = trace_pdu
+        self.trace_connect = trace_connect
+        self.loop = None
+        self.objects = None
+        self.ready = Event()
+        self.thread = Thread(target=asyncio.run, args=(self._serve(),), daemon=True)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        BAC0.log_level('silence')
+        bacnet = BAC0.start(ip=BACNET_IP, deviceId=BACNET_DEVICE_ID)
+        describe_device(bacnet)
+        factories, self.objects = create_bacnet_objects()
+        for factory in factories:
+            factory.add_objects_to_application(bacnet)
+
+        server = ModbusTcpServer(
+            self.context,
+            identity=self.identity,
+            address=(modbus_plc.MODBUS_HOST, modbus_plc.MODBUS_PORT),
+            trace_pdu=self.trace_pdu,
+            trace_connect=self.trace_connect
+        )
+        if self.recorder:
+            self.recorder.attach(server)
+        await server.serve_forever(background=True)
+        self.ready.set()
+
+        await self.stopping.wait()
+        await server.shutdown()
+        await bacnet.disconnect()
+
+    def start(self):
+        """
+        Start both servers and wait until they are listening. Returns False if
+        either could not start.
+        """
+        self.thread.start()
+        while not self.ready.wait(0.05):
+            if not self.thread.is_alive():
+                return False
+        return True
+
+    def call(self, function):
+        """
+        Run function on the servers' loop and return its result
+        """
+        async def run():
+            return function()
+        return asyncio.run_coroutine_threadsafe(run(), self.loop).result()
+
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join(timeout=5)
+
+
+def handle_signal(sig, frame):
+    global is_active
+    print("\nShutting down...")
+    is_active = False
+
+
+def run_dual_plc():
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    modbus_context, device, plants = modbus_plc.setup_modbus_server(1)
+    plant = plants[0]
+
+    recorder = TrafficRecorder(modbus_plc.TRAFFIC_LOG) if modbus_plc.TRAFFIC_LOG else None
+    if recorder:
+        print(f"Capturing Modbus traffic to {modbus_plc.TRAFFIC_LOG}")
+
+    metrics = Registry() if modbus_plc.METRICS_PORT else None
+    server_metrics = modbus_plc.ServerMetrics(metrics) if metrics else None
+    server = DualStackServer(
+        modbus_context,
+        device,
+        recorder,
+        server_metrics.trace_pdu if server_metrics else None,
+        server_metrics.trace_connect if server_metrics else None
+    )
+    if not server.start():
+        print(f"PLC did not start on Modbus {modbus_plc.MODBUS_HOST}:{modbus_plc.MODBUS_PORT} "
+              f"and BACnet {BACNET_IP}")
+        sys.exit(1)
+
+    bridge = server.call(lambda: BACnetBridge(ShadowState(server.objects), plant.image))
+    print(f"PLC running on Modbus port {modbus_plc.MODBUS_PORT} and BACnet device {BACNET_DEVICE_ID} at {BACNET_IP}")
+
+    scheduler = ScanScheduler(modbus_plc.SCAN_PERIOD_MS / 1000.0, modbus_plc.SCAN_OVERRUN_POLICY)
+    print(f"Scan period {modbus_plc.SCAN_PERIOD_MS:g} ms, overrun policy {modbus_plc.SCAN_OVERRUN_POLICY}")
+    if metrics:
+        modbus_plc.scan_metrics(metrics, scheduler.stats)
+        serve(metrics, modbus_plc.MODBUS_HOST, modbus_plc.METRICS_PORT, {'/state': modbus_plc.state_route([plant])})
+        print(f"Metrics on http://{modbus_plc.MODBUS_HOST}:{modbus_plc.METRICS_PORT}/metrics")
+
+    engine = PlantEngine(1)
+    history = HistoryWriter(modbus_plc.HISTORY_DIR, 1) if modbus_plc.HISTORY_DIR else None
+    if history:
+        print(f"Recording history to {modbus_plc.HISTORY_DIR} ({history.scans} scans on disk)")
+
+    def scan_step():
+        plant.image.load()
+        bridge.apply_writes()
+        plc_logic([plant.image], engine, dt=scheduler.elapsed)
+        plant.image.flush()
+        bridge.publish()
+
+    def scan():
+        try:
+            server.call(scan_step)
+            if history:
+                history.append(time.time(), engine)
+        except Exception as e:
+            print(f"Error: {e}")
+
+    def report(stats):
+        print(f"Scan stats: {stats.summary()}")
+
+    profiler = profiling.from_env("dual-plc")
+    if profiler:
+        scan = profiler.wrap(scan)
+
+    try:
+        scheduler.run(scan, lambda: is_active, report, modbus_plc.SCAN_STATS_INTERVAL)
+    finally:
+        print(f"Scan stats: {scheduler.stats.summary()}")
+        if history:
+            history.close()
+        if recorder:
+            recorder.record_state(plant.unit_id, modbus_plc.plant_state(plant))
+            recorder.close()
+            print(f"Captured {recorder.records} Modbus records to {modbus_plc.TRAFFIC_LOG}")
+        server.stop()
+
+
+if __name__ == "__main__":
+    run_dual_plc()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant History Export
+Exports a time range of the history recorded by a PLC with HISTORY_DIR set
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "common"))
+from history_store import HistoryStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export recorded plant history as CSV or NPZ")
+    parser.add_argument("directory", help="history directory written by the PLC")
+    parser.add_argument("--start", type=float, help="first Unix timestamp to export (default first scan)")
+    parser.add_argument("--end", type=float, help="last Unix timestamp to export (default last scan)")
+    parser.add_argument("--plant", type=int, action="append", help="plant index to export (CSV only, repeatable, default all)")
+    parser.add_argument("-o", "--output", default="-", help="output file (default stdout, CSV only)")
+    parser.add_argument("-f", "--format", choices=("csv", "npz"), default="csv")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.directory)
+    first, stop = store.range(args.start, args.end)
+    if args.plant and any(not 0 <= plant < store.plants for plant in args.plant):
+        parser.error(f"plant must be between 0 and {store.plants - 1}")
+
+    if args.format == "npz":
+        if args.output == "-":
+            parser.error("NPZ export needs an output file")
+        store.export_npz(args.output, args.start, args.end)
+    elif args.output == "-":
+        store.export_csv(sys.stdout, args.start, args.end, args.plant)
+    else:
+        with open(args.output, "w", newline="") as out:
+            store.export_csv(out, args.start, args.end, args.plant)
+
+    print(f"{stop - first} of {len(store)} scans exported", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
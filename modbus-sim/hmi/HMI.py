@@ -5,141 +5,249 @@ Flask web application for monitoring and controlling the treatment plant
 
 import threading
 import time
+import sys
 import os
 
-from flask import Flask, render_template, request, jsonify
-from pymodbus.client import ModbusTcpClient
+from flask import Flask, Response, render_template, request, jsonify, g
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from state_stream import StateBroadcaster
+from historian import Historian, parse_query, capacity_for
+from metrics import HMIMetrics, CONTENT_TYPE
+import profiling
+from register_map import (
+    REGISTER_COUNT, COIL_BASE, COIL_ESTOP, COIL_SWITCH, COIL_PUMP, COIL_IN_VALVE, COIL_OUT_VALVE, COIL_AUTO,
+    COIL_ALARM, COIL_LOW_LEVEL_ALARM, COIL_OPERATOR_ERROR_ALARM, HR_BASE, HR_LEVEL, HR_ESTOP, HR_SWITCH, HR_PUMP,
+    HR_IN_VALVE, HR_OUT_VALVE, HR_IN_FLOW, HR_OUT_FLOW, HR_AUTO, HR_ALARM, IR_BASE, IR_SEQUENCE, IR_SEQUENCE_END,
+    SNAPSHOT_COUNT, SNAPSHOT_RETRIES, WRITE_POINTS, CONTROL_FIELDS,
+    initial_state, apply_snapshot, write_batch, run_controls, contiguous_runs
+)
 
 FLASK_HOST = "0.0.0.0"
-FLASK_PORT = 8090
+FLASK_PORT = int(os.getenv("FLASK_PORT", "8090"))
 MODBUS_HOST = os.getenv("MODBUS_HOST", "127.0.0.1")
 MODBUS_PORT = int(os.getenv("MODBUS_PORT", "5020"))
-REGISTER_COUNT = 10
-TANK_MAX = 10000
-
-COIL_BASE = 0
-COIL_ESTOP = 0
-COIL_SWITCH = 1
-COIL_PUMP = 2
-COIL_IN_VALVE = 3
-COIL_OUT_VALVE = 4
-COIL_AUTO = 5
-COIL_ALARM = 6
-COIL_LOW_LEVEL_ALARM = 7
-COIL_OPERATOR_ERROR_ALARM = 8
-
-HR_BASE = 0
-HR_LEVEL = 0
-HR_ESTOP = 1
-HR_SWITCH = 2
-HR_PUMP = 3
-HR_IN_VALVE = 4
-HR_OUT_VALVE = 5
-HR_IN_FLOW = 6
-HR_OUT_FLOW = 7
-HR_AUTO = 8
-HR_ALARM = 9
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "0.5"))
+OPTIMISTIC_HOLD = 2.0
+# A week of samples at the poll interval unless set
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY") or capacity_for(POLL_INTERVAL))
 
 
 class ModbusClient:
     def __init__(self, server_ip, server_port):
-        self.client = ModbusTcpClient(host=server_ip, port=server_port)
-        self.client.connect()
+        self.server_ip = server_ip
+        self.server_port = server_port
+        # Created by start(); the client connects on its first request
+        self.client = None
+        # The sync client is not thread safe; the poller and writer share it
+        self.client_lock = threading.Lock()
+        
+        # Queued commands (last write per control wins) and the values shown
+        # for them until the PLC reports them back
+        self.pending = {}
+        self.optimistic = {}
+        self.pending_ready = threading.Condition()
         
-        self.thread = threading.Thread(target=self._read_data, daemon=True)
+        self.data = initial_state()
+        # The last values read from the PLC, without optimistic ones
+        self.reported = initial_state()
+        # Set once the PLC has been read successfully
+        self.ready = threading.Event()
+        self.broadcaster = StateBroadcaster(self.data)
+        self.historian = Historian(capacity=HISTORY_CAPACITY)
+        self.metrics = HMIMetrics()
+
+    def start(self):
+        """
+        Load pymodbus and start polling on background threads, so the web
+        server comes up without waiting for either
+        """
+        self.thread = threading.Thread(target=self._start, daemon=True)
         self.thread.start()
 
-        self.data = {
-            'emergencyStopStatus': None,
-            'pumpSwitchStatus': None,
-            'pumpStatus': None,
-            'inflowValveStatus': None,
-            'outflowValveStatus': None,
-            'overflowed': None,
-            'inflowMode': None,
-            'tankVolume': None,
-            'maxVolume': TANK_MAX,
-            'inflowRate': None,
-            'outflowRate': None,
-            'lowLevelAlarm': None,
-            'operatorErrorAlarm': None
-        }
+    def _start(self):
+        from pymodbus.client import ModbusTcpClient
+
+        self.client = ModbusTcpClient(host=self.server_ip, port=self.server_port)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        self._read_data()
 
     def _read_data(self):
         while True:
+            # Fill a new dict and swap it in whole so the cycle is published atomically
+            data = dict(self.reported)
+            fresh = False
+            
             try:
-                coil_response = self.client.read_coils(COIL_BASE, count=10)
-                if not coil_response.isError():
-                    coil_values = coil_response.bits
-                    self.data['emergencyStopStatus'] = int(coil_values[COIL_ESTOP]) if coil_values[COIL_ESTOP] is not None else None
-                    self.data['pumpSwitchStatus'] = int(coil_values[COIL_SWITCH]) if coil_values[COIL_SWITCH] is not None else None
-                    self.data['pumpStatus'] = int(coil_values[COIL_PUMP]) if coil_values[COIL_PUMP] is not None else None
-                    self.data['inflowValveStatus'] = int(coil_values[COIL_IN_VALVE]) if coil_values[COIL_IN_VALVE] is not None else None
-                    self.data['outflowValveStatus'] = int(coil_values[COIL_OUT_VALVE]) if coil_values[COIL_OUT_VALVE] is not None else None
-                    self.data['overflowed'] = int(coil_values[COIL_ALARM]) if coil_values[COIL_ALARM] is not None else None
-                    self.data['inflowMode'] = int(coil_values[COIL_AUTO]) if coil_values[COIL_AUTO] is not None else None
-                    self.data['lowLevelAlarm'] = int(coil_values[COIL_LOW_LEVEL_ALARM]) if coil_values[COIL_LOW_LEVEL_ALARM] is not None else None
-                    self.data['operatorErrorAlarm'] = int(coil_values[COIL_OPERATOR_ERROR_ALARM]) if coil_values[COIL_OPERATOR_ERROR_ALARM] is not None else None
+                with self.client_lock:
+                    started = time.perf_counter()
+                    fresh = self._read_snapshot(data)
+                    if fresh is False:
+                        fresh = self._read_coils_and_registers(data)
+                    self.metrics.polled(time.perf_counter() - started)
             except Exception as e:
-                print(f"Error reading coils: {e}")
+                self.metrics.poll_errors.inc()
+                print(f"Error reading PLC: {e}")
+            
+            # History keeps only what the PLC reported this cycle
+            if fresh:
+                self.reported = dict(data)
+                self.historian.record(data)
+                self.ready.set()
+            self._apply_optimistic(data)
+            self.data = data
+            self.broadcaster.publish(data)
+            time.sleep(POLL_INTERVAL)
+
+    def _read_snapshot(self, data):
+        """
+        Read the PLC's input register snapshot in one request. Returns False
+        if the PLC does not publish one, so the caller can fall back to
+        reading coils and holding registers, and None if no consistent
+        snapshot could be read, leaving data as it was.
+        """
+        for _ in range(SNAPSHOT_RETRIES):
+            response = self.client.read_input_registers(IR_BASE, count=SNAPSHOT_COUNT)
+            if response.isError():
+                return False
+            snapshot = response.registers
+            if snapshot[IR_SEQUENCE] == 0:
+                return False
+            if snapshot[IR_SEQUENCE] != snapshot[IR_SEQUENCE_END]:
+                continue
+            
+            apply_snapshot(data, snapshot)
+            return True
+        # Every attempt straddled a scan; keep the previous values this cycle
+        return None
 
+    def _read_coils_and_registers(self, data):
+        """
+        Read coils and holding registers into data. Returns whether both
+        reads succeeded.
+        """
+        read = 0
+        try:
+            coil_response = self.client.read_coils(COIL_BASE, count=10)
+            if not coil_response.isError():
+                coil_values = coil_response.bits
+                data['emergencyStopStatus'] = int(coil_values[COIL_ESTOP]) if coil_values[COIL_ESTOP] is not None else None
+                data['pumpSwitchStatus'] = int(coil_values[COIL_SWITCH]) if coil_values[COIL_SWITCH] is not None else None
+                data['pumpStatus'] = int(coil_values[COIL_PUMP]) if coil_values[COIL_PUMP] is not None else None
+                data['inflowValveStatus'] = int(coil_values[COIL_IN_VALVE]) if coil_values[COIL_IN_VALVE] is not None else None
+                data['outflowValveStatus'] = int(coil_values[COIL_OUT_VALVE]) if coil_values[COIL_OUT_VALVE] is not None else None
+                data['overflowed'] = int(coil_values[COIL_ALARM]) if coil_values[COIL_ALARM] is not None else None
+                data['inflowMode'] = int(coil_values[COIL_AUTO]) if coil_values[COIL_AUTO] is not None else None
+                data['lowLevelAlarm'] = int(coil_values[COIL_LOW_LEVEL_ALARM]) if coil_values[COIL_LOW_LEVEL_ALARM] is not None else None
+                data['operatorErrorAlarm'] = int(coil_values[COIL_OPERATOR_ERROR_ALARM]) if coil_values[COIL_OPERATOR_ERROR_ALARM] is not None else None
+                read += 1
+        except Exception as e:
+            print(f"Error reading coils: {e}")
+
+        try:
+            hr_response = self.client.read_holding_registers(HR_BASE, count=REGISTER_COUNT)
+            if not hr_response.isError():
+                hr_values = hr_response.registers
+                data['tankVolume'] = hr_values[HR_LEVEL]
+                data['emergencyStopStatus'] = hr_values[HR_ESTOP]
+                data['pumpSwitchStatus'] = hr_values[HR_SWITCH]
+                data['pumpStatus'] = hr_values[HR_PUMP]
+                data['inflowValveStatus'] = hr_values[HR_IN_VALVE]
+                data['outflowValveStatus'] = hr_values[HR_OUT_VALVE]
+                data['inflowRate'] = hr_values[HR_IN_FLOW]
+                data['outflowRate'] = hr_values[HR_OUT_FLOW]
+                data['inflowMode'] = hr_values[HR_AUTO]
+                data['overflowed'] = hr_values[HR_ALARM]
+                read += 1
+        except Exception as e:
+            print(f"Error reading registers: {e}")
+        return read == 2
+
+    def _apply_optimistic(self, data):
+        now = time.monotonic()
+        with self.pending_ready:
+            for field, (value, expires) in list(self.optimistic.items()):
+                if data[field] == value or now > expires:
+                    del self.optimistic[field]
+                else:
+                    data[field] = value
+
+    def _write_loop(self):
+        while True:
+            with self.pending_ready:
+                while not self.pending:
+                    self.pending_ready.wait()
+                batch = self.pending
+                self.pending = {}
+            
+            registers, coils = write_batch(batch)
+            rejected = set()
+            
             try:
-                hr_response = self.client.read_holding_registers(HR_BASE, count=REGISTER_COUNT)
-                if not hr_response.isError():
-                    hr_values = hr_response.registers
-                    self.data['tankVolume'] = hr_values[HR_LEVEL]
-                    self.data['emergencyStopStatus'] = hr_values[HR_ESTOP]
-                    self.data['pumpSwitchStatus'] = hr_values[HR_SWITCH]
-                    self.data['pumpStatus'] = hr_values[HR_PUMP]
-                    self.data['inflowValveStatus'] = hr_values[HR_IN_VALVE]
-                    self.data['outflowValveStatus'] = hr_values[HR_OUT_VALVE]
-                    self.data['inflowRate'] = hr_values[HR_IN_FLOW]
-                    self.data['outflowRate'] = hr_values[HR_OUT_FLOW]
-                    self.data['inflowMode'] = hr_values[HR_AUTO]
-                    self.data['overflowed'] = hr_values[HR_ALARM]
+                with self.client_lock:
+                    for address, values in contiguous_runs(registers):
+                        if len(values) == 1:
+                            result = self.client.write_register(address, values[0], device_id=1)
+                        else:
+                            result = self.client.write_registers(address, values, device_id=1)
+                        if result.isError():
+                            print(f"Error writing registers at {address}: {result}")
+                            rejected |= run_controls(address, len(values))
+                    for address, values in contiguous_runs(coils):
+                        if len(values) == 1:
+                            result = self.client.write_coil(address, values[0], device_id=1)
+                        else:
+                            result = self.client.write_coils(address, values, device_id=1)
+                        if result.isError():
+                            print(f"Error writing coils at {address}: {result}")
+                            rejected |= run_controls(address, len(values), coils=True)
             except Exception as e:
-                print(f"Error reading registers: {e}")
-                
-            time.sleep(1)
+                print(f"Error writing to PLC: {e}")
+                # Keep the batch for the next attempt unless newer commands replaced it
+                with self.pending_ready:
+                    self.pending = {**batch, **self.pending}
+                time.sleep(POLL_INTERVAL)
+                continue
+            
+            if rejected:
+                self._reject(batch, rejected)
+
+    def _reject(self, batch, controls):
+        """
+        Stop showing commands the PLC rejected, unless a newer command for
+        the same control is already queued
+        """
+        self.metrics.write_errors.inc(amount=len(controls))
+        with self.pending_ready:
+            for control in controls:
+                field = CONTROL_FIELDS[control]
+                if control not in self.pending and field in self.optimistic \
+                        and self.optimistic[field][0] == batch[control]:
+                    del self.optimistic[field]
 
     def write_data(self, control, value):
-        print(f"Command: {control}={value}")
         try:
             if self.data['inflowMode'] == 0:
                 if control in ['outflowRate', 'inflowRate']:
                     return jsonify({"error": "Flow rates are auto-controlled in auto mode"}), 400
             
-            if control == 'emergencyStop':
-                result = self.client.write_register(HR_ESTOP, value, device_id=1)
-                print(f"Write register result: {result}")
-                result = self.client.write_coil(COIL_ESTOP, bool(value), device_id=1)
-                print(f"Write coil result: {result}")
-                
-            elif control == 'inflowRate':
-                result = self.client.write_register(HR_IN_FLOW, int(value), device_id=1)
-                print(f"Write register result: {result}")
-                
-            elif control == 'outflowRate':
-                result = self.client.write_register(HR_OUT_FLOW, int(value), device_id=1)
-                print(f"Write register result: {result}")
-                
-            elif control == 'pumpSwitch':
-                result = self.client.write_register(HR_SWITCH, value, device_id=1)
-                print(f"Write register result: {result}")
-                result = self.client.write_coil(COIL_SWITCH, bool(value), device_id=1)
-                print(f"Write coil result: {result}")
-                
-            elif control == 'inflowMode':
-                result = self.client.write_register(HR_AUTO, value, device_id=1)
-                print(f"Write register result: {result}")
-                result = self.client.write_coil(COIL_AUTO, bool(value), device_id=1)
-                print(f"Write coil result: {result}")
-                
-            else:
+            if control not in WRITE_POINTS:
                 return jsonify({"error": "Unknown control"}), 400
-                
-            print("Command sent")
-            return jsonify({"success": "Command sent"}), 200
+            
+            value = int(value)
+            field = CONTROL_FIELDS[control]
+            with self.pending_ready:
+                self.pending[control] = value
+                self.optimistic[field] = (value, time.monotonic() + OPTIMISTIC_HOLD)
+                self.pending_ready.notify()
+            
+            data = dict(self.data)
+            data[field] = value
+            self.data = data
+            self.broadcaster.publish(data)
+            
+            return jsonify({"success": "Command queued"}), 202
             
         except Exception as e:
             print(f"Error: {e}")
@@ -156,6 +264,17 @@ app = Flask(__name__)
 modbus = ModbusClient(MODBUS_HOST, MODBUS_PORT)
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    modbus.metrics.request_done(request.path, time.perf_counter() - g.request_started)
+    return response
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -163,21 +282,42 @@ def index():
 
 @app.route('/update', methods=['GET'])
 def update():
-    return jsonify({
-        'tankVolume': modbus.data['tankVolume'],
-        'inflowRate': modbus.data['inflowRate'],
-        'outflowRate': modbus.data['outflowRate'],
-        'pumpSwitchStatus': modbus.data['pumpSwitchStatus'],
-        'emergencyStopStatus': modbus.data['emergencyStopStatus'],
-        'inflowValveStatus': modbus.data['inflowValveStatus'],
-        'outflowValveStatus': modbus.data['outflowValveStatus'],
-        'inflowMode': modbus.data['inflowMode'],
-        'overflowed': modbus.data['overflowed'],
-        'maxVolume': modbus.data['maxVolume'],
-        'lowLevelAlarm': modbus.data['lowLevelAlarm'],
-        'operatorErrorAlarm': modbus.data['operatorErrorAlarm'],
-        'pumpStatus': modbus.data['pumpStatus']
-    })
+    snapshot = modbus.broadcaster.snapshot
+    response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/ready')
+def ready():
+    # For readiness probes: /update answers before the PLC has been read
+    if not modbus.ready.is_set():
+        return jsonify({"error": "PLC not read yet"}), 503
+    return jsonify({"ready": True})
+
+
+@app.route('/stream')
+def stream():
+    return Response(
+        modbus.broadcaster.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/history')
+def history():
+    try:
+        query = parse_query(request.args, modbus.historian.tags)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(modbus.historian.query(**query))
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(modbus.metrics.registry.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/write', methods=['POST'])
@@ -203,5 +343,11 @@ def write():
         return jsonify({"error": "Invalid control"}), 400
 
 
+profiler = profiling.from_env("modbus-hmi")
+if profiler:
+    profiling.wrap_views(app, profiler)
+
+
 if __name__ == '__main__':
+    modbus.start()
     app.run(host=FLASK_HOST, port=FLASK_PORT)
\ No newline at end of file
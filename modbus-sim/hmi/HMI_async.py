@@ -0,0 +1,371 @@
+"""
+Aloha Water Treatment Plant HMI (asyncio)
+Quart web application that polls and controls the treatment plant from a
+single event loop, reconnecting to the PLC whenever it restarts
+"""
+
+import asyncio
+import time
+import sys
+import os
+
+from quart import Quart, Response, render_template, request, jsonify, make_response, g
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from state_stream import StateBroadcaster
+from historian import Historian, parse_query, capacity_for
+from metrics import HMIMetrics, CONTENT_TYPE
+import profiling
+from register_map import (
+    REGISTER_COUNT, COIL_BASE, COIL_ESTOP, COIL_SWITCH, COIL_PUMP, COIL_IN_VALVE, COIL_OUT_VALVE, COIL_AUTO,
+    COIL_ALARM, COIL_LOW_LEVEL_ALARM, COIL_OPERATOR_ERROR_ALARM, HR_BASE, HR_LEVEL, HR_ESTOP, HR_SWITCH, HR_PUMP,
+    HR_IN_VALVE, HR_OUT_VALVE, HR_IN_FLOW, HR_OUT_FLOW, HR_AUTO, HR_ALARM, IR_BASE, IR_SEQUENCE, IR_SEQUENCE_END,
+    SNAPSHOT_COUNT, SNAPSHOT_RETRIES, WRITE_POINTS, CONTROL_FIELDS,
+    initial_state, apply_snapshot, write_batch, run_controls, contiguous_runs
+)
+
+FLASK_HOST = "0.0.0.0"
+FLASK_PORT = int(os.getenv("FLASK_PORT", "8090"))
+MODBUS_HOST = os.getenv("MODBUS_HOST", "127.0.0.1")
+MODBUS_PORT = int(os.getenv("MODBUS_PORT", "5020"))
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "0.5"))
+RECONNECT_MIN = float(os.getenv("RECONNECT_MIN", "0.5"))
+RECONNECT_MAX = float(os.getenv("RECONNECT_MAX", "30"))
+REQUEST_TIMEOUT = 2.0
+OPTIMISTIC_HOLD = 2.0
+# A week of samples at the poll interval unless set
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY") or capacity_for(POLL_INTERVAL))
+
+COIL_FIELDS = {
+    'emergencyStopStatus': COIL_ESTOP,
+    'pumpSwitchStatus': COIL_SWITCH,
+    'pumpStatus': COIL_PUMP,
+    'inflowValveStatus': COIL_IN_VALVE,
+    'outflowValveStatus': COIL_OUT_VALVE,
+    'overflowed': COIL_ALARM,
+    'inflowMode': COIL_AUTO,
+    'lowLevelAlarm': COIL_LOW_LEVEL_ALARM,
+    'operatorErrorAlarm': COIL_OPERATOR_ERROR_ALARM,
+}
+
+REGISTER_FIELDS = {
+    'tankVolume': HR_LEVEL,
+    'emergencyStopStatus': HR_ESTOP,
+    'pumpSwitchStatus': HR_SWITCH,
+    'pumpStatus': HR_PUMP,
+    'inflowValveStatus': HR_IN_VALVE,
+    'outflowValveStatus': HR_OUT_VALVE,
+    'inflowRate': HR_IN_FLOW,
+    'outflowRate': HR_OUT_FLOW,
+    'inflowMode': HR_AUTO,
+    'overflowed': HR_ALARM,
+}
+
+# Raised by the async client when the PLC is gone or stops answering
+CONNECTION_ERRORS = (ModbusException, OSError, asyncio.TimeoutError)
+
+
+class AsyncModbusHMI:
+    """
+    Same behaviour as the threaded HMI's ModbusClient, but every PLC request
+    runs on the server's event loop. Request handlers only touch in-memory
+    state, so none of them ever waits on the PLC.
+    """
+
+    def __init__(self, server_ip, server_port):
+        self.host = server_ip
+        self.port = server_port
+        # Created by start(); the async client must be made on the running loop
+        self.client = None
+        self.tasks = []
+        # Keeps the poller's and writer's requests from interleaving
+        self.client_lock = asyncio.Lock()
+        self.connected = asyncio.Event()
+
+        # Queued commands (last write per control wins) and the values shown
+        # for them until the PLC reports them back
+        self.pending = {}
+        self.optimistic = {}
+        self.pending_ready = asyncio.Event()
+
+        self.data = initial_state()
+        # The last values read from the PLC, without optimistic ones
+        self.reported = initial_state()
+        # Set once the PLC has been read successfully
+        self.ready = asyncio.Event()
+        self.broadcaster = StateBroadcaster(self.data)
+        self.historian = Historian(capacity=HISTORY_CAPACITY)
+        self.metrics = HMIMetrics()
+
+    async def start(self):
+        # Reconnection is done by poll_loop with its own backoff
+        self.client = AsyncModbusTcpClient(
+            self.host, port=self.port, timeout=REQUEST_TIMEOUT, retries=0, reconnect_delay=0
+        )
+        self.tasks = [asyncio.create_task(self.poll_loop()), asyncio.create_task(self.write_loop())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.disconnect()
+
+    async def connect(self):
+        """
+        Connect to the PLC, retrying with exponential backoff until it answers
+        """
+        delay = RECONNECT_MIN
+        while not await self.client.connect():
+            self.metrics.poll_errors.inc()
+            print(f"PLC {self.host}:{self.port} unreachable, retrying in {delay:g}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+        print(f"Connected to PLC {self.host}:{self.port}")
+        self.connected.set()
+
+    def disconnect(self):
+        self.connected.clear()
+        self.client.close()
+
+    async def poll_loop(self):
+        while True:
+            if not self.client.connected:
+                self.disconnect()
+                await self.connect()
+
+            # Fill a new dict and swap it in whole so the cycle is published atomically
+            data = dict(self.reported)
+            try:
+                async with self.client_lock:
+                    started = time.perf_counter()
+                    fresh = await self._read_snapshot(data)
+                    if fresh is False:
+                        fresh = await self._read_coils_and_registers(data)
+                    self.metrics.polled(time.perf_counter() - started)
+            except CONNECTION_ERRORS as e:
+                self.metrics.poll_errors.inc()
+                print(f"Error reading PLC: {e}")
+                self.disconnect()
+                continue
+
+            # History keeps only what the PLC reported this cycle
+            if fresh:
+                self.reported = dict(data)
+                self.historian.record(data)
+                self.ready.set()
+            self._apply_optimistic(data)
+            self.data = data
+            self.broadcaster.publish(data)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _read_snapshot(self, data):
+        # True if read, False if the PLC has no snapshot, None if none was consistent
+        for _ in range(SNAPSHOT_RETRIES):
+            response = await self.client.read_input_registers(IR_BASE, count=SNAPSHOT_COUNT)
+            if response.isError():
+                return False
+            snapshot = response.registers
+            if snapshot[IR_SEQUENCE] == 0:
+                return False
+            if snapshot[IR_SEQUENCE] != snapshot[IR_SEQUENCE_END]:
+                continue
+            apply_snapshot(data, snapshot)
+            return True
+        # Every attempt straddled a scan; keep the previous values this cycle
+        return None
+
+    async def _read_coils_and_registers(self, data):
+        coil_response = await self.client.read_coils(COIL_BASE, count=10)
+        if not coil_response.isError():
+            for field, coil in COIL_FIELDS.items():
+                data[field] = int(coil_response.bits[coil])
+
+        hr_response = await self.client.read_holding_registers(HR_BASE, count=REGISTER_COUNT)
+        if not hr_response.isError():
+            for field, register in REGISTER_FIELDS.items():
+                data[field] = hr_response.registers[register]
+        return not coil_response.isError() and not hr_response.isError()
+
+    def _apply_optimistic(self, data):
+        now = time.monotonic()
+        for field, (value, expires) in list(self.optimistic.items()):
+            if data[field] == value or now > expires:
+                del self.optimistic[field]
+            else:
+                data[field] = value
+
+    async def write_loop(self):
+        while True:
+            await self.pending_ready.wait()
+            await self.connected.wait()
+            batch = self.pending
+            self.pending = {}
+            self.pending_ready.clear()
+
+            registers, coils = write_batch(batch)
+            rejected = set()
+            try:
+                async with self.client_lock:
+                    for address, values in contiguous_runs(registers):
+                        result = await self.client.write_registers(address, values, device_id=1)
+                        if result.isError():
+                            print(f"Error writing registers at {address}: {result}")
+                            rejected |= run_controls(address, len(values))
+                    for address, values in contiguous_runs(coils):
+                        result = await self.client.write_coils(address, values, device_id=1)
+                        if result.isError():
+                            print(f"Error writing coils at {address}: {result}")
+                            rejected |= run_controls(address, len(values), coils=True)
+            except CONNECTION_ERRORS as e:
+                print(f"Error writing to PLC: {e}")
+                # Keep the batch for the next connection unless newer commands replaced it
+                self.pending = {**batch, **self.pending}
+                self.pending_ready.set()
+                self.disconnect()
+                continue
+
+            if rejected:
+                self._reject(batch, rejected)
+
+    def _reject(self, batch, controls):
+        """
+        Stop showing commands the PLC rejected, unless a newer command for
+        the same control is already queued
+        """
+        self.metrics.write_errors.inc(amount=len(controls))
+        for control in controls:
+            field = CONTROL_FIELDS[control]
+            if control not in self.pending and field in self.optimistic \
+                    and self.optimistic[field][0] == batch[control]:
+                del self.optimistic[field]
+
+    def write_data(self, control, value):
+        try:
+            if self.data['inflowMode'] == 0:
+                if control in ['outflowRate', 'inflowRate']:
+                    return jsonify({"error": "Flow rates are auto-controlled in auto mode"}), 400
+
+            if control not in WRITE_POINTS:
+                return jsonify({"error": "Unknown control"}), 400
+
+            value = int(value)
+            field = CONTROL_FIELDS[control]
+            self.pending[control] = value
+            self.optimistic[field] = (value, time.monotonic() + OPTIMISTIC_HOLD)
+            self.pending_ready.set()
+
+            data = dict(self.data)
+            data[field] = value
+            self.data = data
+            self.broadcaster.publish(data)
+
+            return jsonify({"success": "Command queued"}), 202
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return jsonify({"error": str(e)}), 500
+
+
+app = Quart(__name__)
+
+modbus = AsyncModbusHMI(MODBUS_HOST, MODBUS_PORT)
+
+
+@app.before_serving
+async def start_plc_tasks():
+    await modbus.start()
+
+
+@app.after_serving
+async def stop_plc_tasks():
+    await modbus.stop()
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_time(response):
+    modbus.metrics.request_done(request.path, time.perf_counter() - g.request_started)
+    return response
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.route('/update', methods=['GET'])
+async def update():
+    snapshot = modbus.broadcaster.snapshot
+    response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return await response.make_conditional(request)
+
+
+@app.route('/ready')
+async def ready():
+    # For readiness probes: /update answers before the PLC has been read
+    if not modbus.ready.is_set():
+        return jsonify({"error": "PLC not read yet"}), 503
+    return jsonify({"ready": True})
+
+
+@app.route('/stream')
+async def stream():
+    response = await make_response(
+        modbus.broadcaster.stream_async(),
+        {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.timeout = None
+    return response
+
+
+@app.route('/history')
+async def history():
+    try:
+        query = parse_query(request.args, modbus.historian.tags)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Long ranges take milliseconds of NumPy work; keep them off the event loop
+    result = await asyncio.to_thread(modbus.historian.query, **query)
+    return jsonify(result)
+
+
+@app.route('/metrics')
+async def metrics():
+    return Response(modbus.metrics.registry.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/write', methods=['POST'])
+async def write():
+    if not request.is_json:
+        return jsonify({"error": "Expected JSON"}), 400
+
+    payload = await request.get_json()
+    control = payload.get('control')
+    if control is None:
+        return jsonify({"error": "Missing control parameter"}), 400
+
+    value = payload.get('value')
+    if value is None:
+        return jsonify({"error": "Missing value parameter"}), 400
+
+    if control in ['pumpSwitch', 'emergencyStop', 'inflowMode', 'inflowRate', 'outflowRate']:
+        return modbus.write_data(control, value)
+    else:
+        return jsonify({"error": "Invalid control"}), 400
+
+
+profiler = profiling.from_env("modbus-hmi-async")
+if profiler:
+    profiling.wrap_views(app, profiler)
+
+
+if __name__ == '__main__':
+    app.run(host=FLASK_HOST, port=FLASK_PORT, use_reloader=False)
@@ -0,0 +1,137 @@
+"""
+Aloha Water Treatment Plant HMI Register Map
+PLC addresses and the mapping between them and the HMI state, shared by the
+threaded and asyncio HMIs
+"""
+
+REGISTER_COUNT = 10
+TANK_MAX = 10000
+
+COIL_BASE = 0
+COIL_ESTOP = 0
+COIL_SWITCH = 1
+COIL_PUMP = 2
+COIL_IN_VALVE = 3
+COIL_OUT_VALVE = 4
+COIL_AUTO = 5
+COIL_ALARM = 6
+COIL_LOW_LEVEL_ALARM = 7
+COIL_OPERATOR_ERROR_ALARM = 8
+
+HR_BASE = 0
+HR_LEVEL = 0
+HR_ESTOP = 1
+HR_SWITCH = 2
+HR_PUMP = 3
+HR_IN_VALVE = 4
+HR_OUT_VALVE = 5
+HR_IN_FLOW = 6
+HR_OUT_FLOW = 7
+HR_AUTO = 8
+HR_ALARM = 9
+
+IR_BASE = 0
+IR_SEQUENCE = 0
+IR_LEVEL = 1
+IR_IN_FLOW = 2
+IR_OUT_FLOW = 3
+IR_STATUS = 4
+IR_SEQUENCE_END = 5
+SNAPSHOT_COUNT = 6
+SNAPSHOT_RETRIES = 2
+
+# Control -> (holding register, coil or None) written for it
+WRITE_POINTS = {
+    'emergencyStop': (HR_ESTOP, COIL_ESTOP),
+    'pumpSwitch': (HR_SWITCH, COIL_SWITCH),
+    'inflowMode': (HR_AUTO, COIL_AUTO),
+    'inflowRate': (HR_IN_FLOW, None),
+    'outflowRate': (HR_OUT_FLOW, None),
+}
+
+# Control -> state field shown as soon as the command is queued
+CONTROL_FIELDS = {
+    'emergencyStop': 'emergencyStopStatus',
+    'pumpSwitch': 'pumpSwitchStatus',
+    'inflowMode': 'inflowMode',
+    'inflowRate': 'inflowRate',
+    'outflowRate': 'outflowRate',
+}
+
+
+def initial_state():
+    return {
+        'emergencyStopStatus': None,
+        'pumpSwitchStatus': None,
+        'pumpStatus': None,
+        'inflowValveStatus': None,
+        'outflowValveStatus': None,
+        'overflowed': None,
+        'inflowMode': None,
+        'tankVolume': None,
+        'maxVolume': TANK_MAX,
+        'inflowRate': None,
+        'outflowRate': None,
+        'lowLevelAlarm': None,
+        'operatorErrorAlarm': None
+    }
+
+
+def apply_snapshot(data, snapshot):
+    """
+    Copy a consistent input register snapshot into data
+    """
+    status = snapshot[IR_STATUS]
+    data['tankVolume'] = snapshot[IR_LEVEL]
+    data['inflowRate'] = snapshot[IR_IN_FLOW]
+    data['outflowRate'] = snapshot[IR_OUT_FLOW]
+    data['emergencyStopStatus'] = (status >> COIL_ESTOP) & 1
+    data['pumpSwitchStatus'] = (status >> COIL_SWITCH) & 1
+    data['pumpStatus'] = (status >> COIL_PUMP) & 1
+    data['inflowValveStatus'] = (status >> COIL_IN_VALVE) & 1
+    data['outflowValveStatus'] = (status >> COIL_OUT_VALVE) & 1
+    data['inflowMode'] = (status >> COIL_AUTO) & 1
+    data['overflowed'] = (status >> COIL_ALARM) & 1
+    data['lowLevelAlarm'] = (status >> COIL_LOW_LEVEL_ALARM) & 1
+    data['operatorErrorAlarm'] = (status >> COIL_OPERATOR_ERROR_ALARM) & 1
+
+
+def write_batch(batch):
+    """
+    Split a control -> value batch into holding register and coil
+    address -> value dicts
+    """
+    registers = {}
+    coils = {}
+    for control, value in batch.items():
+        register, coil = WRITE_POINTS[control]
+        registers[register] = value
+        if coil is not None:
+            coils[coil] = bool(value)
+    return registers, coils
+
+
+def run_controls(address, count, coils=False):
+    """
+    Controls with a holding register (or coil) among the count addresses
+    from address
+    """
+    index = 1 if coils else 0
+    return {
+        control for control, points in WRITE_POINTS.items()
+        if points[index] is not None and address <= points[index] < address + count
+    }
+
+
+def contiguous_runs(points):
+    """
+    Split an address -> value dict into (start address, [values]) runs of
+    consecutive addresses
+    """
+    runs = []
+    for address in sorted(points):
+        if runs and runs[-1][0] + len(runs[-1][1]) == address:
+            runs[-1][1].append(points[address])
+        else:
+            runs.append((address, [points[address]]))
+    return runs
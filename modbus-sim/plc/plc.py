@@ -4,19 +4,42 @@ Aloha Water Treatment Plant PLC Simulation
 Modbus TCP server for water treatment process control
 """
 
+import asyncio
+import json
+import multiprocessing
 import signal
 import sys
 import os
 import time
 from threading import Thread, Event
 
-from pymodbus.server import StartTcpServer
+from pymodbus.server import ModbusTcpServer
 from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusDeviceContext
 from pymodbus import ModbusDeviceIdentification
 from plc_logic import plc_logic
+from process_image import ProcessImage
+from shared_datastore import SharedStore
+from traffic_log import TrafficRecorder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+from scan_scheduler import ScanScheduler
+from plant_engine import PlantEngine
+from history_store import HistoryWriter
+from metrics import Registry, ScanHistogram, ForwardedRegistry, answer_renders, serve
+import profiling
 
 MODBUS_HOST = os.getenv("MODBUS_HOST", "0.0.0.0")
 MODBUS_PORT = int(os.getenv("MODBUS_PORT", "5020"))
+PLANT_COUNT = int(os.getenv("PLANT_COUNT", "1"))
+UNIT_ID_MAX = 247
+SCAN_PERIOD_MS = float(os.getenv("SCAN_PERIOD_MS", "1000"))
+SCAN_OVERRUN_POLICY = os.getenv("SCAN_OVERRUN_POLICY", "skip")
+SCAN_STATS_INTERVAL = float(os.getenv("SCAN_STATS_INTERVAL", "0"))
+HISTORY_DIR = os.getenv("HISTORY_DIR")
+TRAFFIC_LOG = os.getenv("TRAFFIC_LOG")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Serve Modbus from a second process, sharing the registers through shared memory
+SERVER_PROCESS = os.getenv("SERVER_PROCESS", "0") != "0"
 REGISTER_COUNT = 15
 TANK_MAX = 10000
 RATE_MIN = 50
@@ -55,35 +78,66 @@ COIL_ALARM = 6
 COIL_LOW_LEVEL_ALARM = 7
 COIL_OPERATOR_ERROR_ALARM = 8
 
+BLOCKS_PER_PLANT = 4
+
 is_active = True
 server_started = Event()
 
 
-def setup_modbus_server():
-    holding_register_values = [
-        INIT_LEVEL, INIT_ESTOP, INIT_SWITCH, INIT_PUMP,
-        INIT_IN_VALVE, INIT_OUT_VALVE, INIT_IN_FLOW, 
-        INIT_OUT_FLOW, INIT_AUTO, INIT_ALARM
-    ]
-    
-    coil_values = [
-        INIT_ESTOP, INIT_SWITCH, INIT_PUMP,
-        INIT_IN_VALVE, INIT_OUT_VALVE, INIT_AUTO, INIT_ALARM,
-        0, 0
-    ]
-    
-    holding_registers = ModbusSequentialDataBlock(
-        0x00, 
-        [0] + holding_register_values + [0] * (REGISTER_COUNT - len(holding_register_values))
-    )
-    
-    coils = ModbusSequentialDataBlock(
-        0x00, 
-        [0] + coil_values + [0] * (REGISTER_COUNT - len(coil_values))
-    )
-    
-    input_registers = ModbusSequentialDataBlock(0x00, [0] * REGISTER_COUNT)
-    discrete_inputs = ModbusSequentialDataBlock(0x00, [0] * REGISTER_COUNT)
+class Plant:
+    """
+    One simulated plant: its own data blocks and process image, served under
+    its own Modbus unit ID. Its physics state lives in the shared PlantEngine.
+    With a SharedStore the data blocks live in it, plant n taking the
+    BLOCKS_PER_PLANT blocks after those of plant n - 1.
+    """
+
+    def __init__(self, unit_id, store=None):
+        self.unit_id = unit_id
+
+        holding_register_values = [
+            INIT_LEVEL, INIT_ESTOP, INIT_SWITCH, INIT_PUMP,
+            INIT_IN_VALVE, INIT_OUT_VALVE, INIT_IN_FLOW, 
+            INIT_OUT_FLOW, INIT_AUTO, INIT_ALARM
+        ]
+        
+        coil_values = [
+            INIT_ESTOP, INIT_SWITCH, INIT_PUMP,
+            INIT_IN_VALVE, INIT_OUT_VALVE, INIT_AUTO, INIT_ALARM,
+            0, 0
+        ]
+        
+        block_values = [
+            [0] + holding_register_values + [0] * (REGISTER_COUNT - len(holding_register_values)),
+            [0] + coil_values + [0] * (REGISTER_COUNT - len(coil_values)),
+            [0] * REGISTER_COUNT,
+            [0] * REGISTER_COUNT
+        ]
+        
+        if store is None:
+            blocks = [ModbusSequentialDataBlock(0x00, values) for values in block_values]
+        else:
+            first = (unit_id - 1) * BLOCKS_PER_PLANT
+            blocks = [store.block(first + index, values) for index, values in enumerate(block_values)]
+        self.holding_registers, self.coils, self.input_registers, self.discrete_inputs = blocks
+
+        self.context = ModbusDeviceContext(
+            di=self.discrete_inputs,
+            co=self.coils,
+            hr=self.holding_registers,
+            ir=self.input_registers
+        )
+
+        self.image = ProcessImage(
+            self.discrete_inputs, self.coils, self.holding_registers, self.input_registers, REGISTER_COUNT
+        )
+
+
+def setup_modbus_server(plant_count=PLANT_COUNT, store=None):
+    if not 1 <= plant_count <= UNIT_ID_MAX:
+        raise ValueError(f"Plant count must be between 1 and {UNIT_ID_MAX}, got {plant_count}")
+
+    plants = [Plant(unit_id, store) for unit_id in range(1, plant_count + 1)]
 
     device = ModbusDeviceIdentification()
     device.VendorName = "Aloha Water Treatment"
@@ -93,16 +147,136 @@ def setup_modbus_server():
     device.ModelName = "ATC-100"
     device.MajorMinorRevision = "1.0.0"
 
-    device_context = ModbusDeviceContext(
-        di=discrete_inputs,
-        co=coils,
-        hr=holding_registers,
-        ir=input_registers
-    )
-
-    modbus_context = ModbusServerContext(devices=device_context, single=True)
+    if plant_count == 1:
+        # A single plant answers on every unit ID, as a standalone PLC does
+        modbus_context = ModbusServerContext(devices=plants[0].context, single=True)
+    else:
+        modbus_context = ModbusServerContext(
+            devices={plant.unit_id: plant.context for plant in plants},
+            single=False
+        )
     
-    return modbus_context, device, discrete_inputs, coils, holding_registers, input_registers
+    return modbus_context, device, plants
+
+
+class ServerMetrics:
+    """
+    Request and exception counts per function code and the number of
+    connected clients, fed by the pymodbus server's trace hooks
+    """
+
+    def __init__(self, registry):
+        self.requests = registry.counter(
+            'modbus_requests_total', 'Modbus requests received', ('function',)
+        )
+        self.exceptions = registry.counter(
+            'modbus_exception_responses_total', 'Modbus exception responses sent', ('function',)
+        )
+        self.clients = registry.gauge('modbus_connected_clients', 'Open Modbus TCP connections')
+
+    def trace_pdu(self, sending, pdu):
+        if not sending:
+            self.requests.inc(pdu.function_code)
+        elif pdu.function_code & 0x80:
+            self.exceptions.inc(pdu.function_code & 0x7F)
+        return pdu
+
+    def trace_connect(self, connected):
+        self.clients.inc(amount=1 if connected else -1)
+
+
+def scan_metrics(registry, stats):
+    registry.counter('plc_scans_total', 'PLC scans run', function=lambda: stats.scans)
+    registry.counter('plc_scan_overruns_total', 'Scans that finished after the next deadline', function=lambda: stats.overruns)
+    registry.counter('plc_scans_skipped_total', 'Scan deadlines dropped after overruns', function=lambda: stats.skipped)
+    registry.add(ScanHistogram('plc_scan_duration_seconds', 'Scan execution time', lambda: stats.execution))
+    registry.add(ScanHistogram('plc_scan_jitter_seconds', 'Scan start delay after its deadline', lambda: stats.jitter))
+
+
+def plant_state(plant):
+    return {
+        'coils': plant.coils.getValues(1, REGISTER_COUNT),
+        'holding_registers': plant.holding_registers.getValues(1, REGISTER_COUNT),
+        'input_registers': plant.input_registers.getValues(1, REGISTER_COUNT),
+    }
+
+
+def state_route(plants):
+    """
+    /state on the metrics port: the registers of every plant by unit ID
+    """
+    def route():
+        state = {}
+        for plant in plants:
+            # Coils written by clients are stored as bools
+            registers = plant_state(plant)
+            state[str(plant.unit_id)] = {block: [int(value) for value in values] for block, values in registers.items()}
+        return 200, "application/json", json.dumps(state)
+    return route
+
+
+def serve_modbus(context, started=server_started, recorder=None, **kwargs):
+    """
+    Run the Modbus TCP server, setting started once it is listening. A
+    TrafficRecorder, if given, captures every connection's traffic.
+    """
+    async def serve():
+        server = ModbusTcpServer(context, **kwargs)
+        if recorder:
+            recorder.attach(server)
+        await server.serve_forever(background=True)
+        started.set()
+        await server.serving
+
+    asyncio.run(serve())
+
+
+def stop_server(sig, frame):
+    sys.exit(0)
+
+
+def serve_shared(spec, plant_count, started, metrics_connection=None):
+    """
+    Server process for SERVER_PROCESS: serves the plants in the SharedStore
+    attached to with spec until the scan process terminates it. Traffic is
+    captured and request metrics are counted here, as the requests never
+    reach the scan process; the scan process fetches the metrics over
+    metrics_connection when scraped.
+    """
+    # Ctrl+C reaches the whole process group; the scan process decides when this one stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop_server)
+
+    store = SharedStore(*spec)
+    modbus_context, device, plants = setup_modbus_server(plant_count, store)
+    recorder = TrafficRecorder(TRAFFIC_LOG) if TRAFFIC_LOG else None
+    server_metrics = None
+    if metrics_connection:
+        registry = Registry()
+        server_metrics = ServerMetrics(registry)
+        answer_renders(registry, metrics_connection)
+    try:
+        serve_modbus(
+            modbus_context,
+            started,
+            recorder,
+            identity=device,
+            address=(MODBUS_HOST, MODBUS_PORT),
+            trace_pdu=server_metrics.trace_pdu if server_metrics else None,
+            trace_connect=server_metrics.trace_connect if server_metrics else None
+        )
+    finally:
+        if recorder:
+            close_recorder(recorder, plants)
+        store.close()
+
+
+def close_recorder(recorder, plants):
+    # The final process state lets a replay diff where it ended up
+    for plant in plants:
+        recorder.record_state(plant.unit_id, plant_state(plant))
+    recorder.close()
+    print(f"Captured {recorder.records} Modbus records to {TRAFFIC_LOG}")
 
 
 def handle_signal(sig, frame):
@@ -118,39 +292,107 @@ def run_modbus_server():
     signal.signal(signal.SIGINT, handle_signal)
     signal.signal(signal.SIGTERM, handle_signal)
     
-    modbus_context, device, discrete_inputs, coils, holding_registers, input_registers = setup_modbus_server()
-
-    server_thread = Thread(
-        target=StartTcpServer,
-        kwargs={
-            'context': modbus_context,
-            'identity': device,
-            'address': (MODBUS_HOST, MODBUS_PORT),
-        },
-        daemon=True
-    )
-    server_thread.start()
+    store = SharedStore(PLANT_COUNT * BLOCKS_PER_PLANT, REGISTER_COUNT + 1) if SERVER_PROCESS else None
+    modbus_context, device, plants = setup_modbus_server(store=store)
+
+    if TRAFFIC_LOG:
+        print(f"Capturing Modbus traffic to {TRAFFIC_LOG}")
+    metrics = Registry() if METRICS_PORT else None
+
+    if store:
+        started = multiprocessing.Event()
+        recorder = None
+        metrics_connection = None
+        if metrics:
+            # Request metrics are counted in the server process and rendered there on scrape
+            connection, metrics_connection = multiprocessing.Pipe()
+            metrics.add(ForwardedRegistry(connection))
+        server = multiprocessing.Process(
+            target=serve_shared,
+            args=(store.spec(), len(plants), started, metrics_connection),
+            daemon=True
+        )
+    else:
+        started = server_started
+        recorder = TrafficRecorder(TRAFFIC_LOG) if TRAFFIC_LOG else None
+        server_metrics = ServerMetrics(metrics) if metrics else None
+        server = Thread(
+            target=serve_modbus,
+            args=(modbus_context,),
+            kwargs={
+                'recorder': recorder,
+                'identity': device,
+                'address': (MODBUS_HOST, MODBUS_PORT),
+                'trace_pdu': server_metrics.trace_pdu if server_metrics else None,
+                'trace_connect': server_metrics.trace_connect if server_metrics else None,
+            },
+            daemon=True
+        )
+    server.start()
     
-    time.sleep(1)
+    # The server ends early only if it could not listen
+    while not started.wait(0.05):
+        if not server.is_alive():
+            print(f"Modbus server did not start on {MODBUS_HOST}:{MODBUS_PORT}")
+            if store:
+                store.close()
+                store.unlink()
+            sys.exit(1)
     
-    server_started.set()
-    print(f"PLC running on port {MODBUS_PORT}")
+    if len(plants) == 1:
+        print(f"PLC running on port {MODBUS_PORT}")
+    else:
+        print(f"PLC fleet of {len(plants)} plants running on port {MODBUS_PORT} (unit IDs 1-{len(plants)})")
+    if store:
+        print(f"Modbus server in process {server.pid}, registers in shared memory {store.memory.name}")
     
+    scheduler = ScanScheduler(SCAN_PERIOD_MS / 1000.0, SCAN_OVERRUN_POLICY)
+    print(f"Scan period {SCAN_PERIOD_MS:g} ms, overrun policy {SCAN_OVERRUN_POLICY}")
+    if metrics:
+        scan_metrics(metrics, scheduler.stats)
+        serve(metrics, MODBUS_HOST, METRICS_PORT, {'/state': state_route(plants)})
+        print(f"Metrics on http://{MODBUS_HOST}:{METRICS_PORT}/metrics")
+
+    engine = PlantEngine(len(plants))
+    images = [plant.image for plant in plants]
+    history = HistoryWriter(HISTORY_DIR, len(plants)) if HISTORY_DIR else None
+    if history:
+        print(f"Recording history to {HISTORY_DIR} ({history.scans} scans on disk)")
+
+    def scan():
+        try:
+            for image in images:
+                image.load()
+            plc_logic(images, engine, dt=scheduler.elapsed)
+            for image in images:
+                image.flush()
+            if history:
+                history.append(time.time(), engine)
+        except Exception as e:
+            print(f"Error: {e}")
+
+    def report(stats):
+        print(f"Scan stats: {stats.summary()}")
+
+    profiler = profiling.from_env("modbus-plc")
+    if profiler:
+        scan = profiler.wrap(scan)
+
     try:
-        while is_active:
-            try:
-                discrete_inputs.setValues(0, discrete_inputs.getValues(0, REGISTER_COUNT + 1))
-                coils.setValues(0, coils.getValues(0, REGISTER_COUNT + 1))
-                holding_registers.setValues(0, holding_registers.getValues(0, REGISTER_COUNT + 1))
-                input_registers.setValues(0, input_registers.getValues(0, REGISTER_COUNT + 1))
-
-                plc_logic(discrete_inputs, coils, holding_registers, input_registers)
-            except Exception as e:
-                print(f"Error: {e}")
-                
-            time.sleep(1)
+        scheduler.run(scan, lambda: is_active, report, SCAN_STATS_INTERVAL)
     except KeyboardInterrupt:
         print("\nStopped")
+    finally:
+        print(f"Scan stats: {scheduler.stats.summary()}")
+        if history:
+            history.close()
+        if recorder:
+            close_recorder(recorder, plants)
+        if store:
+            server.terminate()
+            server.join()
+            store.close()
+            store.unlink()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,9 @@
 """
 Aloha Water Treatment Plant Control Logic
+Modbus front end for the shared plant engine
 """
 
-TANK_MAX = 10000
-RATE_MIN = 50
+import numpy as np
 
 HR_LEVEL = 0
 HR_ESTOP = 1
@@ -26,120 +26,73 @@ COIL_ALARM = 6
 COIL_LOW_LEVEL_ALARM = 7
 COIL_OPERATOR_ERROR_ALARM = 8
 
-tank_volume = 0
+REGISTER_COUNT = 10
+COIL_COUNT = 9
 
+# Input register snapshot of the whole plant, rewritten at the end of every
+# scan. The sequence number is repeated at both ends so a reader can detect
+# a read that straddles two scans. Status bit n holds coil n.
+IR_SEQUENCE = 0
+IR_LEVEL = 1
+IR_IN_FLOW = 2
+IR_OUT_FLOW = 3
+IR_STATUS = 4
+IR_SEQUENCE_END = 5
+SNAPSHOT_COUNT = 6
+SEQUENCE_MAX = 0xFFFF
+STATUS_BITS = 1 << np.arange(COIL_COUNT)
 
-def plc_logic(discrete_inputs, coils, holding_registers, input_registers):
-    global tank_volume
-    
-    register_count = 10
-    target_volume = int(2/3 * TANK_MAX)
 
-    hr_values = holding_registers.getValues(1, register_count)
-    level = hr_values[HR_LEVEL]
-    estop = hr_values[HR_ESTOP]
-    switch = hr_values[HR_SWITCH]
-    in_valve = hr_values[HR_IN_VALVE]
-    out_valve = hr_values[HR_OUT_VALVE]
-    in_flow = hr_values[HR_IN_FLOW]
-    out_flow = hr_values[HR_OUT_FLOW]
-    auto_mode = hr_values[HR_AUTO]
-    alarm = hr_values[HR_ALARM]
-    
-    coil_values = coils.getValues(1, 10)
-    coil_estop_value = coil_values[COIL_ESTOP]
-    coil_switch_value = coil_values[COIL_SWITCH]
-    coil_auto_value = coil_values[COIL_AUTO]
-    
-    if estop != coil_estop_value:
-        holding_registers.setValues(HR_ESTOP + 1, [coil_estop_value])
-        estop = coil_estop_value
-    
-    if switch != coil_switch_value:
-        holding_registers.setValues(HR_SWITCH + 1, [coil_switch_value])
-        switch = coil_switch_value
-    
-    if auto_mode != coil_auto_value:
-        holding_registers.setValues(HR_AUTO + 1, [coil_auto_value])
-        auto_mode = coil_auto_value
-    
-    pump = 0
-    
-    if switch and not estop:
-        pump = in_valve = out_valve = 1
-        
-        if auto_mode == 0:
-            out_flow = RATE_MIN
-            
-            if level <= 1000 and out_flow > 0:
-                out_flow = 0
-                out_valve = 0
-            
-            if level < target_volume:
-                deficit = target_volume - level
-                if deficit > 3000:
-                    in_flow = RATE_MIN + 80
-                elif deficit > 1500:
-                    in_flow = RATE_MIN + 40
-                elif deficit > 500:
-                    in_flow = RATE_MIN + 20
-                else:
-                    in_flow = RATE_MIN
-            else:
-                if level > target_volume + 500:
-                    in_flow = 0
-                else:
-                    in_flow = RATE_MIN
-        else:
-            pass
-    else:
-        pump = in_valve = out_valve = 0
-        in_flow = out_flow = 0
-    
-    if pump == 1:
-        tank_volume = level + (in_flow - out_flow)
-        
-        if tank_volume < 0:
-            tank_volume = 0
-        elif tank_volume > TANK_MAX:
-            alarm = 1
-            
-            if auto_mode == 0:
-                tank_volume = TANK_MAX
-                in_flow = 0
-                holding_registers.setValues(HR_IN_FLOW + 1, [0])
-            else:
-                tank_volume = TANK_MAX
-        elif tank_volume < TANK_MAX:
-            alarm = 0
-    else:
-        tank_volume = level
-    
-    holding_registers.setValues(HR_PUMP + 1, [pump])
-    coils.setValues(COIL_PUMP + 1, [pump])
-    
-    holding_registers.setValues(HR_LEVEL + 1, [tank_volume])
-    holding_registers.setValues(HR_IN_VALVE + 1, [in_valve])
-    holding_registers.setValues(HR_OUT_VALVE + 1, [out_valve])
-    holding_registers.setValues(HR_IN_FLOW + 1, [in_flow])
-    holding_registers.setValues(HR_OUT_FLOW + 1, [out_flow])
-    holding_registers.setValues(HR_ALARM + 1, [alarm])
-    
-    coils.setValues(COIL_IN_VALVE + 1, [in_valve])
-    coils.setValues(COIL_OUT_VALVE + 1, [out_valve])
-    coils.setValues(COIL_ALARM + 1, [alarm])
-    
-    low_level_alarm = 1 if (tank_volume <= 1000 and out_flow > 0) else 0
-    coils.setValues(COIL_LOW_LEVEL_ALARM + 1, [low_level_alarm])
-    
-    operator_error_alarm = 0
-    if auto_mode == 1:
-        requested_in_flow = hr_values[HR_IN_FLOW]
-        requested_out_flow = hr_values[HR_OUT_FLOW]
-        
-        if tank_volume <= 1000 and requested_out_flow > 0:
-            operator_error_alarm = 1
-        elif tank_volume >= 9000 and requested_in_flow > 0:
-            operator_error_alarm = 1
-    
-    coils.setValues(COIL_OPERATOR_ERROR_ALARM + 1, [operator_error_alarm])
+def plc_logic(images, engine, dt=1.0):
+    """
+    Run one scan for every plant. images[i] is the loaded ProcessImage of
+    plant i in the engine. Flow rates are per second, so the level changes by
+    (in_flow - out_flow) * dt where dt is the scheduled time since the last
+    scan in seconds.
+    """
+    hr = np.array([image.holding_registers.values[:REGISTER_COUNT] for image in images], dtype=np.int64)
+    co = np.array([image.coils.values[:COIL_COUNT] for image in images], dtype=np.int64)
+    ir = np.array([image.input_registers.values[:SNAPSHOT_COUNT] for image in images], dtype=np.int64)
+
+    # Coils are the operator command points, the holding registers mirror them
+    engine.estop = co[:, COIL_ESTOP] != 0
+    engine.switch = co[:, COIL_SWITCH] != 0
+    engine.manual = co[:, COIL_AUTO] != 0
+    engine.in_flow = hr[:, HR_IN_FLOW].copy()
+    engine.out_flow = hr[:, HR_OUT_FLOW].copy()
+    engine.overflow_alarm = hr[:, HR_ALARM] != 0
+    engine.sync_level(hr[:, HR_LEVEL])
+
+    engine.step(dt)
+
+    hr[:, HR_LEVEL] = np.trunc(engine.level)
+    hr[:, HR_ESTOP] = co[:, COIL_ESTOP]
+    hr[:, HR_SWITCH] = co[:, COIL_SWITCH]
+    hr[:, HR_PUMP] = engine.pump
+    hr[:, HR_IN_VALVE] = engine.in_valve
+    hr[:, HR_OUT_VALVE] = engine.out_valve
+    hr[:, HR_IN_FLOW] = engine.in_flow
+    hr[:, HR_OUT_FLOW] = engine.out_flow
+    hr[:, HR_AUTO] = co[:, COIL_AUTO]
+    hr[:, HR_ALARM] = engine.overflow_alarm
+
+    co[:, COIL_PUMP] = engine.pump
+    co[:, COIL_IN_VALVE] = engine.in_valve
+    co[:, COIL_OUT_VALVE] = engine.out_valve
+    co[:, COIL_ALARM] = engine.overflow_alarm
+    co[:, COIL_LOW_LEVEL_ALARM] = engine.low_level_alarm
+    co[:, COIL_OPERATOR_ERROR_ALARM] = engine.operator_error_alarm
+
+    # Sequence runs 1..SEQUENCE_MAX so 0 means no snapshot has been published
+    sequence = ir[:, IR_SEQUENCE] % SEQUENCE_MAX + 1
+    ir[:, IR_SEQUENCE] = sequence
+    ir[:, IR_LEVEL] = hr[:, HR_LEVEL]
+    ir[:, IR_IN_FLOW] = hr[:, HR_IN_FLOW]
+    ir[:, IR_OUT_FLOW] = hr[:, HR_OUT_FLOW]
+    ir[:, IR_STATUS] = (co != 0) @ STATUS_BITS
+    ir[:, IR_SEQUENCE_END] = sequence
+
+    for image, hr_row, co_row, ir_row in zip(images, hr.tolist(), co.tolist(), ir.tolist()):
+        image.holding_registers.values[:REGISTER_COUNT] = hr_row
+        image.coils.values[:COIL_COUNT] = co_row
+        image.input_registers.values[:SNAPSHOT_COUNT] = ir_row
@@ -0,0 +1,76 @@
+"""
+Aloha Water Treatment Plant Process Image
+Local copy of the Modbus datastore that the control logic works on each scan
+"""
+
+# pymodbus device contexts offset protocol addresses by one into the data blocks
+BLOCK_OFFSET = 1
+
+
+class BlockImage:
+    """
+    Image of one data block indexed by protocol address. load() reads the
+    block in a single call and flush() writes back only the ranges that
+    changed since the load, one setValues call per contiguous run.
+    """
+
+    def __init__(self, block, count):
+        self.block = block
+        self.count = count
+        self.values = [0] * count
+        self.loaded = [0] * count
+
+    def load(self):
+        # Blocks shorter than count come back truncated, so the image takes their size
+        self.values = list(self.block.getValues(BLOCK_OFFSET, self.count))
+        self.loaded = list(self.values)
+
+    def dirty_ranges(self):
+        ranges = []
+        start = None
+        for index in range(len(self.values)):
+            if self.values[index] != self.loaded[index]:
+                if start is None:
+                    start = index
+            elif start is not None:
+                ranges.append((start, index))
+                start = None
+        if start is not None:
+            ranges.append((start, len(self.values)))
+        return ranges
+
+    def flush(self):
+        ranges = self.dirty_ranges()
+        for start, end in ranges:
+            self.block.setValues(BLOCK_OFFSET + start, self.values[start:end])
+        self.loaded = list(self.values)
+        return len(ranges)
+
+    def __getitem__(self, address):
+        return self.values[address]
+
+    def __setitem__(self, address, value):
+        self.values[address] = value
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ProcessImage:
+    def __init__(self, discrete_inputs, coils, holding_registers, input_registers, count):
+        self.discrete_inputs = BlockImage(discrete_inputs, count)
+        self.coils = BlockImage(coils, count)
+        self.holding_registers = BlockImage(holding_registers, count)
+        self.input_registers = BlockImage(input_registers, count)
+        self.blocks = (self.discrete_inputs, self.coils, self.holding_registers, self.input_registers)
+
+    def load(self):
+        for block in self.blocks:
+            block.load()
+
+    def flush(self):
+        """
+        Write changed ranges back to the datastore and return the number of
+        setValues calls made
+        """
+        return sum(block.flush() for block in self.blocks)
@@ -0,0 +1,117 @@
+"""
+Aloha Water Treatment Plant Shared Datastore
+Modbus data blocks in shared memory, so the scan and the Modbus server can
+run in separate processes
+"""
+
+import array
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+SEQUENCE_BYTES = 8
+
+
+class SharedDataBlock(ModbusSequentialDataBlock):
+    """
+    ModbusSequentialDataBlock whose values are a view into a SharedStore.
+    Writers hold the store's lock and bump the block's sequence number
+    before and after writing, so it is odd while a write is in progress.
+    Readers take no lock: they copy the values and retry until the sequence
+    number was the same even value before and after the copy.
+    """
+
+    def __init__(self, store, sequence, values, address=0x00):
+        # values is the shared array itself, so the base initializer, which
+        # copies into a list, is not used
+        self.address = address
+        self.values = values
+        self.default_value = 0
+        # The segment is unmapped when its store is collected
+        self.store = store
+        self.sequence = sequence
+
+    def getValues(self, address, count=1):
+        start = address - self.address
+        while True:
+            sequence = self.sequence[0]
+            if not sequence & 1:
+                values = self.values[start:start + count].tolist()
+                if self.sequence[0] == sequence:
+                    return values
+            time.sleep(0)
+
+    def setValues(self, address, values):
+        if not isinstance(values, list):
+            values = [values]
+        start = address - self.address
+        # The block cannot grow; values past its end are dropped
+        values = array.array('H', values[:max(len(self.values) - start, 0)])
+        with self.store.lock:
+            self.sequence[0] += 1
+            self.values[start:start + len(values)] = values
+            self.sequence[0] += 1
+
+    def reset(self):
+        self.setValues(self.address, [self.default_value] * len(self.values))
+
+
+class SharedStore:
+    """
+    One shared memory segment holding `blocks` data blocks of `size` 16-bit
+    values, each preceded by its sequence number. Without a name a new
+    segment is created; with the name (and lock) of an existing store, from
+    spec(), another process attaches to it.
+    """
+
+    def __init__(self, blocks, size, name=None, lock=None):
+        self.blocks = blocks
+        self.size = size
+        # Sequence numbers stay 8-byte aligned
+        self.stride = SEQUENCE_BYTES + (2 * size + 7) // 8 * 8
+        self.created = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.created, size=blocks * self.stride)
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        self.views = []
+
+    def spec(self):
+        """
+        SharedStore arguments that attach another process to this store
+        """
+        return (self.blocks, self.size, self.memory.name, self.lock)
+
+    def block(self, index, values=None, address=0x00):
+        """
+        Data block number index. values initialize it, unless the store was
+        attached to, in which case it keeps what its creator wrote.
+        """
+        if not 0 <= index < self.blocks:
+            raise IndexError(f"Block {index} outside store of {self.blocks} blocks")
+        offset = index * self.stride
+        sequence = self.memory.buf[offset:offset + SEQUENCE_BYTES].cast('Q')
+        registers = self.memory.buf[offset + SEQUENCE_BYTES:offset + SEQUENCE_BYTES + 2 * self.size].cast('H')
+        self.views += [sequence, registers]
+        block = SharedDataBlock(self, sequence, registers, address)
+        if values is not None and self.created:
+            block.setValues(address, list(values))
+        return block
+
+    def close(self):
+        """
+        Unmap the segment in this process. Its blocks must not be used after.
+        """
+        # The segment cannot be unmapped while views into it remain
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Remove the segment once every process is done with it; only the
+        creating process does so
+        """
+        if self.created:
+            self.memory.unlink()
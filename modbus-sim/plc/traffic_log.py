@@ -0,0 +1,151 @@
+"""
+Aloha Water Treatment Plant Modbus Traffic Log
+Compact binary capture of every request and response the PLC serves, plus
+the final process state, for replay against a fresh PLC
+"""
+
+import copy
+import itertools
+import struct
+import threading
+import time
+from collections import namedtuple
+
+MAGIC = b"AWTMBTL2"
+
+# time (Unix seconds), kind, connection, unit ID, function code, transaction ID, payload length
+RECORD = struct.Struct("<dBIBBHH")
+
+KIND_REQUEST = 0
+KIND_RESPONSE = 1
+KIND_STATE = 2
+
+# Register count prefix of each block in a state payload
+COUNT = struct.Struct("<H")
+
+Record = namedtuple("Record", "time kind connection unit function transaction payload")
+
+# The process state as read back over Modbus; coils are stored one per register
+STATE_BLOCKS = ('coils', 'holding_registers', 'input_registers')
+
+
+def encode_state(state):
+    """
+    Pack a block name -> [values] dict of STATE_BLOCKS into a state payload
+    """
+    payload = b""
+    for name in STATE_BLOCKS:
+        values = [int(value) & 0xFFFF for value in state[name]]
+        payload += COUNT.pack(len(values)) + struct.pack(f"<{len(values)}H", *values)
+    return payload
+
+
+def decode_state(payload):
+    state = {}
+    offset = 0
+    for name in STATE_BLOCKS:
+        (count,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        state[name] = list(struct.unpack_from(f"<{count}H", payload, offset))
+        offset += 2 * count
+    return state
+
+
+def encode_pdu(pdu):
+    """
+    Payload of pdu, leaving pdu untouched: pymodbus pads a PDU's bit list to
+    whole bytes while encoding it, which would make the server write extra
+    coils for a traced write-multiple-coils request
+    """
+    pdu = copy.copy(pdu)
+    pdu.bits = list(pdu.bits)
+    return pdu.encode()
+
+
+class TrafficRecorder:
+    """
+    Appends records to a traffic log. attach() hooks it into a pymodbus
+    server, which then hands it each decoded request and response on the
+    server's event loop, so it only packs the record into a buffered file;
+    the buffer is written out as it fills and on close().
+
+    Every client numbers its transactions from 1, so each record also
+    carries the number of the connection it came in on, which is what tells
+    apart the requests of concurrent clients.
+    """
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.file = open(path, "wb", buffering=buffer_size)
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.connections = itertools.count(1)
+
+    def write(self, kind, connection, unit, function, transaction, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        header = RECORD.pack(
+            timestamp, kind, connection, unit & 0xFF, function & 0xFF, transaction & 0xFFFF, len(payload)
+        )
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(header + payload)
+            self.records += 1
+
+    def attach(self, server):
+        """
+        Record the traffic of every connection server accepts from now on.
+        The server's own trace_pdu, if any, still sees every PDU.
+        """
+        new_connection = server.callback_new_connection
+
+        def callback_new_connection():
+            handler = new_connection()
+            connection = next(self.connections)
+            trace_pdu = handler.trace_pdu
+
+            def trace(sending, pdu):
+                self.trace_pdu(connection, sending, pdu)
+                return trace_pdu(sending, pdu)
+
+            handler.trace_pdu = trace
+            return handler
+
+        server.callback_new_connection = callback_new_connection
+
+    def trace_pdu(self, connection, sending, pdu):
+        kind = KIND_RESPONSE if sending else KIND_REQUEST
+        try:
+            payload = encode_pdu(pdu)
+        except Exception:
+            payload = b""
+        self.write(kind, connection, pdu.dev_id, pdu.function_code, pdu.transaction_id, payload)
+        return pdu
+
+    def record_state(self, unit, state):
+        self.write(KIND_STATE, 0, unit, 0, 0, encode_state(state))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_log(path):
+    """
+    Yield the records of a traffic log in order, stopping quietly at a
+    record cut short by a crash
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a Modbus traffic log")
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(data):
+        timestamp, kind, connection, unit, function, transaction, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            break
+        yield Record(timestamp, kind, connection, unit, function, transaction, data[offset:offset + length])
+        offset += length
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Aloha Water Treatment Plant Modbus Replay
+Re-issues the requests of a traffic log captured with TRAFFIC_LOG against a
+fresh PLC, one client per captured connection, and diffs the responses and
+final process state
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter, defaultdict, deque
+
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ModbusException
+from pymodbus.pdu import DecodePDU
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "modbus-sim", "plc"))
+from traffic_log import (
+    KIND_REQUEST, KIND_RESPONSE, KIND_STATE, STATE_BLOCKS, read_log, decode_state
+)
+
+REQUEST_TIMEOUT = 2.0
+
+
+def parse_speed(value):
+    if value == "max":
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def split_log(records):
+    """
+    Requests in capture order, the captured response to each (None if the
+    capture has none) and the last captured state of each unit. A response
+    answers the oldest unanswered request with its connection, unit and
+    transaction ID; transaction IDs wrap on long-lived connections.
+    """
+    requests = []
+    responses = []
+    states = {}
+    pending = defaultdict(deque)
+    for record in records:
+        key = (record.connection, record.unit, record.transaction)
+        if record.kind == KIND_REQUEST:
+            pending[key].append(len(requests))
+            requests.append(record)
+            responses.append(None)
+        elif record.kind == KIND_RESPONSE:
+            if pending[key]:
+                responses[pending[key].popleft()] = record
+        elif record.kind == KIND_STATE:
+            states[record.unit] = decode_state(record.payload)
+    return requests, responses, states
+
+
+async def read_state(client, unit, counts):
+    coils = await client.read_coils(0, count=counts['coils'], device_id=unit)
+    holding = await client.read_holding_registers(0, count=counts['holding_registers'], device_id=unit)
+    inputs = await client.read_input_registers(0, count=counts['input_registers'], device_id=unit)
+    return {
+        'coils': [int(bit) for bit in coils.bits[:counts['coils']]],
+        'holding_registers': list(holding.registers),
+        'input_registers': list(inputs.registers),
+    }
+
+
+def response_fields(function, payload):
+    """
+    What a response says, decoded, so encodings that differ only in padding
+    compare equal
+    """
+    pdu = DecodePDU(is_server=False).decode(bytes([function]) + payload)
+    if pdu is None:
+        return (function, payload)
+    return (
+        pdu.function_code, pdu.address, pdu.count, list(pdu.bits), list(pdu.registers),
+        getattr(pdu, 'exception_code', None)
+    )
+
+
+class Replay:
+    """
+    Replays the requests of each captured connection on a connection of its
+    own, opened when its first request is due, so concurrent clients stay
+    concurrent. Results are tallied per function code.
+    """
+
+    def __init__(self, host, port, speed):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.decoder = DecodePDU(is_server=True)
+        self.sent = Counter()
+        self.differing = Counter()
+        self.failed = Counter()
+        self.latencies = []
+
+    async def wait_until(self, captured):
+        if self.speed:
+            delay = self.started + (captured - self.first) / self.speed - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def run(self, sessions):
+        self.loop = asyncio.get_running_loop()
+        self.first = min(session[0][0].time for session in sessions)
+        self.started = self.loop.time()
+        await asyncio.gather(*(self.session(session) for session in sessions))
+        return self.loop.time() - self.started
+
+    async def session(self, exchanges):
+        await self.wait_until(exchanges[0][0].time)
+        client = AsyncModbusTcpClient(self.host, port=self.port, timeout=REQUEST_TIMEOUT, retries=0, reconnect_delay=0)
+        if not await client.connect():
+            for record, _ in exchanges:
+                self.failed[record.function] += 1
+            return
+        try:
+            for record, response in exchanges:
+                await self.wait_until(record.time)
+                await self.exchange(client, record, response)
+        finally:
+            client.close()
+
+    async def exchange(self, client, record, response):
+        request = self.decoder.decode(bytes([record.function]) + record.payload)
+        if request is None:
+            self.failed[record.function] += 1
+            return
+        request.dev_id = record.unit
+
+        self.sent[record.function] += 1
+        before = time.perf_counter()
+        try:
+            result = await client.execute(False, request)
+        except (ModbusException, OSError, asyncio.TimeoutError):
+            self.failed[record.function] += 1
+            return
+        self.latencies.append(time.perf_counter() - before)
+
+        if response is not None:
+            replayed = response_fields(result.function_code, result.encode())
+            if replayed != response_fields(response.function, response.payload):
+                self.differing[record.function] += 1
+
+
+async def replay(path, host, port, speed, settle):
+    requests, captured, states = split_log(read_log(path))
+    if not requests:
+        print(f"{path} holds no requests")
+        return 0
+
+    sessions = defaultdict(list)
+    for record, response in zip(requests, captured):
+        sessions[record.connection].append((record, response))
+
+    run = Replay(host, port, speed)
+    elapsed = await run.run(list(sessions.values()))
+    sent = sum(run.sent.values())
+    if not sent and run.failed:
+        raise ConnectionError(f"PLC {host}:{port} unreachable")
+
+    captured_span = requests[-1].time - requests[0].time
+    print(f"Replayed {sent} requests over {len(sessions)} connections in {elapsed:.2f}s "
+          f"(captured over {captured_span:.2f}s, {sent / max(elapsed, 1e-9):.0f} req/s)")
+    latencies = sorted(run.latencies)
+    if latencies:
+        print(f"Latency p50 {latencies[len(latencies) // 2] * 1e3:.2f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} ms")
+    print("Function  Sent  Different response  Failed")
+    for function in sorted(set(run.sent) | set(run.failed)):
+        print(f"{function:8d}  {run.sent[function]:4d}  {run.differing[function]:18d}  {run.failed[function]:6d}")
+
+    if not states:
+        print("The log holds no final state to compare")
+        return 0
+
+    client = AsyncModbusTcpClient(host, port=port, timeout=REQUEST_TIMEOUT, retries=0, reconnect_delay=0)
+    if not await client.connect():
+        raise ConnectionError(f"PLC {host}:{port} unreachable")
+    # Let the PLC scan the last writes before reading where it ended up
+    await asyncio.sleep(settle)
+    differences = 0
+    for unit, expected in sorted(states.items()):
+        counts = {name: len(expected[name]) for name in STATE_BLOCKS}
+        actual = await read_state(client, unit, counts)
+        for name in STATE_BLOCKS:
+            for address, (want, got) in enumerate(zip(expected[name], actual[name])):
+                if want != got:
+                    differences += 1
+                    print(f"unit {unit} {name}[{address}]: captured {want}, replay {got}")
+    client.close()
+    print("Final state matches the capture" if not differences else f"{differences} state values differ")
+    return 1 if differences else 0
+
+
+def list_log(path):
+    names = {KIND_REQUEST: "request", KIND_RESPONSE: "response", KIND_STATE: "state"}
+    for record in read_log(path):
+        print(f"{record.time:.6f} {names.get(record.kind, record.kind):8s} "
+              f"conn {record.connection:4d} unit {record.unit:3d} fc {record.function:3d} tid {record.transaction:5d} {record.payload.hex()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured Modbus traffic log against a PLC")
+    parser.add_argument("log", help="traffic log written by the PLC with TRAFFIC_LOG set")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="multiple of the captured pace, or 'max' for as fast as possible (default 1)")
+    parser.add_argument("--settle", type=float, default=1.0,
+                        help="seconds to wait after the last request before reading the final state")
+    parser.add_argument("--list", action="store_true", help="print the log instead of replaying it")
+    args = parser.parse_args()
+
+    if args.list:
+        list_log(args.log)
+        return
+    sys.exit(asyncio.run(replay(args.log, args.host, args.port, args.speed, args.settle)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,34 @@
 #!/usr/bin/env python3
+import argparse
+import ipaddress
+import json
+import signal
 import sys
 import os
 import subprocess
-import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "common"))
+from launcher import Component, Supervisor, port_ready, http_ready, bacnet_ready, all_ready, wait_for
+from fleet import FleetMonitor, Worker, shard, UNIT_ID_MAX
+
+# HMI_MODE=async runs the asyncio Modbus HMI instead of the threaded one
+MODBUS_HMI = "HMI_async.py" if os.getenv("HMI_MODE") == "async" else "HMI.py"
+
+BACNET_DEVICE_ID = 1001
+DEFAULT_GROUP = {
+    'protocol': 'modbus',
+    'count': 1,
+    'plants': None,
+    'host': None,
+    'port': 5020,
+    'ip': '127.0.0.1',
+    'hmi_port': 8090,
+    'metrics_port': 0,
+    'plc': True,
+    'hmi': None,
+    'hmi_mode': None,
+    'env': {},
+}
 
 def run_modbus_local():
     port = input("\nEnter port to run on [5020]: ").strip() or "5020"
@@ -12,10 +38,14 @@ def run_modbus_local():
     
     print("Starting PLC...")
     plc = subprocess.Popen([sys.executable, "plc.py"], cwd=os.path.join("modbus-sim", "plc"), env=env)
-    time.sleep(2)
+    if not wait_for(port_ready("127.0.0.1", int(port)), process=plc):
+        print("PLC did not start")
+        plc.terminate()
+        plc.wait()
+        return
     print("Starting HMI...")
     try:
-        subprocess.run([sys.executable, "HMI.py"], cwd=os.path.join("modbus-sim", "hmi"), env=env)
+        subprocess.run([sys.executable, MODBUS_HMI], cwd=os.path.join("modbus-sim", "hmi"), env=env)
     except KeyboardInterrupt:
         pass
     finally:
@@ -39,7 +69,7 @@ def run_modbus_distributed():
         port = input("Port of PLC [5020]: ").strip() or "5020"
         env["MODBUS_HOST"] = ip
         env["MODBUS_PORT"] = port
-        subprocess.run([sys.executable, "HMI.py"], cwd=os.path.join("modbus-sim", "hmi"), env=env)
+        subprocess.run([sys.executable, MODBUS_HMI], cwd=os.path.join("modbus-sim", "hmi"), env=env)
 
 def run_bacnet_distributed():
     print("\nRun component:\n1. PLC (server)\n2. HMI (web interface)")
@@ -68,6 +98,217 @@ def run_modbus():
 def run_bacnet():
     run_bacnet_distributed()
 
+def probe_host(host):
+    # A wildcard bind address is reached on loopback
+    return "127.0.0.1" if host in (None, "0.0.0.0", "") else host
+
+def modbus_components(group):
+    components = []
+    hmi_script = "HMI_async.py" if group['hmi_mode'] == "async" else MODBUS_HMI
+    plant_counts = shard(group['plants'], group['count']) if group['plants'] else None
+    for i in range(group['count']):
+        port = group['port'] + i
+        metrics_port = group['metrics_port'] + i if group['metrics_port'] else 0
+        env = dict(group['env'], MODBUS_PORT=port)
+        if group['host']:
+            env['MODBUS_HOST'] = group['host']
+        plc_env = dict(env, METRICS_PORT=metrics_port)
+        if plant_counts:
+            plc_env['PLANT_COUNT'] = plant_counts[i]
+        plc = Component(
+            f"modbus-plc-{port}",
+            os.path.join("modbus-sim", "plc"),
+            "plc.py" if group['plc'] else None,
+            plc_env,
+            port_ready(probe_host(group['host']), port)
+        )
+        components.append(plc)
+        if group['hmi']:
+            hmi_port = group['hmi_port'] + i
+            components.append(Component(
+                f"modbus-hmi-{hmi_port}",
+                os.path.join("modbus-sim", "hmi"),
+                hmi_script,
+                dict(env, MODBUS_HOST=probe_host(group['host']), FLASK_PORT=hmi_port),
+                http_ready(f"http://127.0.0.1:{hmi_port}/ready"),
+                depends=[plc]
+            ))
+    return components
+
+def bacnet_components(group):
+    components = []
+    first = ipaddress.ip_address(group['ip'])
+    for i in range(group['count']):
+        ip = str(first + i)
+        metrics_port = group['metrics_port'] + i if group['metrics_port'] else 0
+        plc = Component(
+            f"bacnet-plc-{ip}",
+            os.path.join("bacnet-sim", "plc"),
+            "plc.py" if group['plc'] else None,
+            dict(group['env'], BACNET_IP=f"{ip}/24", METRICS_PORT=metrics_port),
+            bacnet_ready(ip, BACNET_DEVICE_ID)
+        )
+        components.append(plc)
+        if group['hmi']:
+            hmi_port = group['hmi_port'] + i
+            # Every HMI binds a BACnet port of its own; UDP, so reusing the
+            # number of its TCP web port cannot clash with anything. Next to
+            # a local PLC it shares the PLC's address, which is known to work.
+            env = dict(group['env'], DEVICE_IP=ip, FLASK_PORT=hmi_port, BACNET_LOCAL_PORT=hmi_port)
+            if group['plc']:
+                env['BACNET_LOCAL_IP'] = f"{ip}/24"
+            components.append(Component(
+                f"bacnet-hmi-{hmi_port}",
+                os.path.join("bacnet-sim", "hmi"),
+                "HMI.py",
+                env,
+                http_ready(f"http://127.0.0.1:{hmi_port}/ready"),
+                depends=[plc]
+            ))
+    return components
+
+def dual_components(group):
+    components = []
+    first = ipaddress.ip_address(group['ip'])
+    hmi_script = "HMI_async.py" if group['hmi_mode'] == "async" else MODBUS_HMI
+    for i in range(group['count']):
+        port = group['port'] + i
+        ip = str(first + i)
+        metrics_port = group['metrics_port'] + i if group['metrics_port'] else 0
+        env = dict(group['env'], MODBUS_PORT=port)
+        if group['host']:
+            env['MODBUS_HOST'] = group['host']
+        plc = Component(
+            f"dual-plc-{port}",
+            os.path.join("dual-sim", "plc"),
+            "plc.py" if group['plc'] else None,
+            dict(env, BACNET_IP=f"{ip}/24", METRICS_PORT=metrics_port),
+            all_ready(port_ready(probe_host(group['host']), port), bacnet_ready(ip, BACNET_DEVICE_ID))
+        )
+        components.append(plc)
+        if group['hmi']:
+            # The Modbus HMI; a BACnet HMI can be pointed at the same PLC separately
+            hmi_port = group['hmi_port'] + i
+            components.append(Component(
+                f"modbus-hmi-{hmi_port}",
+                os.path.join("modbus-sim", "hmi"),
+                hmi_script,
+                dict(env, MODBUS_HOST=probe_host(group['host']), FLASK_PORT=hmi_port),
+                http_ready(f"http://127.0.0.1:{hmi_port}/ready"),
+                depends=[plc]
+            ))
+    return components
+
+def build_components(groups):
+    components = []
+    for entry in groups:
+        unknown = set(entry) - set(DEFAULT_GROUP)
+        if unknown:
+            raise ValueError(f"unknown group settings: {', '.join(sorted(unknown))}")
+        group = dict(DEFAULT_GROUP, **entry)
+        if group['plants'] and group['protocol'] != "modbus":
+            raise ValueError("plants can only be spread over Modbus PLCs")
+        if group['hmi'] is None:
+            # An HMI shows only the first plant of a fleet PLC
+            group['hmi'] = not group['plants']
+        if group['protocol'] == "modbus":
+            components += modbus_components(group)
+        elif group['protocol'] == "bacnet":
+            components += bacnet_components(group)
+        elif group['protocol'] == "dual":
+            components += dual_components(group)
+        else:
+            raise ValueError(f"unknown protocol {group['protocol']!r}")
+    return components
+
+def fleet_workers(components):
+    # Every component with a metrics port is a PLC the fleet view covers
+    workers = []
+    for component in components:
+        metrics_port = int(component.env.get('METRICS_PORT') or 0)
+        if metrics_port:
+            host = probe_host(component.env.get('MODBUS_HOST') or component.env.get('METRICS_HOST'))
+            workers.append(Worker(
+                component,
+                f"http://{host}:{metrics_port}",
+                component.env.get('MODBUS_PORT'),
+                int(component.env.get('PLANT_COUNT') or 1)
+            ))
+    return workers
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+def launch(components, log_dir=None, restart=True, fleet_port=None):
+    supervisor = Supervisor(components, log_dir, restart)
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    if fleet_port:
+        FleetMonitor(fleet_workers(components)).serve("0.0.0.0", fleet_port)
+        print(f"Fleet view on http://127.0.0.1:{fleet_port} (/health, /metrics, /state)")
+    try:
+        supervisor.start()
+        supervisor.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping...")
+        supervisor.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Start PLC and HMI instances without the menu. Instance i uses port + i, "
+                    "hmi-port + i and, for BACnet and dual, ip + i."
+    )
+    parser.add_argument("protocol", nargs="?", choices=("modbus", "bacnet", "dual"),
+                        help="dual runs PLCs that serve Modbus and BACnet from one process image")
+    parser.add_argument("-n", "--count", type=int, default=1, help="PLC/HMI pairs to start")
+    parser.add_argument("--plants", type=int,
+                        help=f"Modbus: plants to spread over the -n PLCs, at most {UNIT_ID_MAX} each (HMIs off)")
+    parser.add_argument("--host", help="Modbus/dual: PLC bind address, or the remote PLC with --no-plc")
+    parser.add_argument("--port", type=int, default=5020, help="Modbus port of the first PLC")
+    parser.add_argument("--ip", default="127.0.0.1", help="BACnet/dual: BACnet address of the first PLC")
+    parser.add_argument("--hmi-port", type=int, default=8090, help="web port of the first HMI")
+    parser.add_argument("--metrics-port", type=int, default=0, help="metrics port of the first PLC (0 = off)")
+    parser.add_argument("--plc", action=argparse.BooleanOptionalAction, default=True,
+                        help="start PLCs (--no-plc only probes them, for HMIs of remote PLCs)")
+    parser.add_argument("--hmi", action=argparse.BooleanOptionalAction,
+                        help="start HMIs (default: on unless --plants is set)")
+    parser.add_argument("--hmi-mode", choices=("threaded", "async"), help="Modbus HMI implementation")
+    parser.add_argument("-c", "--config", help="JSON file with a list of instance groups")
+    parser.add_argument("--log-dir", help="write each process's output to <log-dir>/<name>.log")
+    parser.add_argument("--no-restart", action="store_true", help="leave crashed processes down")
+    parser.add_argument("--fleet-port", type=int,
+                        help="serve /health, /metrics and /state of every PLC with a metrics port here")
+    args = parser.parse_args()
+    if not args.protocol and not args.config:
+        parser.error("give a protocol or --config")
+    return args
+
+def main_cli(args):
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        groups = config.get('groups', [])
+        log_dir = args.log_dir or config.get('log_dir')
+        restart = config.get('restart', True) and not args.no_restart
+        fleet_port = args.fleet_port or config.get('fleet_port')
+    else:
+        groups = [{
+            'protocol': args.protocol, 'count': args.count, 'plants': args.plants, 'host': args.host, 'port': args.port,
+            'ip': args.ip, 'hmi_port': args.hmi_port, 'metrics_port': args.metrics_port,
+            'plc': args.plc, 'hmi': args.hmi, 'hmi_mode': args.hmi_mode,
+        }]
+        log_dir = args.log_dir
+        restart = not args.no_restart
+        fleet_port = args.fleet_port
+    try:
+        components = build_components(groups)
+        if fleet_port and not fleet_workers(components):
+            raise ValueError("the fleet view needs PLCs with a metrics port (--metrics-port)")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    launch(components, log_dir, restart, fleet_port)
+
 def main():
     print("\nAloha Water Treatment Simulator\n\nProtocol:\n1. Modbus\n2. BACnet")
     choice = input("\nSelect protocol: ").strip()
@@ -78,7 +319,10 @@ def main():
         run_bacnet()
 
 if __name__ == "__main__":
-    try:
-        main()
-    except KeyboardInterrupt:
-        print("")
+    if len(sys.argv) > 1:
+        main_cli(parse_args())
+    else:
+        try:
+            main()
+        except KeyboardInterrupt:
+            print("")
@@ -0,0 +1,23 @@
+"""
+Aloha Water Treatment Plant Tests
+Puts the common and Modbus PLC modules on the path; the BACnet control logic
+shares its module name with the Modbus one, so it is loaded under its own
+"""
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "common"))
+sys.path.insert(0, os.path.join(ROOT, "modbus-sim", "plc"))
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bacnet_plc_logic = load_module("bacnet_plc_logic", os.path.join("bacnet-sim", "plc", "plc_logic.py"))
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from historian import Historian, capacity_for, downsample, parse_query
+
+TAGS = {'tankVolume': 'uint16', 'pumpStatus': 'bool'}
+
+
+def sample(volume, pump):
+    return {'tankVolume': volume, 'pumpStatus': pump}
+
+
+def test_downsample_buckets():
+    times = np.arange(10, dtype=np.float64)
+    values = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
+    bucket_times, summaries = downsample(times, {'v': values}, 3)
+    assert bucket_times == [1.0, 4.0, 7.5]
+    assert summaries['v'] == {'min': [1.0, 4.0, 7.0], 'max': [3.0, 6.0, 10.0], 'mean': [2.0, 5.0, 8.5]}
+
+
+def test_downsample_keeps_short_series_and_empty_ones():
+    bucket_times, summaries = downsample(np.array([1.0, 2.0]), {'v': np.array([3, 4])}, 500)
+    assert bucket_times == [1.0, 2.0]
+    assert summaries['v']['mean'] == [3.0, 4.0]
+    assert downsample(np.array([]), {'v': np.array([])}, 10) == ([], {'v': {'min': [], 'max': [], 'mean': []}})
+
+
+def test_ring_overwrites_the_oldest_samples():
+    historian = Historian(TAGS, capacity=5)
+    for index in range(8):
+        historian.record(sample(100 + index, index % 3 == 0), timestamp=1000.0 + index)
+    assert len(historian) == 5
+
+    result = historian.query(points=10)
+    assert result['samples'] == 5
+    assert result['time'] == [1003.0, 1004.0, 1005.0, 1006.0, 1007.0]
+    assert result['tags']['tankVolume']['mean'] == [103.0, 104.0, 105.0, 106.0, 107.0]
+    assert result['tags']['pumpStatus']['max'] == [1.0, 0.0, 0.0, 1.0, 0.0]
+
+
+def test_range_query_across_the_wrap():
+    historian = Historian(TAGS, capacity=4)
+    for index in range(6):
+        historian.record(sample(index, False), timestamp=2000.0 + index)
+    result = historian.query(start=2003.0, end=2004.5)
+    assert result['time'] == [2003.0, 2004.0]
+    assert historian.query(end=1999.0)['samples'] == 0
+
+
+def test_record_needs_every_tag_and_clamps():
+    historian = Historian(TAGS, capacity=3)
+    assert not historian.record(sample(None, True), timestamp=1.0)
+    assert historian.record(sample(70000, True), timestamp=1.0)
+    assert historian.query()['tags']['tankVolume']['max'] == [65535.0]
+
+
+def test_times_stay_sorted_when_the_clock_steps_back():
+    historian = Historian(TAGS, capacity=3)
+    historian.record(sample(1, False), timestamp=10.0)
+    historian.record(sample(2, False), timestamp=9.0)
+    assert historian.query()['time'] == [10.0, 10.0]
+
+
+def test_capacity_for_interval():
+    assert capacity_for(0.5) == 1209600
+    assert capacity_for(1.0, span=60) == 60
+    assert capacity_for(1000.0, span=1) == 1
+
+
+def test_parse_query():
+    assert parse_query({'tags': 'tankVolume', 'start': '5', 'points': '20'}, TAGS) == {
+        'tags': ['tankVolume'], 'start': 5.0, 'points': 20
+    }
+    for args in ({'tags': 'level'}, {'end': 'soon'}, {'points': '0'}):
+        with pytest.raises(ValueError):
+            parse_query(args, TAGS)
@@ -0,0 +1,55 @@
+import io
+
+import numpy as np
+
+from history_store import HistoryWriter, HistoryStore
+from plant_engine import PlantEngine
+
+
+def write_scans(directory, count, start=100.0):
+    engine = PlantEngine(2)
+    engine.switch[:] = [True, False]
+    engine.level[:] = [4000.0, 2500.0]
+    writer = HistoryWriter(str(directory), 2, batch_size=4)
+    for scan in range(count):
+        engine.step(1.0)
+        writer.append(start + scan, engine)
+    writer.close()
+    return engine
+
+
+def test_written_scans_read_back(tmp_path):
+    write_scans(tmp_path, 10)
+    store = HistoryStore(str(tmp_path))
+    assert len(store) == 10
+    fields = store.fields(plant=0)
+    assert fields['time'].tolist() == [100.0 + scan for scan in range(10)]
+    assert fields['tankVolume'].tolist() == [4040 + 40 * scan for scan in range(10)]
+    assert fields['pumpStatus'].tolist() == [1] * 10
+    assert store.fields(plant=1)['tankVolume'].tolist() == [2500] * 10
+
+
+def test_range_is_inclusive(tmp_path):
+    write_scans(tmp_path, 10)
+    store = HistoryStore(str(tmp_path))
+    assert store.range(102.0, 104.0) == (2, 5)
+    assert store.range(200.0) == (10, 10)
+    assert len(store.query(103.5, 105.0)['time']) == 2
+
+
+def test_reopening_continues_the_history(tmp_path):
+    write_scans(tmp_path, 3)
+    write_scans(tmp_path, 3, start=50.0)
+    store = HistoryStore(str(tmp_path))
+    # Times never go backwards, so the second run is held at the last time
+    assert store.columns['time'].tolist() == [100.0, 101.0, 102.0, 102.0, 102.0, 102.0]
+
+
+def test_csv_export(tmp_path):
+    write_scans(tmp_path, 2)
+    out = io.StringIO()
+    HistoryStore(str(tmp_path)).export_csv(out, plants=[1])
+    rows = out.getvalue().splitlines()
+    assert rows[0].startswith("plant,time,tankVolume")
+    assert len(rows) == 3
+    assert np.all([row.startswith("1,") for row in rows[1:]])
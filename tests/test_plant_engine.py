@@ -0,0 +1,197 @@
+import itertools
+
+import numpy as np
+import pytest
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+from conftest import bacnet_plc_logic
+from plant_engine import PlantEngine, TANK_MAX
+from plc_logic import (
+    plc_logic, REGISTER_COUNT, HR_LEVEL, HR_IN_FLOW, HR_OUT_FLOW, HR_ALARM, HR_PUMP, HR_IN_VALVE, HR_OUT_VALVE,
+    COIL_ESTOP, COIL_SWITCH, COIL_AUTO, COIL_LOW_LEVEL_ALARM, COIL_OPERATOR_ERROR_ALARM,
+)
+from process_image import ProcessImage
+
+LEVELS = (0, 40, 500, 1000, 1001, 1050, 3000, 5000, 6166, 6666, 7166, 7167, 8999, 9000, 9960, 10000)
+FLOWS = (0, 30, 200)
+SWITCHES = (False, True)
+
+
+def reference_scan(level, estop, switch, manual, in_flow, out_flow, alarm):
+    """
+    One scan of the original scalar Modbus control law with dt = 1, for
+    checking the vectorized engine against
+    """
+    requested_in_flow, requested_out_flow = in_flow, out_flow
+    target_volume = int(2 / 3 * TANK_MAX)
+    pump = in_valve = out_valve = False
+    if switch and not estop:
+        pump = in_valve = out_valve = True
+        if not manual:
+            out_flow = 50
+            if level <= 1000:
+                out_flow = 0
+                out_valve = False
+            if level < target_volume:
+                deficit = target_volume - level
+                if deficit > 3000:
+                    in_flow = 130
+                elif deficit > 1500:
+                    in_flow = 90
+                elif deficit > 500:
+                    in_flow = 70
+                else:
+                    in_flow = 50
+            else:
+                in_flow = 0 if level > target_volume + 500 else 50
+    else:
+        in_flow = out_flow = 0
+
+    if pump:
+        volume = level + (in_flow - out_flow)
+        if volume < 0:
+            volume = 0
+        elif volume > TANK_MAX:
+            alarm = True
+            volume = TANK_MAX
+            if not manual:
+                in_flow = 0
+        elif volume < TANK_MAX:
+            alarm = False
+    else:
+        volume = level
+
+    operator_error = manual and (
+        (volume <= 1000 and requested_out_flow > 0) or (volume >= 9000 and requested_in_flow > 0)
+    )
+    return {
+        'level': volume, 'in_flow': in_flow, 'out_flow': out_flow, 'pump': pump, 'in_valve': in_valve,
+        'out_valve': out_valve, 'overflow_alarm': alarm, 'low_level_alarm': volume <= 1000 and out_flow > 0,
+        'operator_error_alarm': operator_error,
+    }
+
+
+def test_engine_matches_the_scalar_control_law():
+    cases = list(itertools.product(LEVELS, SWITCHES, SWITCHES, SWITCHES, FLOWS, FLOWS, SWITCHES))
+    engine = PlantEngine(len(cases))
+    for field, values in zip(
+        ('level', 'estop', 'switch', 'manual', 'in_flow', 'out_flow', 'overflow_alarm'), zip(*cases)
+    ):
+        getattr(engine, field)[:] = values
+
+    engine.step(1.0)
+
+    for index, case in enumerate(cases):
+        expected = reference_scan(*case)
+        actual = {field: getattr(engine, field)[index].item() for field in expected}
+        assert actual == expected, f"level, estop, switch, manual, in, out, alarm = {case}"
+
+
+def test_level_change_scales_with_dt():
+    engine = PlantEngine(1)
+    engine.level[:] = 5000.0
+    engine.switch[:] = True
+    engine.manual[:] = True
+    engine.in_flow[:] = 30
+    engine.step(0.25)
+    assert engine.level[0] == pytest.approx(5007.5)
+    engine.step(0.4)
+    assert engine.level[0] == pytest.approx(5019.5)
+
+
+def modbus_plant():
+    blocks = [ModbusSequentialDataBlock(0x00, [0] * (REGISTER_COUNT + 1)) for _ in range(4)]
+    discrete_inputs, coils, holding_registers, input_registers = blocks
+    return ProcessImage(discrete_inputs, coils, holding_registers, input_registers, REGISTER_COUNT)
+
+
+def modbus_scan(image, engine, inputs):
+    image.load()
+    image.coils[COIL_ESTOP] = int(inputs['emergencyStop'])
+    image.coils[COIL_SWITCH] = int(inputs['pumpSwitch'])
+    image.coils[COIL_AUTO] = int(inputs['autoMode'])
+    if 'inflowRate' in inputs:
+        image.holding_registers[HR_IN_FLOW] = inputs['inflowRate']
+        image.holding_registers[HR_OUT_FLOW] = inputs['outflowRate']
+    plc_logic([image], engine)
+    image.flush()
+    hr, co = image.holding_registers, image.coils
+    return {
+        'tankLevel': hr[HR_LEVEL], 'inflowRate': hr[HR_IN_FLOW], 'outflowRate': hr[HR_OUT_FLOW],
+        'pumpStatus': bool(hr[HR_PUMP]), 'inflowValve': bool(hr[HR_IN_VALVE]),
+        'outflowValve': bool(hr[HR_OUT_VALVE]), 'overflowAlarm': bool(hr[HR_ALARM]),
+        'lowLevelAlarm': bool(co[COIL_LOW_LEVEL_ALARM]), 'operatorErrorAlarm': bool(co[COIL_OPERATOR_ERROR_ALARM]),
+    }
+
+
+def bacnet_scan(shadow, engine, inputs):
+    shadow.update(inputs)
+    bacnet_plc_logic.plc_logic(shadow, engine)
+    return {key: shadow[key] for key in (
+        'tankLevel', 'inflowRate', 'outflowRate', 'pumpStatus', 'inflowValve', 'outflowValve',
+        'overflowAlarm', 'lowLevelAlarm', 'operatorErrorAlarm',
+    )}
+
+
+@pytest.mark.parametrize("level", (0, 900, 6000, 9500, 9990))
+def test_bacnet_and_modbus_front_ends_agree(level):
+    # Operator actions per scan; flow rates are only written when given
+    script = [
+        {'emergencyStop': False, 'pumpSwitch': True, 'autoMode': False},
+        {'emergencyStop': False, 'pumpSwitch': True, 'autoMode': True, 'inflowRate': 200, 'outflowRate': 0},
+        {'emergencyStop': False, 'pumpSwitch': True, 'autoMode': True},
+        {'emergencyStop': False, 'pumpSwitch': True, 'autoMode': True, 'inflowRate': 0, 'outflowRate': 120},
+        {'emergencyStop': True, 'pumpSwitch': True, 'autoMode': True, 'inflowRate': 40, 'outflowRate': 60},
+        {'emergencyStop': False, 'pumpSwitch': False, 'autoMode': True},
+        {'emergencyStop': False, 'pumpSwitch': True, 'autoMode': False},
+    ]
+
+    image = modbus_plant()
+    image.load()
+    image.holding_registers[HR_LEVEL] = level
+    image.flush()
+    shadow = {
+        'tankLevel': level, 'emergencyStop': False, 'pumpSwitch': False, 'autoMode': False, 'inflowRate': 0,
+        'outflowRate': 0, 'overflowAlarm': False, 'pumpStatus': False, 'inflowValve': False,
+        'outflowValve': False, 'lowLevelAlarm': False, 'operatorErrorAlarm': False,
+    }
+    modbus_engine, bacnet_engine = PlantEngine(1), PlantEngine(1)
+
+    for step, inputs in enumerate(script * 5):
+        assert bacnet_scan(shadow, bacnet_engine, inputs) == modbus_scan(image, modbus_engine, inputs), \
+            f"scan {step}"
+
+
+@pytest.mark.parametrize("level, in_flow, out_flow", ((500, 0, 70), (9500, 40, 0)))
+def test_operator_error_alarm_uses_the_requested_rates(level, in_flow, out_flow):
+    # Manual mode with the pump switched off: nothing flows, but the request
+    # itself is the operator error on both front ends, as on the Modbus PLC
+    # before the shared engine
+    inputs = {'emergencyStop': False, 'pumpSwitch': False, 'autoMode': True,
+              'inflowRate': in_flow, 'outflowRate': out_flow}
+    image = modbus_plant()
+    image.load()
+    image.holding_registers[HR_LEVEL] = level
+    image.flush()
+    shadow = {'tankLevel': level, 'overflowAlarm': False}
+
+    modbus = modbus_scan(image, PlantEngine(1), inputs)
+    bacnet = bacnet_scan(shadow, PlantEngine(1), inputs)
+    assert modbus['operatorErrorAlarm'] and bacnet['operatorErrorAlarm']
+    assert modbus['inflowRate'] == bacnet['inflowRate'] == 0
+    assert modbus['outflowRate'] == bacnet['outflowRate'] == 0
+
+
+def test_plants_are_independent():
+    images = [modbus_plant() for _ in range(3)]
+    for index, image in enumerate(images):
+        image.load()
+        image.holding_registers[HR_LEVEL] = 2000 * (index + 1)
+        image.coils[COIL_SWITCH] = int(index != 1)
+        image.flush()
+        image.load()
+    engine = PlantEngine(3)
+    plc_logic(images, engine)
+    levels = [image.holding_registers[HR_LEVEL] for image in images]
+    assert levels == [2000 + 130 - 50, 4000, 6000 + 70 - 50]
+    assert np.array_equal(engine.pump, [True, False, True])
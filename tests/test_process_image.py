@@ -0,0 +1,42 @@
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+from process_image import BlockImage
+
+
+class CountingBlock(ModbusSequentialDataBlock):
+    def __init__(self, values):
+        super().__init__(0x00, values)
+        self.writes = []
+
+    def setValues(self, address, values):
+        self.writes.append((address, list(values)))
+        super().setValues(address, values)
+
+
+def test_flush_writes_only_changed_runs():
+    block = CountingBlock([0] * 11)
+    image = BlockImage(block, 10)
+    image.load()
+    image[0] = 1
+    image[1] = 2
+    image[5] = 3
+    image[9] = 4
+    assert image.dirty_ranges() == [(0, 2), (5, 6), (9, 10)]
+    assert image.flush() == 3
+    assert block.writes == [(1, [1, 2]), (6, [3]), (10, [4])]
+    assert block.getValues(1, 10) == [1, 2, 0, 0, 0, 3, 0, 0, 0, 4]
+
+
+def test_unchanged_image_writes_nothing():
+    block = CountingBlock([0] + list(range(10)))
+    image = BlockImage(block, 10)
+    image.load()
+    image[3] = image[3]
+    assert image.flush() == 0
+    assert block.writes == []
+
+
+def test_short_block_truncates_the_image():
+    image = BlockImage(ModbusSequentialDataBlock(0x00, [0] * 6), 10)
+    image.load()
+    assert len(image) == 5
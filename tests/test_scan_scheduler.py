@@ -0,0 +1,82 @@
+import pytest
+
+from scan_scheduler import ScanScheduler, VirtualClock, Histogram
+
+
+def run_scans(policy, count, overruns=None, period=0.1):
+    """
+    Run count scans on a virtual clock. overruns maps a scan number (from 1)
+    to extra seconds that scan takes. Returns the scheduler and, per scan,
+    (start time, elapsed).
+    """
+    overruns = overruns or {}
+    clock = VirtualClock()
+    scheduler = ScanScheduler(period, policy, clock=clock, sleep=clock.sleep)
+    scans = []
+
+    def scan():
+        scans.append((clock(), scheduler.elapsed))
+        clock.now += overruns.get(len(scans), 0.0)
+
+    scheduler.run(scan, lambda: len(scans) < count)
+    return scheduler, scans
+
+
+def test_scans_follow_the_period():
+    scheduler, scans = run_scans("skip", 5)
+    assert [start for start, _ in scans] == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4])
+    assert [elapsed for _, elapsed in scans] == pytest.approx([0.1] * 5)
+    assert scheduler.stats.overruns == 0
+    assert scheduler.stats.skipped == 0
+
+
+def test_skip_drops_missed_scans_and_stays_on_the_grid():
+    scheduler, scans = run_scans("skip", 6, {3: 0.35})
+    starts = [start for start, _ in scans]
+    # Scan 3 ends at 0.55, so the deadlines 0.3, 0.4 and 0.5 are dropped
+    assert starts == pytest.approx([0.0, 0.1, 0.2, 0.6, 0.7, 0.8])
+    assert scheduler.stats.overruns == 1
+    assert scheduler.stats.skipped == 3
+
+
+def test_skip_elapsed_covers_the_skipped_scans():
+    scheduler, scans = run_scans("skip", 6, {3: 0.35})
+    elapsed = [elapsed for _, elapsed in scans]
+    assert elapsed == pytest.approx([0.1, 0.1, 0.1, 0.4, 0.1, 0.1])
+    # Simulated time keeps up with the schedule
+    assert sum(elapsed) == pytest.approx(scans[-1][0] + 0.1)
+
+
+def test_catchup_runs_missed_scans_back_to_back():
+    scheduler, scans = run_scans("catchup", 8, {3: 0.35})
+    starts = [start for start, _ in scans]
+    assert starts == pytest.approx([0.0, 0.1, 0.2, 0.55, 0.55, 0.55, 0.6, 0.7])
+    assert [elapsed for _, elapsed in scans] == pytest.approx([0.1] * 8)
+    # The catch-up scans for 0.3 and 0.4 also finish after their next deadline
+    assert scheduler.stats.overruns == 3
+    assert scheduler.stats.skipped == 0
+    assert scheduler.stats.jitter.max == pytest.approx(0.25)
+
+
+def test_report_is_called_every_interval():
+    clock = VirtualClock()
+    scheduler = ScanScheduler(0.25, clock=clock, sleep=clock.sleep)
+    reports = []
+    scheduler.run(lambda: None, lambda: scheduler.stats.scans < 10, lambda stats: reports.append(stats.scans), 1.0)
+    assert reports == [4, 8]
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        ScanScheduler(0.001)
+    with pytest.raises(ValueError):
+        ScanScheduler(0.1, "later")
+
+
+def test_histogram_percentile_is_a_bucket_edge():
+    histogram = Histogram()
+    for ms in (0.2, 0.2, 0.2, 3.0):
+        histogram.record(ms / 1000.0)
+    assert histogram.percentile(0.5) == pytest.approx(0.00025)
+    assert histogram.percentile(1.0) == pytest.approx(0.005)
+    assert histogram.mean() == pytest.approx(0.0009)
@@ -0,0 +1,74 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from shared_datastore import SharedStore
+
+SIZE = 64
+WRITES = 5000
+
+
+@pytest.fixture
+def store():
+    store = SharedStore(2, SIZE)
+    yield store
+    store.close()
+    store.unlink()
+
+
+def fill(spec, writes):
+    store = SharedStore(*spec)
+    block = store.block(0)
+    for value in range(1, writes + 1):
+        block.setValues(0, [value] * SIZE)
+    store.close()
+
+
+def test_blocks_are_shared_between_attached_stores(store):
+    block = store.block(1, [7] * SIZE)
+    attached = SharedStore(*store.spec())
+    try:
+        other = attached.block(1, [0] * SIZE)
+        assert other.getValues(0, 3) == [7, 7, 7]
+        other.setValues(2, [1, 2])
+        assert block.getValues(0, 5) == [7, 7, 1, 2, 7]
+    finally:
+        attached.close()
+
+
+def test_values_past_the_end_are_dropped(store):
+    block = store.block(0, [0] * SIZE)
+    block.setValues(SIZE - 2, [1, 2, 3, 4])
+    assert block.getValues(SIZE - 3, 3) == [0, 1, 2]
+    assert block.sequence[0] == 4
+
+
+def test_reader_waits_out_a_write_in_progress(store):
+    block = store.block(0, [5] * SIZE)
+    block.sequence[0] += 1
+    result = []
+    reader = threading.Thread(target=lambda: result.append(block.getValues(0, 2)))
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive()
+    block.values[0] = 6
+    block.sequence[0] += 1
+    reader.join(1.0)
+    assert result == [[6, 5]]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_snapshots_are_never_torn(store):
+    block = store.block(0, [0] * SIZE)
+    writer = multiprocessing.get_context("fork").Process(target=fill, args=(store.spec(), WRITES))
+    writer.start()
+    reads = 0
+    while writer.is_alive() or reads == 0:
+        values = block.getValues(0, SIZE)
+        assert len(set(values)) == 1, values
+        reads += 1
+    writer.join()
+    assert writer.exitcode == 0
+    assert block.getValues(0, SIZE) == [WRITES] * SIZE
@@ -0,0 +1,45 @@
+from pymodbus.pdu.bit_message import WriteMultipleCoilsRequest
+from pymodbus.pdu.register_message import ReadHoldingRegistersRequest
+
+from traffic_log import (
+    TrafficRecorder, read_log, encode_pdu, encode_state, decode_state, KIND_REQUEST, KIND_RESPONSE, KIND_STATE,
+)
+
+
+def test_records_round_trip(tmp_path):
+    path = tmp_path / "traffic.bin"
+    recorder = TrafficRecorder(str(path))
+    request = ReadHoldingRegistersRequest(address=0, count=10, dev_id=2, transaction_id=7)
+    recorder.trace_pdu(3, False, request)
+    recorder.write(KIND_RESPONSE, 3, 2, 3, 7, b"\x02\x00\x01", timestamp=5.0)
+    recorder.record_state(2, {'coils': [1, 0], 'holding_registers': [500], 'input_registers': []})
+    recorder.close()
+
+    records = list(read_log(str(path)))
+    assert [(r.kind, r.connection, r.unit, r.function, r.transaction) for r in records] == [
+        (KIND_REQUEST, 3, 2, 3, 7), (KIND_RESPONSE, 3, 2, 3, 7), (KIND_STATE, 0, 2, 0, 0),
+    ]
+    assert records[0].payload == request.encode()
+    assert records[1].time == 5.0
+    assert decode_state(records[2].payload) == {'coils': [1, 0], 'holding_registers': [500], 'input_registers': []}
+
+
+def test_truncated_record_ends_the_log(tmp_path):
+    path = tmp_path / "traffic.bin"
+    recorder = TrafficRecorder(str(path))
+    for transaction in (1, 2):
+        recorder.write(KIND_REQUEST, 1, 1, 3, transaction, b"\x00\x00\x00\x0a")
+    recorder.close()
+    path.write_bytes(path.read_bytes()[:-2])
+    assert [record.transaction for record in read_log(str(path))] == [1]
+
+
+def test_encode_pdu_leaves_the_bits_unpadded():
+    request = WriteMultipleCoilsRequest(address=0, bits=[True, False, True])
+    assert encode_pdu(request) == b"\x00\x00\x00\x03\x01\x05"
+    assert request.bits == [True, False, True]
+
+
+def test_state_values_wrap_to_16_bits():
+    state = {'coils': [], 'holding_registers': [-1, 70000], 'input_registers': [3]}
+    assert decode_state(encode_state(state))['holding_registers'] == [0xFFFF, 70000 & 0xFFFF]